@@ -17,19 +17,26 @@ __status__ = "Prototype"
 
 # Imports.
 import hashlib
+import hmac
+import json
 import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
 from datetime import datetime, timedelta
-from functools import wraps
-import pandas as pd
+from functools import partial, wraps
 
 import jwt
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, make_response, request, stream_with_context
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 from werkzeug.http import HTTP_STATUS_CODES
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from ..controller import controller
+from .. import const
 from ..secrets import secrets
+from ..utils import cache, canonical, limiter, metrics, ratelimit, trace
 from flask_cors import CORS
 
 # Child logger.
@@ -72,28 +79,154 @@ def generate_token(uuid, exp=1):
     return token
 
 
-def throttle(f):
+# Metrics of the API (see /metrics).
+REQUEST_SECONDS = metrics.Histogram(
+    "api_request_seconds",
+    "Time to answer a request (to the first byte of streams).",
+    ("method", "route", "status"),
+)
+
+
+@app.before_request
+def request_timer():
+    """
+    Start the latency measurement and the trace of the request.
+
+    :return: None
+    """
+
+    g.request_start = time.perf_counter()
+
+    # Probes of the load balancer would push the traces of real
+    # requests out of the buffer.
+    if request.endpoint in _PROBES:
+        return
+
+    g.request_trace = ExitStack()
+    g.request_trace.enter_context(trace.trace("request", method=request.method, path=request.path))
+
+
+@app.teardown_request
+def request_trace_end(error=None):
+    """
+    Finish the trace of the request (after streamed responses ended).
+
+    :param error: The unhandled exception, if any.
+    :return: None
+    """
+
+    if "request_trace" in g:
+        g.pop("request_trace").close()
+
+
+@app.after_request
+def request_metrics(response):
+    """
+    Record the latency of the request per route and status.
+
+    :param response: The response.
+    :return: The response.
+    """
+
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(
+            time.perf_counter() - g.request_start
+        )
+
+    return response
+
+
+# Set once this process has finished its warm-up. Until then, requests
+# are answered with 503, so no request waits for the model to load.
+READY = threading.Event()
+
+# The steps of the warm-up of this process (see controller.warm_up).
+WARMUP = {}
+
+# Liveness and readiness probes, answered during the warm-up too.
+_PROBES = ("healthz", "readyz")
+
+# The warm-up thread of this process (see start_warm_up), and whether
+# the server started it at startup rather than the first request.
+_WARMUP_THREAD = None
+_WARMUP_SCHEDULED = False
+_WARMUP_LOCK = threading.Lock()
+
+
+@app.before_request
+def readiness_gate():
+    """
+    Reject requests until the startup of this process has finished.
+    If the server did not start the warm-up (e.g. flask run, plain
+    gunicorn or a serverless function importing the app), the first
+    request starts it and waits for it, at most const.WARMUP_LAZY_WAIT
+    seconds.
+
+    :return: A 503 response, or None to handle the request.
+    """
+
+    if READY.is_set():
+        return None
+
+    if not _WARMUP_SCHEDULED:
+        thread = start_warm_up(scheduled=False)
+        if request.endpoint not in _PROBES:
+            thread.join(const.WARMUP_LAZY_WAIT)
+
+    if not READY.is_set() and request.endpoint not in _PROBES:
+        response = jsonify({"error": HTTP_STATUS_CODES[503], "message": "Starting up."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+
+
+# Requests per second per client, see throttle.
+LIMITER = ratelimit.create(secrets.API_THROTTLE)
+
+
+def client_key() -> str:
+    """
+    Identify the client of the current request for rate limiting: the
+    authenticated UUID if there is one, otherwise the IP address.
+
+    :return: The client key.
+    :rtype: str
+    """
+
+    user = token_auth.current_user() or basic_auth.current_user()
+    if user:
+        return f"user:{user}"
+
+    return f"ip:{request.remote_addr}"
+
+
+def throttle(f=None, cost=None):
     """
     Decorator function to throttle API calls.
 
     :param f: The function to be throttled.
     :type f: function
+    :param cost: Function returning the number of requests the current
+        request counts as. Default: 1.
+    :type cost: function
     :return: The throttled function.
     :rtype: function
     """
 
-    last_call = None
-    time_interval = 1 / secrets.API_THROTTLE
+    if f is None:
+        return partial(throttle, cost=cost)
 
     @wraps(f)
     def wrapper(*args, **kwargs):
         """
-        The wrapper function throttles requests from the same IP address
-        to a maximum of one request per time_interval seconds. If a
-        request is made within that interval, it will return an error
-        message and HTTP status code 429 (Too Many Requests). Otherwise,
-        it will call the function f with all arguments passed to
-        wrapper.
+        The wrapper function limits the requests of each client (UUID
+        or IP address) to secrets.API_THROTTLE per second, with short
+        bursts allowed (see utils/ratelimit.py). If the client is over
+        its limit, it will return an error message and HTTP status code
+        429 (Too Many Requests) with 'Retry-After'. Otherwise, it will
+        call the function f with all arguments passed to wrapper. All
+        responses carry the 'RateLimit-*' headers.
 
         :param args: Pass a variable number of arguments to the function
         :param kwargs: Pass keyword-ed, variable-length argument list to
@@ -101,18 +234,30 @@ def throttle(f):
         :return: Wrapped function
         """
 
-        nonlocal last_call
-        now = datetime.now()
-        if last_call and now - last_call < timedelta(seconds=time_interval):
-            LOGGER.debug(f"Throttling requests from {request.remote_addr}.")
+        key = client_key()
+        allowed, headers = LIMITER.check(key, cost() if cost else 1)
 
-            return auth_error(429, "Please try again later.")
-        last_call = now
-        return f(*args, **kwargs)
+        if not allowed:
+            LOGGER.debug(f"Throttling requests from {key}.")
+            response = make_response(auth_error(429, "Please try again later."))
+        else:
+            response = make_response(f(*args, **kwargs))
+
+        response.headers.update(headers)
+        return response
 
     return wrapper
 
 
+# The password clients log in with: the SHA-256 digest of the access
+# key, computed once.
+ACCESS_KEY_DIGEST = hashlib.sha256(secrets.API_ACCESS_KEY.encode()).hexdigest().encode()
+
+# Verified tokens: SHA-256 digest of the token -> UUID, until the token
+# expires. Spares the signature check on every request.
+TOKEN_CACHE = cache.TTLCache(maxsize=const.TOKEN_CACHE_SIZE, ttl=3600)
+
+
 @basic_auth.verify_password
 def auth_password(username, password):
     """
@@ -126,7 +271,8 @@ def auth_password(username, password):
     :rtype: str
     """
 
-    if username and password == hashlib.sha256(secrets.API_ACCESS_KEY.encode()).hexdigest():
+    # Constant time, so the digest cannot be guessed from response times.
+    if username and hmac.compare_digest(password.encode(), ACCESS_KEY_DIGEST):
         return str(username)
 
 
@@ -157,12 +303,19 @@ def auth_verify(token):
     :rtype: str
     """
 
+    if not token:
+        return None
+
+    digest = hashlib.sha256(token.encode()).digest()
+    uuid = TOKEN_CACHE.get(digest)
+    if uuid is not None:
+        return uuid
+
     try:
         token_dec = jwt.decode(token, secrets.API_SECRET_KEY, algorithms=["HS256"])
 
     except Exception as e:
-        LOGGER.error(f"Could not verify token: {str(e)}.")
-        print("EXCEPTION:", str(e))
+        LOGGER.warning(f"Could not verify token: {str(e)}.")
         return None
 
     # Check if the token is expired (e.g., expires in 1 hour).
@@ -170,6 +323,9 @@ def auth_verify(token):
         # Block the request.
         return None
 
+    # Cache the token until it expires.
+    TOKEN_CACHE.set(digest, token_dec["uuid"], ttl=token_dec["exp"] - time.time())
+
     return token_dec["uuid"]
 
 
@@ -226,6 +382,132 @@ def analyze():
     # # Forward the data to the controller.
     response_data = controller.analyze(domain)
 
+    # Scan queued for the scan workers: the client polls the job.
+    if response_data.get("job"):
+        return jsonify(response_data), 202
+
+    return jsonify(response_data), 200
+
+
+def _batch_max() -> int:
+    # Every domain takes a token, so larger batches would never pass.
+    return min(const.BATCH_MAX, int(LIMITER.burst))
+
+
+def _batch_domains() -> list[str] or None:
+    # The domains of a valid batch request, otherwise None.
+    data = request.get_json(silent=True) or {}
+    domains = data.get("domains")
+
+    if (
+        not isinstance(domains, list)
+        or not all(isinstance(domain, str) and domain for domain in domains)
+        or not 0 < len(domains) <= _batch_max()
+    ):
+        return None
+
+    return domains
+
+
+def _batch_cost() -> int:
+    # One request per distinct domain, as each is looked up or scanned
+    # once. Invalid requests count once.
+    domains = _batch_domains()
+    if domains is None:
+        return 1
+
+    return len({canonical.canonical(domain) for domain in domains})
+
+
+@app.route("/analyze/batch", methods=["POST"])
+# @token_auth.login_required
+@throttle(cost=_batch_cost)
+def analyze_batch():
+    """
+    Analyze up to const.BATCH_MAX domains with one request, each domain
+    like a request of its own (see /analyze), which also counts once
+    for the rate limit. Known and stored domains are answered right
+    away, the others are queued, answered provisionally or scanned
+    concurrently. Pass "?stream=1" (or accept application/x-ndjson) to
+    receive one JSON line per domain as soon as it is finished,
+    otherwise all results are sent at once, in the order of the request.
+    """
+
+    # Extract the data from the request.
+    domains = _batch_domains()
+
+    if domains is None:
+        message = f"Expected 'domains': a list of 1 to {_batch_max()} domains."
+        return jsonify({"error": HTTP_STATUS_CODES[400], "message": message}), 400
+
+    results = controller.analyze_batch(domains)
+
+    if request.args.get("stream") or request.accept_mimetypes.best == "application/x-ndjson":
+
+        def generate():
+            for url, response_data in results:
+                yield json.dumps({"input": url, **response_data}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    answers = dict(results)
+    return jsonify({"results": [{"input": url, **answers[url]} for url in domains]}), 200
+
+
+@app.route("/analyze/stream", methods=["GET", "POST"])
+# @token_auth.login_required
+@throttle
+def analyze_stream():
+    """
+    Analyze a domain and report the progress as server-sent events, so
+    EventSource clients can show a result early: a provisional score,
+    the status of each source as the scan proceeds, and the final
+    score. The domain is passed as "?domain=" or in the JSON body.
+    """
+
+    data = request.get_json(silent=True) or {}
+
+    # Extract the data from the request.
+    domain = request.args.get("domain") or data.get("domain")
+
+    if not isinstance(domain, str) or not domain:
+        message = "Expected 'domain'."
+        return jsonify({"error": HTTP_STATUS_CODES[400], "message": message}), 400
+
+    def generate():
+        for message in controller.analyze_stream(domain):
+            if message is None:
+                # Comment line, keeps proxies from closing the connection.
+                yield ": keep-alive\n\n"
+                continue
+
+            event, response_data = message
+            yield f"event: {event}\ndata: {json.dumps(response_data, default=str)}\n\n"
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/analyze/job/<job_id>", methods=["GET"])
+# @token_auth.login_required
+@throttle
+def analyze_job(job_id):
+    """
+    Poll the result of a scan job queued by /analyze/ask (status 202).
+    Answers 202 while the job is queued or running, and 200 with the
+    score once it is done.
+    """
+
+    response_data = controller.job(job_id)
+
+    if response_data is None:
+        return jsonify({"error": HTTP_STATUS_CODES[404], "message": "Unknown job."}), 404
+
+    if response_data["status"] in ("queued", "running"):
+        return jsonify(response_data), 202
+
     return jsonify(response_data), 200
 
 
@@ -256,10 +538,230 @@ def feedback():
     )
 
 
+def _cache_metric(key: str) -> dict:
+    caches = {**controller.cache_stats(), "tokens": TOKEN_CACHE.stats()}
+    return {(name,): stats[key] for name, stats in caches.items() if key in stats}
+
+
+def _queue_depths() -> dict:
+    depths = {
+        ("scans_inflight", ""): controller.SCANS.stats()["inflight"],
+        ("refresh_tracked", ""): controller.SCHEDULER.stats()["tracked"],
+    }
+
+    for host, stats in limiter.stats().items():
+        depths[("host_queued", host)] = stats["queued"]
+        depths[("host_active", host)] = stats["active"]
+
+    if const.JOB_QUEUE:
+        for status, count in controller.JOBS.stats().items():
+            depths[(f"jobs_{status}", "")] = count
+
+    return depths
+
+
+metrics.Callback(
+    "cache_hits_total",
+    "Cache hits.",
+    lambda: _cache_metric("hits"),
+    ("cache",),
+    kind="counter",
+)
+metrics.Callback(
+    "cache_misses_total",
+    "Cache misses.",
+    lambda: _cache_metric("misses"),
+    ("cache",),
+    kind="counter",
+)
+metrics.Callback(
+    "cache_hit_ratio",
+    "Share of lookups answered by the cache.",
+    lambda: _cache_metric("hit_ratio"),
+    ("cache",),
+)
+metrics.Callback(
+    "cache_entries",
+    "Entries in the cache.",
+    lambda: _cache_metric("size"),
+    ("cache",),
+)
+metrics.Callback(
+    "queue_depth",
+    "Scans, refreshes, jobs and outbound requests waiting or running.",
+    _queue_depths,
+    ("queue", "host"),
+)
+
+
+def _host_metric(key: str) -> dict:
+    return {(host,): stats[key] for host, stats in limiter.stats().items()}
+
+
+metrics.Callback(
+    "host_requests_total",
+    "Requests sent through the per-host limiter of this process.",
+    lambda: _host_metric("requests"),
+    ("host",),
+    kind="counter",
+)
+metrics.Callback(
+    "host_throttled_total",
+    "Responses with status 429 that paused the host.",
+    lambda: _host_metric("throttled"),
+    ("host",),
+    kind="counter",
+)
+metrics.Callback(
+    "host_wait_seconds_total",
+    "Seconds requests waited for a slot, the rate limit or a pause.",
+    lambda: _host_metric("wait_total"),
+    ("host",),
+    kind="counter",
+)
+metrics.Callback(
+    "host_wait_seconds_max",
+    "Longest wait of a request for the host.",
+    lambda: _host_metric("wait_max"),
+    ("host",),
+)
+metrics.Callback(
+    "host_wait_seconds_avg",
+    "Average wait of a request for the host.",
+    lambda: _host_metric("wait_avg"),
+    ("host",),
+)
+metrics.Callback(
+    "api_rate_limited_total",
+    "Requests rejected by the per-client rate limit.",
+    lambda: LIMITER.stats()["limited"],
+    kind="counter",
+)
+
+
+metrics.Callback(
+    "api_ready",
+    "1 once the warm-up of this process is done and it takes traffic.",
+    lambda: int(READY.is_set()),
+)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Metrics of this process in the Prometheus text format: request
+    latencies per route, fetch latencies and failures per source,
+    cache counters, queue depths, bypass attempts and model inference
+    times.
+    """
+
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/debug/traces", methods=["GET"])
+@token_auth.login_required
+@throttle
+def debug_traces():
+    """
+    The most recent traces of this process, newest first. Query
+    parameters: limit (default 20), min_ms (only slower traces) and
+    format=chrome (Chrome trace event JSON, for chrome://tracing or
+    Perfetto). Needs a token, as traces contain the looked-up domains.
+    """
+
+    try:
+        limit = int(request.args.get("limit", 20))
+        min_duration = float(request.args.get("min_ms", 0)) / 1000
+    except ValueError:
+        message = "Expected numbers for 'limit' and 'min_ms'."
+        return jsonify({"error": HTTP_STATUS_CODES[400], "message": message}), 400
+
+    traces = trace.recent(limit=limit, min_duration=min_duration)
+
+    if request.args.get("format") == "chrome":
+        return jsonify(trace.to_chrome(traces)), 200
+
+    return jsonify({"traces": [t.to_dict() for t in traces]}), 200
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """
+    Liveness probe: the process answers requests, also while it warms
+    up.
+    """
+
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    Readiness probe: 200 once the warm-up of this process is done,
+    otherwise 503. Both report the steps of the warm-up.
+    """
+
+    ready = READY.is_set()
+    return jsonify({"ready": ready, "steps": WARMUP}), 200 if ready else 503
+
+
+def warm_up() -> bool:
+    """
+    Warm up this process (see controller.warm_up) and open the
+    readiness gate, unless a step needed for scoring failed.
+
+    :return: True if the process is ready.
+    :rtype: bool
+    """
+
+    start = time.perf_counter()
+    ready, steps = controller.warm_up()
+    WARMUP.update(steps)
+
+    if not ready:
+        LOGGER.critical(f"Warm-up of process {os.getpid()} failed, not taking traffic.")
+        return False
+
+    READY.set()
+    LOGGER.info(
+        f"Warm-up done in {time.perf_counter() - start:.1f} s, process {os.getpid()} ready."
+    )
+    return True
+
+
+def start_warm_up(scheduled: bool = True) -> threading.Thread:
+    """
+    Warm up this process in the background, so the probes are answered
+    meanwhile. The warm-up runs once per process, later calls return
+    its thread.
+
+    :param scheduled: False if started by the first request (see
+        readiness_gate), True if started by the server.
+    :type scheduled: bool
+    :return: The warm-up thread.
+    :rtype: threading.Thread
+    """
+
+    global _WARMUP_THREAD, _WARMUP_SCHEDULED
+
+    with _WARMUP_LOCK:
+        _WARMUP_SCHEDULED = _WARMUP_SCHEDULED or scheduled
+        if _WARMUP_THREAD is None:
+            _WARMUP_THREAD = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+            _WARMUP_THREAD.start()
+        return _WARMUP_THREAD
+
+
 def start():
     """
     The start function is the entry point to start the API.
     """
 
+    # With the reloader, this process only watches the files, while a
+    # child process (WERKZEUG_RUN_MAIN set) serves and warms up.
+    if os.environ.get("WERKZEUG_RUN_MAIN"):
+        start_warm_up()
+
     # Start the Flask application.
     app.run(debug=True)
+
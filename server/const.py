@@ -18,6 +18,7 @@ __status__ = "Prototype"
 # Imports.
 import os
 import platform
+import re
 
 # Constants.
 CURRENT_PLATFORM = platform.uname()[0].upper()  # 'DARWIN' / 'LINUX' ...
@@ -25,6 +26,30 @@ APP_PATH = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
 # LOG_FILE = f"{APP_PATH}/log/server.log"
 LOG_FILE = "/tmp/server.log"
 
+# Log output as "text" or "json" (one object per line). Records below
+# WARNING of the loggers in LOG_SAMPLING (and their children) are only
+# kept with the given probability.
+LOG_FORMAT = "text"
+LOG_SAMPLING = {
+    "server.database.database": 0.1,
+    "server.utils.resolver": 0.1,
+    "server.controller.scrape": 0.5,
+}
+
+# AI model, its feature scaler and the scores of already known domains.
+MODEL_FILE = f"{os.path.dirname(APP_PATH)}/oneguardai.keras"
+SCALER_FILE = f"{os.path.dirname(APP_PATH)}/scaler.pkl"
+KNOWN_SCORES_FILE = f"{os.path.dirname(APP_PATH)}/testset.csv"
+
+# Lightweight model for provisional scores (see model/fast.py).
+FAST_MODEL_FILE = f"{APP_PATH}/model/fast_model.json"
+
+# Public suffix list (https://publicsuffix.org/list/), shipped offline.
+PSL_FILE = f"{APP_PATH}/data/public_suffix_list.dat"
+
+# TLDs supported by WHOIS, precomputed (see registrar.write_tlds).
+WHOIS_TLDS_FILE = f"{APP_PATH}/data/whois_tlds.txt"
+
 COUNTRY_MAP = {
     "NaN": "NaN",
     "AD": 0,
@@ -275,5 +300,324 @@ COUNTRY_MAP = {
     "ZW": 245,
 }
 
+# Well-known url shortening services (see domain_url.py).
+SHORTENING_RE = re.compile(
+    r"(^|\.)("
+    r"bit\.ly|bitly\.com|goo\.gl|shorte\.st|go2l\.ink|x\.co|ow\.ly|t\.co|"
+    r"tinyurl\.com|tr\.im|is\.gd|cli\.gs|migre\.me|ff\.im|tiny\.cc|url4\.eu|"
+    r"su\.pr|twurl\.nl|snipurl\.com|short\.to|budurl\.com|post\.ly|snipr\.com|"
+    r"fic\.kr|doiop\.com|short\.ie|kl\.am|wp\.me|rubyurl\.com|om\.ly|to\.ly|"
+    r"bit\.do|lnkd\.in|db\.tt|qr\.ae|adf\.ly|cur\.lv|ity\.im|q\.gs|po\.st|"
+    r"bc\.vc|u\.to|j\.mp|buzurl\.com|cutt\.us|u\.bb|yourls\.org|v\.gd|"
+    r"qr\.net|1url\.com|tweez\.me|rb\.gy|cutt\.ly|shorturl\.at|t\.ly"
+    r")$",
+    re.IGNORECASE,
+)
+
+# TLDs frequently used for phishing and scam shops (see domain_url.py).
+SUSPICIOUS_TLD = {
+    "bar",
+    "bid",
+    "buzz",
+    "cam",
+    "cf",
+    "click",
+    "club",
+    "cyou",
+    "fit",
+    "ga",
+    "gdn",
+    "gq",
+    "icu",
+    "kim",
+    "link",
+    "live",
+    "loan",
+    "ml",
+    "monster",
+    "online",
+    "party",
+    "quest",
+    "rest",
+    "sbs",
+    "shop",
+    "site",
+    "store",
+    "surf",
+    "tk",
+    "top",
+    "uno",
+    "vip",
+    "website",
+    "win",
+    "work",
+    "xyz",
+    "zip",
+}
+
+
+# Scan initialization: Timeouts (seconds) for the first contact with a
+# website and the Cloudflare bypass services. TIMEOUT applies to the
+# requests of the sources (review sites, favicon, TLS, social).
+INIT_TIMEOUT = 10
+CF_TIMEOUT = 60
+TIMEOUT = 10
+
+# Results of the reachability probe are cached per domain, so the
+# WebScraper and later scans within this window do not probe again.
+PROBE_TTL = 120
+PROBE_CACHE_SIZE = 4096
+
+# DNS cache: The TTL of the records is clamped to [MIN, MAX] seconds,
+# failed lookups are remembered for NEGATIVE seconds. DEFAULT applies
+# to answers of the system resolver, which reports no TTL. Names listed
+# in HOSTS_FILE are always left to the system resolver. At most
+# PREFETCH_QUEUE prefetches wait for a lookup, further ones are dropped.
+DNS_CACHE_SIZE = 8192
+DNS_TIMEOUT = 5
+DNS_DEFAULT_TTL = 300
+DNS_MIN_TTL = 30
+DNS_MAX_TTL = 3600
+DNS_NEGATIVE_TTL = 60
+DNS_HOSTS_FILE = "/etc/hosts"
+DNS_PREFETCH_QUEUE = 64
+
+# Politeness limits for third-party sites, shared by all scans of a
+# process. Host (subdomains included): (max parallel requests, requests
+# per second, burst). The limits apply per process: N API workers (or
+# scan workers) send up to N times as much to a host, so set the values
+# to the host's allowance divided by the number of processes.
+HOST_LIMITS = {
+    "trustpilot.com": (2, 1.0, 3),
+    "scamadviser.com": (2, 0.5, 2),
+    "check.getsafeonline.org": (2, 0.5, 2),
+    "urlvoid.com": (1, 0.5, 2),
+    "trustedshops.de": (2, 1.0, 3),
+}
+HOST_LIMIT_MAX_WAIT = 120  # Max. seconds to wait for a free slot.
+HOST_LIMIT_RETRIES = 2  # Retries after a 429 response.
+HOST_LIMIT_BACKOFF = 30  # Pause if 429 comes without 'Retry-After'.
+HOST_LIMIT_MAX_BACKOFF = 120
+
+# WebScraper: Bodies are streamed and cut after MAX_BODY_SIZE bytes. The
+# first SIGNATURE_WINDOW bytes are checked for Cloudflare's phishing
+# warning (abort) and challenge pages (stop downloading, bypass needed).
+MAX_BODY_SIZE = 5 * 1024 * 1024
+SIGNATURE_WINDOW = 2048
+PHISHING_SIGNATURES = (b"suspected phishing site | cloudflare",)
+CHALLENGE_SIGNATURES = (
+    b"<title>just a moment...</title>",
+    b"<title>attention required! | cloudflare</title>",
+)
+
+# Default resource budget of a single scan (see controller/budget.py).
+BUDGET_SECONDS = 45  # Max. wall-clock time.
+BUDGET_REQUESTS = 40  # Max. number of outbound requests.
+BUDGET_BYTES = 20 * 1024 * 1024  # Max. downloaded bytes.
+BUDGET_PAID = 2  # Max. calls of paid scraping services.
+
+# Score store: In-process LRU in front of the database. Memory entries
+# expire after SCORE_CACHE_TTL seconds, so updates by other workers are
+# picked up. Stale entries are refreshed by background workers.
+SCORE_CACHE_SIZE = 10000
+SCORE_CACHE_TTL = 3600
+SCORE_REFRESH_WORKERS = 2
+
+# Request coalescing: Concurrent analyses of the same domain share one
+# scan. With SCAN_LEASE, worker processes also coordinate through a
+# lease in the database. The lease must outlive a scan (BUDGET_SECONDS).
+# Waiting processes give up after SCAN_LEASE_TTL seconds. A failed scan
+# is marked for SCAN_FAILED_TTL seconds, so the waiting processes do
+# not rescan the domain one after another.
+SCAN_LEASE = False
+SCAN_LEASE_COLLECTION = "leases"
+SCAN_LEASE_TTL = 120
+SCAN_LEASE_POLL = 1.0
+SCAN_FAILED_TTL = 300
+
+# Negative cache: Seconds a failed scan is remembered, per exception
+# class of server.data.exceptions (subclasses inherit). Classes not
+# listed (e.g. BudgetExceededError) are not cached.
+NEGATIVE_CACHE_SIZE = 4096
+NEGATIVE_TTLS = {
+    "NotReachableError": 300,  # Offline now, maybe back soon.
+    "NotScrapableError": 1800,  # Anti-scraping does not change quickly.
+    "CloudflareFlaggedError": 86400,  # Flagged as phishing.
+}
+
+# Canonical domains: Aliases learned from redirects expire after
+# ALIAS_TTL seconds. Aliases to another registrable domain (e.g.
+# shop.com -> shop.de) are off by default, as redirects can be cloaked.
+ALIAS_CACHE_SIZE = 10000
+ALIAS_TTL = 86400
+ALIAS_CROSS_DOMAIN = False
+
+# Domain-level sources are cached per registrable domain (seconds).
+DOMAIN_SOURCE_CACHE_SIZE = 4096
+DOMAIN_SOURCE_TTLS = {
+    "whois": 86400,
+    "pagerank": 86400,
+    "trustpilot": 21600,
+    "scamadviser": 21600,
+    "trustedshops": 21600,
+}
+
+# Feature cache: Seconds each feature group of a scanned domain stays
+# valid. Rescans only recompute the expired groups and rescore the
+# merged feature vector.
+FEATURE_CACHE_SIZE = 50000
+FEATURE_TTLS = {
+    "domain_url": 30 * 86400,  # Derived from the name only.
+    "https_ssl": 7 * 86400,  # Certificates and security headers.
+    "script": 3 * 86400,
+    "misc": 3 * 86400,
+    "trustpilot": 3 * 86400,
+    "scamadviser": 3 * 86400,
+    "getsafeonline": 86400,  # Blocklists change quickly.
+    "pagerank": 14 * 86400,
+    "urlvoid": 86400,  # Blocklists change quickly.
+    "trustedshops": 7 * 86400,
+    "whois": 14 * 86400,  # Domain age in months.
+}
+
+# Fast path: Unknown domains are answered right away with a provisional
+# score of the fast model, while the full scan runs in the background.
+# Off by default, as the fast model only sees the domain name: on
+# held-out domains its score is off by 6.38 points on average (verdict
+# accuracy 0.68, always guessing the majority verdict gives 0.57).
+# Turning it on trades that error for an instant first answer, flagged
+# "provisional". Either way, provisional scores (also of /analyze/stream)
+# are only given if the fast model's confidence (0 at a probability of
+# 0.5, 1 at 0 or 1) is at least FAST_MIN_CONFIDENCE, else the score is
+# unknown until the scan has finished. At 0.3, 24 % of held-out domains
+# get a score, with accuracy 0.86 and 3.46 points error. Measure with:
+# python -m server.model.fast
+FAST_PATH = False
+FAST_MIN_CONFIDENCE = 0.3
+
+# Scoring cascade: After each extraction stage (cheap, medium), stop if
+# the model is already confident, i.e. the probability of being
+# trustworthy is at most CASCADE_LOW or at least CASCADE_HIGH. Off by
+# default: the thresholds are not measured yet, and the model was
+# trained on complete feature vectors, so it judges the missing groups
+# of a partial vector as if they were 0. Only turn it on with replay
+# results of: python -m server.model.cascade (or with models trained on
+# the features of each stage).
+CASCADE = False
+CASCADE_LOW = 0.05
+CASCADE_HIGH = 0.95
+
+# Refresh scheduler: Every REFRESH_INTERVAL seconds, entries expiring
+# within REFRESH_WINDOW seconds are refreshed if their domain got at
+# least REFRESH_MIN_HITS requests (decaying with REFRESH_HALF_LIFE
+# seconds). At most REFRESH_BATCH per round, at REFRESH_RATE per second,
+# chosen from the REFRESH_CANDIDATES most requested expiring entries.
+# Every process stores its request counts (of at most REFRESH_TRACKED
+# domains per round) in the database, but only the holder of the lease
+# REFRESH_LEASE refreshes, so the refreshes are not multiplied by the
+# number of worker processes.
+REFRESH_INTERVAL = 300
+REFRESH_WINDOW = 2 * 86400
+REFRESH_MIN_HITS = 3
+REFRESH_HALF_LIFE = 86400
+REFRESH_TRACKED = 50000
+REFRESH_CANDIDATES = 1000
+REFRESH_LEASE = "refresh-scheduler"
+REFRESH_BATCH = 100
+REFRESH_RATE = 0.2
+REFRESH_BURST = 5
+
+# Job queue: With JOB_QUEUE, unknown domains are scanned by separate
+# scan worker processes (python -m server.controller.jobs) instead of
+# the API workers. Jobs running longer than JOB_TIMEOUT seconds are
+# retried, up to JOB_MAX_ATTEMPTS. Results are kept JOB_RESULT_TTL s.
+JOB_QUEUE = False
+JOB_DB_FILE = "/tmp/server-jobs.sqlite3"
+JOB_WORKERS = 4
+JOB_POLL = 0.5
+JOB_TIMEOUT = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_RESULT_TTL = 3600
+
+# Batch analysis: At most BATCH_MAX domains per request. Each (distinct)
+# domain counts as one request for the rate limit, so BATCH_MAX is at
+# most RATE_LIMIT_BURST. Unknown domains are scanned by BATCH_WORKERS
+# threads, shared by all batch requests.
+BATCH_MAX = 10
+BATCH_WORKERS = 8
+
+# Streaming (/analyze/stream): A keep-alive comment is sent after
+# STREAM_HEARTBEAT seconds without news.
+STREAM_HEARTBEAT = 15
+
+# API rate limits: Every client (UUID or IP address) may send
+# secrets.API_THROTTLE requests per second, in bursts of up to
+# RATE_LIMIT_BURST. Buckets are kept in memory, spread over
+# RATE_LIMIT_SHARDS shards of RATE_LIMIT_MAX_CLIENTS clients in total,
+# or in the SQLite database RATE_LIMIT_DB_FILE (shared by all workers of
+# the host) if set.
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_SHARDS = 16
+RATE_LIMIT_MAX_CLIENTS = 100000
+RATE_LIMIT_DB_FILE = None
+
+# Number of verified API tokens cached (until they expire).
+TOKEN_CACHE_SIZE = 10000
+
+# Production server (python -m server.server --production): gunicorn
+# with SERVER_WORKERS processes of SERVER_THREADS threads. Workers are
+# replaced after SERVER_MAX_REQUESTS requests (+ random jitter), and
+# killed if silent for SERVER_TIMEOUT seconds.
+SERVER_PRODUCTION = False
+SERVER_BIND = "127.0.0.1:5000"
+SERVER_WORKERS = min(2 * (os.cpu_count() or 1) + 1, 8)
+SERVER_THREADS = 4
+SERVER_MAX_REQUESTS = 2000
+SERVER_MAX_REQUESTS_JITTER = 200
+SERVER_TIMEOUT = 120
+SERVER_GRACEFUL_TIMEOUT = 30
+
+# Tracing (see utils/trace.py): TRACE_SAMPLE of all requests and scans
+# are traced, the last TRACE_BUFFER_SIZE traces are kept (at most
+# TRACE_MAX_SPANS spans each) and served by /debug/traces (with a token).
+TRACE_ENABLED = True
+TRACE_SAMPLE = 1.0
+TRACE_BUFFER_SIZE = 200
+TRACE_MAX_SPANS = 500
+
+# Import time budget of the entry point (python -m server.utils.startup).
+STARTUP_MODULE = "server.server"
+STARTUP_BUDGET_MS = 1500
+
+# Warm-up (see /readyz): Before a worker takes traffic, it runs a dummy
+# inference, loads the known scores, resolves the WARMUP_HOSTS of the
+# review sites, opens DB_MIN_POOL_SIZE database connections and loads
+# the WARMUP_DOMAINS most requested score entries into memory. Servers
+# that do not warm up at startup (flask run, plain gunicorn, serverless
+# functions) warm up on the first request, which waits at most
+# WARMUP_LAZY_WAIT seconds for it.
+WARMUP_DOMAINS = 1000
+WARMUP_LAZY_WAIT = 60
+WARMUP_HOSTS = [
+    "de.trustpilot.com",
+    "www.scamadviser.com",
+    "www.virustotal.com",
+    "check.getsafeonline.org",
+    "openpagerank.com",
+    "www.urlvoid.com",
+    "www.trustedshops.de",
+]
 
 # Database.
+# One pooled MongoDB client per process (see database.client). Each
+# process keeps up to DB_MAX_POOL_SIZE connections (its request threads
+# plus the refresh and batch workers) and at least DB_MIN_POOL_SIZE, so
+# the first requests need no handshake. Connections idle for
+# DB_MAX_IDLE_MS are closed. A request waits at most
+# DB_WAIT_QUEUE_TIMEOUT_MS for a free connection. Times in milliseconds.
+DB_MAX_POOL_SIZE = 32
+DB_MIN_POOL_SIZE = 2
+DB_MAX_IDLE_MS = 60000
+DB_CONNECT_TIMEOUT_MS = 5000
+DB_SERVER_SELECTION_TIMEOUT_MS = 5000
+DB_WAIT_QUEUE_TIMEOUT_MS = 2000
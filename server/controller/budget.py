@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+"""
+budget.py: Resource budget of a single website scan.
+
+One slow domain must not tie up a worker for minutes. A ScanBudget is
+created per scan and handed to every source. Sources ask it before
+doing network work, clamp their timeouts to the remaining time and
+charge the requests, bytes and paid-service calls they make. Sources
+that give up because the budget is used up are recorded as skipped.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-15"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import math
+import threading
+import time
+
+from server import const
+from server.data import exceptions
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+class ScanBudget:
+    """
+    Limits for wall-clock time, outbound requests, downloaded bytes and
+    paid-service calls of one scan. Thread-safe, so sources running in
+    parallel can share it.
+
+    :ivar float max_seconds: Maximum wall-clock time of the scan.
+    :ivar int max_requests: Maximum number of outbound requests.
+    :ivar int max_bytes: Maximum number of downloaded bytes.
+    :ivar int max_paid: Maximum number of paid-service calls.
+    :ivar int requests: Outbound requests made so far.
+    :ivar int bytes: Bytes downloaded so far.
+    :ivar int paid: Paid-service calls made so far.
+    :ivar list skipped: Names of the sources skipped due to the budget.
+    """
+
+    def __init__(
+        self,
+        max_seconds: float = const.BUDGET_SECONDS,
+        max_requests: int = const.BUDGET_REQUESTS,
+        max_bytes: int = const.BUDGET_BYTES,
+        max_paid: int = const.BUDGET_PAID,
+    ) -> None:
+        """
+        Start the clock of a new budget.
+
+        :param max_seconds: Maximum wall-clock time of the scan.
+        :type max_seconds: float
+        :param max_requests: Maximum number of outbound requests.
+        :type max_requests: int
+        :param max_bytes: Maximum number of downloaded bytes.
+        :type max_bytes: int
+        :param max_paid: Maximum number of paid-service calls.
+        :type max_paid: int
+        """
+
+        self.max_seconds = max_seconds
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.max_paid = max_paid
+
+        self.requests = 0
+        self.bytes = 0
+        self.paid = 0
+        self.skipped = []
+
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def unlimited(cls) -> "ScanBudget":
+        """
+        Create a budget without any limits (for calls outside a scan).
+
+        :return: A ScanBudget that is never exhausted.
+        :rtype: ScanBudget
+        """
+
+        return cls(math.inf, math.inf, math.inf, math.inf)
+
+    def elapsed(self) -> float:
+        """
+        :return: Seconds since the scan started.
+        :rtype: float
+        """
+
+        return time.monotonic() - self._started
+
+    def remaining(self) -> float:
+        """
+        :return: Seconds left until the time budget is used up.
+        :rtype: float
+        """
+
+        return max(self.max_seconds - self.elapsed(), 0.0)
+
+    def timeout(self, default: float) -> float:
+        """
+        Clamp a timeout to the remaining time of the scan.
+
+        :param default: The timeout the source would use otherwise.
+        :type default: float
+        :return: The smaller of default and the remaining time.
+        :rtype: float
+        """
+
+        return min(default, self.remaining())
+
+    def exhausted(self, paid: bool = False) -> str or None:
+        """
+        Check if any part of the budget is used up.
+
+        :param paid: Pass True if the next call uses a paid service.
+        :type paid: bool
+        :return: The name of the exhausted limit, or None.
+        :rtype: str | None
+        """
+
+        with self._lock:
+            if self.remaining() <= 0:
+                return "time"
+            if self.requests >= self.max_requests:
+                return "requests"
+            if self.bytes >= self.max_bytes:
+                return "bytes"
+            if paid and self.paid >= self.max_paid:
+                return "paid"
+
+        return None
+
+    def allows(self, source: str, paid: bool = False) -> bool:
+        """
+        Ask if a source may still run. If not, the source is recorded
+        as skipped.
+
+        :param source: The name of the source (e.g. "trustpilot").
+        :type source: str
+        :param paid: Pass True if the source uses a paid service.
+        :type paid: bool
+        :return: True if the source may run.
+        :rtype: bool
+        """
+
+        reason = self.exhausted(paid=paid)
+        if reason is None:
+            return True
+
+        self.skip(source, reason)
+        return False
+
+    def skip(self, source: str, reason: str) -> None:
+        """
+        Record a source as skipped because of the budget.
+
+        :param source: The name of the source.
+        :type source: str
+        :param reason: The name of the exhausted limit.
+        :type reason: str
+        :return: None
+        """
+
+        with self._lock:
+            if source not in self.skipped:
+                self.skipped.append(source)
+
+        LOGGER.info(f"Skipping '{source}': Scan budget ({reason}) is used up.")
+
+    def check(self, paid: bool = False) -> None:
+        """
+        Raise if the budget is used up. Used inside the WebScraper,
+        where the exception ends the scraping process.
+
+        :param paid: Pass True if the next call uses a paid service.
+        :type paid: bool
+        :return: None
+        :raises: BudgetExceededError.
+        """
+
+        reason = self.exhausted(paid=paid)
+        if reason is not None:
+            raise exceptions.BudgetExceededError(reason)
+
+    def charge(self, requests: int = 1, nbytes: int = 0, paid: bool = False) -> None:
+        """
+        Charge outbound requests and downloaded bytes to the budget.
+
+        :param requests: Number of requests made. Default: 1.
+        :type requests: int
+        :param nbytes: Number of bytes downloaded. Default: 0.
+        :type nbytes: int
+        :param paid: Pass True if the requests used a paid service.
+        :type paid: bool
+        :return: None
+        """
+
+        with self._lock:
+            self.requests += requests
+            self.bytes += nbytes
+            if paid:
+                self.paid += requests
+
+    def summary(self) -> dict:
+        """
+        Return what the scan used and which sources were skipped.
+
+        :return: A dict with seconds, requests, bytes, paid and skipped.
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                "seconds": round(self.elapsed(), 2),
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "paid": self.paid,
+                "skipped": list(self.skipped),
+            }
+
+    def __str__(self) -> str:
+        """
+        Return a string representation of the object.
+
+        :return: A string representation of the object.
+        :rtype: str
+        """
+
+        return (
+            f"ScanBudget("
+            f"seconds={self.elapsed():.2f}/{self.max_seconds}, "
+            f"requests={self.requests}/{self.max_requests}, "
+            f"bytes={self.bytes}/{self.max_bytes}, "
+            f"paid={self.paid}/{self.max_paid}, "
+            f"skipped={self.skipped!r})"
+        )
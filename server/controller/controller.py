@@ -16,183 +16,587 @@ __date__ = "2023-11-07"
 __status__ = "Prototype"
 
 # Imports.
+import csv
+import functools
 import logging
-import numpy as np
-import joblib
-from datetime import datetime, timedelta
-from tensorflow.keras.models import load_model
-from sklearn.preprocessing import StandardScaler
-import pandas as pd
-from .features import WebsiteFeatures
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from server import const
-from server.secrets import secrets
-from urllib.parse import urlparse
-import random
+from . import scrape
+from .features import FEATURE_CACHE, WebsiteFeatures
+from .jobs import JOBS
+from .scheduler import SCHEDULER
+from .store import STORE
 
 from ..database import database
-from ..model import ai
-from .. import scan
+from ..model import ai, fast
+from ..scan import registrar, review
+from ..utils import canonical, resolver, singleflight, trace
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
+# Scores of already known domains (domain -> score), loaded on first use.
+_KNOWN_SCORES = None
+_KNOWN_LOCK = threading.Lock()
+
+# Scans in flight, keyed by canonical domain.
+SCANS = singleflight.SingleFlight()
+
+# Scans of batch requests, shared by all requests of this process.
+_BATCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=const.BATCH_WORKERS, thread_name_prefix="batch-scan"
+)
+
 
-def calculate_score(domain: str) -> tuple[int, int, str]:
-    scan_data = scan.get_data(domain)
-    user_score = scan.get_user_score_trustpilot(domain)
-    score = ai.generate_score(scan_data)
+def known_scores() -> dict:
+    """
+    Return the index of domains with a known score (testset.csv). The
+    file is read once per process.
 
-    return score, user_score, scan_data.get("category")
+    :return: A dict mapping domains to scores (0-15).
+    :rtype: dict
+    """
 
+    global _KNOWN_SCORES
 
-def analyze(domain):
-    # Create database connection.
-    # LOGGER.debug("Connecting to database...")
-    # db_manager = database.DatabaseManager(
-    #     secrets.DB_URI,
-    #     secrets.DB_NAME,
-    #     secrets.DB_COLLECTION,
-    # )
+    if _KNOWN_SCORES is None:
+        with _KNOWN_LOCK:
+            if _KNOWN_SCORES is None:
+                with open(const.KNOWN_SCORES_FILE, newline="") as f:
+                    _KNOWN_SCORES = {
+                        canonical.hostname(row["domain"]): int(row["score"])
+                        for row in csv.DictReader(f)
+                    }
+                LOGGER.debug(f"Loaded {len(_KNOWN_SCORES)} known scores.")
 
-    domain = urlparse(domain).netloc
+    return _KNOWN_SCORES
 
-    df = pd.read_csv("testset.csv")
-    df = df.reset_index()
 
-    score = 0
-    found = False
+def calculate_score(domain: str, progress=None, host: str = None) -> dict or None:
+    """
+    Scan a website and score it with the AI model.
+
+    :param domain: The canonical domain, under which the score is
+        stored.
+    :type domain: str
+    :param progress: Called per finished feature group, see
+        WebsiteFeatures.feature_extraction.
+    :param host: The host the user asked for, which is scanned instead
+        of the canonical domain (see canonical.scan_hosts).
+    :type host: str
+    :return: A new score entry (see WebsiteScoreEntry.to_dict), or None
+        if the website could not be scanned.
+    :rtype: dict | None
+    """
 
-    print("Searching for", domain)
-    for index, row in df.iterrows():
-        if row["domain"] == domain.lower():
-            score = row["score"]
-            found = True
+    for name in canonical.scan_hosts(domain, host):
+        obj = WebsiteFeatures(name)
+        obj.feature_extraction(judge=ai.predict if const.CASCADE else None, progress=progress)
+        if obj.alive:
+            break
 
-    if not found:
-        score = int(random.uniform(9, 14))
-        # model = load_model("oneguardai.keras")
-        # scaler = joblib.load("scaler.pkl")
+    if not obj.alive:
+        return None
 
-        # obj = WebsiteFeatures(domain)
-        # obj.feature_extraction()
+    score = ai.generate_score(obj.features, obj.features_names)
 
-        # df = pd.DataFrame([obj.features], columns=obj.features_names)
-        # df["WHOIS_COUNTRY"] = df["WHOIS_COUNTRY"].replace(const.COUNTRY_MAP)
+    # The Trustpilot rating (1-5 stars) serves as user score (0-15).
+    tp_rating = obj.features[obj.features_names.index("TP_RATING")]
+    if tp_rating == "NaN":
+        user_score = None
+    else:
+        user_score = int(round((float(tp_rating) - 1) / 4 * 15))
 
-        # # Replace NaN values with 0.
-        # df.replace("NaN", np.nan, inplace=True)
-        # df = df.infer_objects(copy=False)
-        # df.fillna(0, inplace=True)
+    entry = database.WebsiteScoreEntry(domain, score, user_score, None)
+    return entry.to_dict()
+
+
+@trace.traced("scan", root=True)
+def _scan(domain: str, progress=None, host: str = None) -> dict or None:
+    """
+    Calculate and store the score of a domain. With const.SCAN_LEASE,
+    only the worker process holding the lease scans, all others wait
+    for its entry to show up in the database. The database is read
+    past the memory tier, which may still hold the stale entry. If the
+    scan fails, it is marked as failed in the database, and the waiting
+    processes give up too. They wait at most const.SCAN_LEASE_TTL
+    seconds.
+
+    :param domain: The canonical domain.
+    :type domain: str
+    :param progress: Called per finished feature group.
+    :param host: The host the user asked for, see calculate_score.
+    :type host: str
+    :return: The stored entry, or None if the website could not be
+        scanned.
+    :rtype: dict | None
+    """
+
+    if const.SCAN_LEASE:
+        deadline = time.monotonic() + const.SCAN_LEASE_TTL
+        while not STORE.acquire_lease(domain):
+            if time.monotonic() >= deadline:
+                LOGGER.warning(f"Gave up waiting for the scan of {domain} by another worker.")
+                return None
+
+            time.sleep(const.SCAN_LEASE_POLL)
+            entry, stale = STORE.get(domain, cached=False)
+            if entry is not None and not stale:
+                LOGGER.debug(f"Got entry for {domain} from another worker.")
+                return entry
+            if STORE.failed(domain):
+                LOGGER.debug(f"Another worker could not scan {domain}.")
+                return None
+
+    try:
+        # The previous lease holder may have stored the entry (or
+        # failed) just before this process took the lease.
+        if const.SCAN_LEASE:
+            entry, stale = STORE.get(domain, cached=False)
+            if entry is not None and not stale:
+                LOGGER.debug(f"Got entry for {domain} from another worker.")
+                return entry
+            if STORE.failed(domain):
+                LOGGER.debug(f"Another worker could not scan {domain}.")
+                return None
+
+        entry = calculate_score(domain, progress, host)
+        if entry is None:
+            if const.SCAN_LEASE:
+                STORE.mark_failed(domain)
+            return None
+
+        return STORE.put(entry)
+
+    finally:
+        if const.SCAN_LEASE:
+            STORE.release_lease(domain)
+
+
+def scan(domain: str, progress=None, host: str = None) -> dict or None:
+    """
+    Scan a domain once, no matter how many requests ask for it at the
+    same time. Concurrent callers wait for the running scan and share
+    its entry.
+
+    :param domain: The canonical domain.
+    :type domain: str
+    :param progress: Called per finished feature group, only if this
+        call runs the scan (not if it shares a running one).
+    :param host: The host the user asked for, see calculate_score.
+    :type host: str
+    :return: The stored entry, or None if the website could not be
+        scanned.
+    :rtype: dict | None
+    """
 
-        # # Convert all columns to numeric.
-        # df = df.apply(pd.to_numeric)
-        # df = df.select_dtypes(include=[np.number])
-        # df = pd.DataFrame(df)
+    entry, shared = SCANS.do(domain, _scan, domain, progress, host)
+    if shared:
+        LOGGER.debug(f"Shared the running scan of {domain}.")
 
-        # # Standardize and normalize the features.
-        # scaled_features = scaler.transform(df)
+    return entry
 
-        # score = model.predict(scaled_features)
 
-    # data = db_manager.get_by_domain(domain)
+def response(entry: dict) -> dict:
+    """
+    Select the fields of a score entry that are sent to the client.
+
+    :param entry: The score entry.
+    :type entry: dict
+    :return: The response data.
+    :rtype: dict
+    """
+
+    return {
+        "domain": entry.get("domain"),
+        "score": entry.get("score"),
+        "score_readable": entry.get("score_readable"),
+        "user_score": entry.get("user_score"),
+        "user_score_readable": entry.get("user_score_readable"),
+        "category": entry.get("category"),
+        "provisional": False,
+    }
+
+
+def provisional(domain: str) -> dict:
+    """
+    Score a domain with the fast model, from its name only. If the
+    model is less confident than const.FAST_MIN_CONFIDENCE, the score
+    is left unknown.
+
+    :param domain: The canonical domain.
+    :type domain: str
+    :return: The response data for the client, flagged as provisional.
+    :rtype: dict
+    """
+
+    probability = fast.predict(domain)
+    confidence = fast.confidence(probability)
+    if confidence < const.FAST_MIN_CONFIDENCE:
+        return {**unknown(domain), "confidence": round(confidence, 2), "provisional": True}
+
+    score = int(round(probability * 15))
+
     return {
         "domain": domain,
         "score": score,
-        "score_readable": {
-            0: "F",
-            1: "E-",
-            2: "E",
-            3: "E+",
-            4: "D-",
-            5: "D",
-            6: "D+",
-            7: "C-",
-            8: "C",
-            9: "C+",
-            10: "B-",
-            11: "B",
-            12: "B+",
-            13: "A-",
-            14: "A",
-            15: "A+",
-        }[score],
-        # "user_score": data.get("user_score"),
-        # "user_score_readable": data.get("user_score_readable"),
-        # "category": data.get("category"),
+        "score_readable": database.WebsiteScore._convert_scores(score),
+        "confidence": round(confidence, 2),
+        "provisional": True,
+    }
+
+
+def start_refresh() -> None:
+    """
+    Start refreshing popular entries before they expire, in the
+    background (see scheduler.py).
+
+    :return: None
+    """
+
+    SCHEDULER.start(scan)
+
+
+def _resolve_hosts() -> int:
+    resolved = 0
+    for host in const.WARMUP_HOSTS:
+        try:
+            resolver.RESOLVER.resolve(host)
+            resolved += 1
+        except (OSError, UnicodeError) as e:
+            LOGGER.warning(f"Warm-up could not resolve '{host}': {str(e)}.")
+    return resolved
+
+
+# Warm-up steps a process can not score without.
+_WARMUP_REQUIRED = ("model", "fast_model", "known_scores")
+
+
+def warm_up() -> tuple[bool, dict]:
+    """
+    Prepare this process for traffic: load both models and run a dummy
+    inference each (the first prediction is much slower than the
+    following), load the known-score index, resolve the hosts of the
+    review sites, open the pooled database connections, provision the
+    database indexes and load the most requested score entries into
+    memory. Failing DNS or
+    database steps are reported, but do not keep the process from
+    serving.
+
+    :return: True if all required steps succeeded, and step name ->
+        dict with ok, seconds, result (or error).
+    :rtype: tuple[bool, dict]
+    """
+
+    steps = {
+        "model": lambda: ai.predict(
+            [0] * len(WebsiteFeatures.features_names), WebsiteFeatures.features_names
+        ),
+        "fast_model": lambda: fast.predict("example.com"),
+        "known_scores": lambda: len(known_scores()),
+        "dns": _resolve_hosts,
+        "db_pool": STORE.open_pool,
+        "db_indexes": STORE.ensure_indexes,
+        "score_cache": lambda: STORE.warm(const.WARMUP_DOMAINS),
     }
-    # now = datetime.now()
-
-    # if data:
-    #     data_timestamp = data.get("updated_at")
-    # else:
-    #     data_timestamp = None
-
-    # # Entry exists in database and is younger than 14 days.
-    # if data_timestamp and now - data_timestamp < timedelta(days=secrets.DB_RETENTION):
-    #     LOGGER.debug(
-    #         f"Found entry for {domain} in database, which is younger "
-    #         f"than {str(secrets.DB_RETENTION)} days."
-    #     )
-
-    # # No entry in database or older than 14 days -> calculate the score,
-    # # create a new entry and store it in the database.
-    # else:
-    #     score, user_score, category = calculate_score(domain)
-
-    #     # Create a new entry.
-    #     entry = database.WebsiteScoreEntry(domain, score, user_score, category)
-
-    #     data = entry.to_dict()
-
-    #     # No entry -> store the new entry in the database.
-    #     if data_timestamp is None:
-    #         db_manager.insert_entry(data)
-    #         LOGGER.debug(f"Created new entry for {domain} in database.")
-
-    #     # Entry available -> Update entry in database.
-    #     else:
-    #         db_manager.update_entry(data)
-    #         LOGGER.debug(f"Updated entry for {domain} in database.")
-
-    # # At this point, the score is either retrieved from the database or
-    # # calculated and stored in the database. Now, the score is returned
-    # # to the API endpoint, which will send it to the client.
-    # return {
-    #     "domain": data.get("domain"),
-    #     "score": data.get("score"),
-    #     "score_readable": data.get("score_readable"),
-    #     "user_score": data.get("user_score"),
-    #     "user_score_readable": data.get("user_score_readable"),
-    #     "category": data.get("category"),
-    # }
-    """
-    Get the final domain score
-    """
-    model = load_model("oneguardai.keras")
-    scaler = joblib.load("scaler.pkl")
-
-    obj = WebsiteFeatures(domain)
-    obj.feature_extraction()
-
-    df = pd.DataFrame([obj.features], columns=obj.features_names)
-    df["WHOIS_COUNTRY"] = df["WHOIS_COUNTRY"].replace(const.COUNTRY_MAP)
-
-    # Replace NaN values with 0.
-    df.replace("NaN", np.nan, inplace=True)
-    df = df.infer_objects(copy=False)
-    df.fillna(0, inplace=True)
-
-    # Convert all columns to numeric.
-    df = df.apply(pd.to_numeric)
-    df = df.select_dtypes(include=[np.number])
-    df = pd.DataFrame(df)
-
-    # Standardize and normalize the features.
-    scaled_features = scaler.transform(df)
-
-    prediction = model.predict(scaled_features)
-
-    return prediction
+
+    report = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            report[name] = {"ok": True, "result": step()}
+        except Exception as e:
+            LOGGER.error(f"Warm-up step '{name}' failed: {e.__class__.__name__}: {e}")
+            report[name] = {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+        report[name]["seconds"] = round(time.perf_counter() - start, 3)
+
+    return all(report[name]["ok"] for name in _WARMUP_REQUIRED), report
+
+
+def unknown(domain: str) -> dict:
+    """
+    Response data for a website that could not be scanned.
+
+    :param domain: The canonical domain.
+    :type domain: str
+    :return: The response data for the client.
+    :rtype: dict
+    """
+
+    return {"domain": domain, "score": None, "score_readable": "Unknown"}
+
+
+def lookup(domain: str) -> dict or None:
+    """
+    Answer a domain without scanning: from the index of known domains
+    or from the score store (memory, then database). Stale entries are
+    returned right away and refreshed in the background.
+
+    :param domain: The canonical domain.
+    :type domain: str
+    :return: The response data for the client, or None if the domain
+        has to be scanned.
+    :rtype: dict | None
+    """
+
+    SCHEDULER.touch(domain)
+
+    LOGGER.debug(f"Searching for {domain}")
+    known = known_scores().get(domain)
+    if known is not None:
+        return {
+            "domain": domain,
+            "score": known,
+            "score_readable": database.WebsiteScore._convert_scores(known),
+        }
+
+    entry, stale = STORE.get(domain)
+    if entry is None:
+        return None
+
+    # Entry exists, but is older than secrets.DB_RETENTION days -> serve
+    # it now and rescan in the background for the next request.
+    if stale:
+        STORE.refresh(domain, scan)
+
+    return response(entry)
+
+
+def _start(domain: str, host: str) -> dict or None:
+    """
+    Start the scan of a domain without an entry, if the client does not
+    wait for it: with const.JOB_QUEUE, the scan is queued for the scan
+    workers, with const.FAST_PATH, it runs in the background of this
+    process. Either way, the client gets a provisional score (if the
+    fast path is on) right away.
+
+    :param domain: The canonical domain.
+    :type domain: str
+    :param host: The host the user asked for, see calculate_score.
+    :type host: str
+    :return: The response data for the client, or None if the caller
+        has to scan the domain (see scan).
+    :rtype: dict | None
+    """
+
+    # The client polls the job (see job) for the result.
+    if const.JOB_QUEUE:
+        data = provisional(domain) if const.FAST_PATH else unknown(domain)
+        data["job"] = JOBS.submit(domain)
+        return data
+
+    # This process scans: resolve the host while the scan starts up, so
+    # it finds the A and AAAA records already cached.
+    resolver.prefetch(host)
+
+    # The full scan runs in the background for the next request.
+    if const.FAST_PATH:
+        STORE.refresh(domain, functools.partial(scan, host=host))
+        return provisional(domain)
+
+    return None
+
+
+def analyze(domain: str) -> dict:
+    """
+    Get the score of a website. Known and stored domains are answered
+    right away (see lookup). Unknown domains are queued, answered with
+    a provisional score (see _start) or scanned, and concurrent requests
+    for the same domain share one scan.
+
+    :param domain: The url of the website (e.g. "https://shop.de").
+    :type domain: str
+    :return: The response data for the client.
+    :rtype: dict
+    """
+
+    host = canonical.hostname(domain)
+    domain = canonical.canonical(domain)
+
+    data = lookup(domain)
+    if data is not None:
+        return data
+
+    data = _start(domain, host)
+    if data is not None:
+        return data
+
+    # No entry -> calculate the score and store it.
+    entry = scan(domain, host=host)
+    if entry is None:
+        return unknown(domain)
+
+    return response(entry)
+
+
+def analyze_batch(domains: list[str]):
+    """
+    Get the scores of many websites at once, each domain like a request
+    of its own (see analyze). Known, stored, queued and provisionally
+    scored domains are answered first, the others are scanned
+    concurrently (each domain once) and answered as their scans finish.
+
+    :param domains: The urls of the websites, as sent by the client.
+    :type domains: list[str]
+    :return: A generator of (url, response data) pairs, one per url.
+    """
+
+    # Canonical domain -> urls of the request that map to it, and the
+    # host of the first url, which is scanned.
+    pending = {}
+    hosts = {}
+    answered = {}
+
+    for url in domains:
+        domain = canonical.canonical(url)
+        if domain in answered:
+            yield url, answered[domain]
+            continue
+        if domain in pending:
+            pending[domain].append(url)
+            continue
+
+        host = canonical.hostname(url)
+        data = lookup(domain)
+        if data is None:
+            data = _start(domain, host)
+
+        if data is not None:
+            answered[domain] = data
+            yield url, data
+        else:
+            pending[domain] = [url]
+            hosts[domain] = host
+
+    futures = {
+        _BATCH_EXECUTOR.submit(scan, domain, host=hosts[domain]): domain for domain in pending
+    }
+    for future in as_completed(futures):
+        domain = futures[future]
+        try:
+            entry = future.result()
+        except Exception as e:
+            LOGGER.error(f"Batch scan of '{domain}' failed: {e.__class__.__name__}: {e}")
+            entry = None
+
+        data = unknown(domain) if entry is None else response(entry)
+        for url in pending[domain]:
+            yield url, data
+
+
+def analyze_stream(domain: str):
+    """
+    Get the score of a website step by step. Known and stored domains
+    are answered at once. For unknown domains, a provisional score of
+    the fast model comes first, then the status of each source as the
+    scan proceeds, and finally the score.
+
+    :param domain: The url of the website (e.g. "https://shop.de").
+    :type domain: str
+    :return: A generator of (event, data) pairs. Events are
+        'provisional', 'source' and 'final'. None is yielded every
+        const.STREAM_HEARTBEAT seconds without news, so the caller can
+        keep the connection alive.
+    """
+
+    host = canonical.hostname(domain)
+    domain = canonical.canonical(domain)
+
+    data = lookup(domain)
+    if data is not None:
+        yield "final", data
+        return
+
+    resolver.prefetch(host)
+    yield "provisional", provisional(domain)
+
+    events = queue.Queue()
+
+    def _run():
+        try:
+            entry = scan(domain, lambda name, status: events.put(("source", {
+                "source": name,
+                "status": status,
+            })), host)
+        except Exception as e:
+            LOGGER.error(f"Streamed scan of '{domain}' failed: {e.__class__.__name__}: {e}")
+            entry = None
+
+        events.put(("final", unknown(domain) if entry is None else response(entry)))
+
+    # The scan goes on (and is stored) if the client disconnects.
+    threading.Thread(target=_run, name="stream-scan", daemon=True).start()
+
+    while True:
+        try:
+            event, data = events.get(timeout=const.STREAM_HEARTBEAT)
+        except queue.Empty:
+            yield None
+            continue
+
+        yield event, data
+        if event == "final":
+            return
+
+
+def cache_stats() -> dict:
+    """
+    Return the counters of all caches of the scan path.
+
+    :return: Cache name -> dict with hits, misses, hit_ratio and (if
+        known) size.
+    :rtype: dict
+    """
+
+    store = STORE.stats()
+    caches = {
+        "score_memory": store["memory"],
+        "score_database": store["database"],
+        "features": FEATURE_CACHE.stats(),
+        "negative": scrape.NEGATIVE_CACHE.stats(),
+        "aliases": canonical.ALIASES.stats(),
+        "dns": resolver.stats(),
+    }
+
+    for source in (
+        review.trustpilot,
+        review.scamadviser,
+        review.pagerank,
+        review.trustedshops,
+        registrar.whois_info,
+    ):
+        caches[f"source_{source.__name__}"] = source.cache.stats()
+
+    return caches
+
+
+def job(job_id: str) -> dict or None:
+    """
+    Get the status of a scan job and its result, once it is done.
+
+    :param job_id: The id returned by analyze.
+    :type job_id: str
+    :return: The job status ('queued', 'running', 'done' or 'failed')
+        and the response data of a finished job, or None if the job is
+        unknown (or expired).
+    :rtype: dict | None
+    """
+
+    data = JOBS.get(job_id)
+    if data is None:
+        return None
+
+    if data["status"] == "done":
+        return {**data["result"], "job": job_id, "status": "done"}
+
+    if data["status"] == "failed":
+        return {**unknown(data["domain"]), "job": job_id, "status": "failed"}
+
+    return {"domain": data["domain"], "job": job_id, "status": data["status"]}
 
 
 def feedback(domain: str, user_feedback: str) -> bool:
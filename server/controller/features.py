@@ -23,9 +23,11 @@ import requests
 from bs4 import BeautifulSoup
 
 
+from server import const
 from ..scan import domain_url, https_ssl, misc, registrar, review, script
-from ..utils import log
+from ..utils import cache, log, metrics, trace
 from . import scrape
+from .budget import ScanBudget
 
 # Root logger and log counter.
 if __name__ == "__main__":
@@ -36,6 +38,19 @@ else:
     # Child logger.
     LOGGER = logging.getLogger(__name__)
 
+# Feature groups of recently scanned domains: (domain, group) -> values.
+FEATURE_CACHE = cache.TTLCache(maxsize=const.FEATURE_CACHE_SIZE)
+
+SOURCE_SECONDS = metrics.Histogram(
+    "source_fetch_seconds", "Time to compute a feature group (source).", ("source",)
+)
+SOURCE_FAILURES = metrics.Counter(
+    "source_failures", "Feature groups (sources) without any value.", ("source",)
+)
+SOURCE_SKIPS = metrics.Counter(
+    "source_skips", "Feature groups (sources) skipped due to the scan budget.", ("source",)
+)
+
 
 class WebsiteFeatures:
     features_names = [
@@ -109,12 +124,61 @@ class WebsiteFeatures:
         # "ALL_ACCOUNTS", "SOCIAL_ACCOUNTS", "SOCIAL_ACCOUNTS2"
     ]
 
-    def __init__(self, domain: str):
+    # Feature groups in the order of features_names: (name, size). Each
+    # group is computed by the method '_group_<name>' and cached on its
+    # own for const.FEATURE_TTLS[name] seconds.
+    feature_groups = [
+        ("domain_url", 10),
+        ("https_ssl", 7),
+        ("script", 4),
+        ("misc", 3),
+        ("trustpilot", 2),
+        ("scamadviser", 4),
+        ("getsafeonline", 8),
+        ("pagerank", 2),
+        ("urlvoid", 3),
+        ("trustedshops", 3),
+        ("whois", 6),
+    ]
+
+    # Stages of the extraction, from cheap to expensive groups. Cheap
+    # groups only need the fetched page, medium ones one lookup, and
+    # expensive ones scrape third-party sites.
+    feature_stages = [
+        ("cheap", ["domain_url", "script", "misc"]),
+        ("medium", ["https_ssl", "whois", "pagerank"]),
+        (
+            "expensive",
+            ["trustpilot", "scamadviser", "getsafeonline", "urlvoid", "trustedshops"],
+        ),
+    ]
+
+    def __init__(self, domain: str, budget: ScanBudget = None, refresh: bool = False):
 
         self.domain = domain
         self.url = f"https://{domain}"
         self.alive = None
-
+        self.error = None
+
+        # Resource budget shared by all sources of this scan. Sources
+        # skipped because of it are listed in features_skipped.
+        self.budget = budget or ScanBudget()
+        self.features_skipped = []
+
+        # Pass refresh=True to ignore all cached feature groups.
+        self.refresh = refresh
+        self.groups_cached = []
+        self.groups_fetched = []
+        self.groups_failed = []
+        self.groups_skipped = []
+
+        # Outbound requests made per fetched group, and the stage after
+        # which the cascade stopped (see feature_extraction).
+        self.groups_requests = {}
+        self.stopped_after = None
+
+        # The website is only fetched if a group has to be recomputed
+        # (see initialization).
         self.response = None
         self.soup = None
 
@@ -123,155 +187,97 @@ class WebsiteFeatures:
         self.features_count = len(self.features_names)
         self.features_count_nan = len(self.features_names)
 
-        # Start the initialization process.
-        self.initialization()
-
-        # Stop here if website is not reachable during initialization.
-        if self.alive is False:
-            return
-
     def initialization(self):
 
         LOGGER.info("------------------ START -------------------")
         LOGGER.info(f"Domain: {self.domain}")
 
-        response = scrape.get(domain=self.domain)
+        with trace.span("scrape"):
+            response = scrape.get(domain=self.domain, budget=self.budget, learn_aliases=True)
 
+        self.alive = False
         if response:
+            self.error = response.error
             if response.success:
                 self.alive = True
                 self.response = response.response
                 self.soup = response.soup
 
-    def feature_extraction(self):
-
-        if self.alive:
-            LOGGER.info("Website is reachable. Starting feature extraction " "...")
-        else:
-            LOGGER.info("----------------- SKIPPING -----------------")
-            return
-
-        start_time = time.perf_counter()
-
-        # Domain specific features -> domain.py
-        self.features.append(domain_url.length_domain(self.domain))
-        self.features.append(domain_url.subdomain(self.domain))
-        self.features.append(domain_url.port(self.domain))
-        self.features.append(domain_url.at_symbol(self.domain))
-        self.features.append(domain_url.pre_suffix(self.domain))
-        self.features.append(domain_url.https_hostname(self.domain))
-        self.features.append(domain_url.ip_addr(self.domain))
-        self.features.append(domain_url.shortening_service(self.domain))
-        self.features.append(domain_url.redirecting(self.domain))
-        self.features.append(domain_url.suspicious_tld(self.domain))
+    def feature_extraction(self, judge=None, progress=None):
+        """
+        Extract all features of the website, stage by stage from cheap
+        to expensive groups. Fresh groups are taken from the cache.
 
-        # Security and HTML-Header features -> https.py
-        if encr := https_ssl.https_encrypted(self.domain):
-            self.features.append(True)  # HTTPS enabled (good)
-            self.features.append(encr.get("wildcard", True))
-        else:
-            self.features.append(False)  # HTTPS disabled (bad)
-            self.features.append(True)  # HTTPS wildcard enabled (bad)
+        With a judge, extraction stops early once the verdict is clear:
+        after each stage except the last, the judge scores the features
+        so far (missing ones as "NaN"). If the probability is below
+        const.CASCADE_LOW or above const.CASCADE_HIGH, the remaining
+        groups are skipped and stay "NaN".
 
-        sec_headers = https_ssl.security_headers(self.response)
-        self.features.append(sec_headers.get("strict-transport-security", "NaN"))
-        self.features.append(sec_headers.get("content-security-policy", "NaN"))
-        self.features.append(sec_headers.get("x-content-type-options", "NaN"))
-        self.features.append(sec_headers.get("x-frame-options", "NaN"))
-        self.features.append(sec_headers.get("secure-cookies", "NaN"))
-
-        # Script features -> script.py
-        self.features.append(script.statusbar_mouseover(self.response))
-        self.features.append(script.rightclick_disabled(self.response))
-        self.features.append(script.popup_window(self.response))
-        self.features.append(script.i_frame(self.response))
-
-        # General Website/HTML-Body features -> misc.py
-        self.features.append(misc.favicon_external(self.domain, self.soup))
-        self.features.append(misc.website_traffic(self.response))
-        self.features.append(misc.forwarding(self.response))
-
-        # TrustPilot -> review.py
-        tp_results = review.trustpilot(self.domain)
-        self.features.append(tp_results.get("rating", "NaN"))
-        self.features.append(tp_results.get("reviews_count", "NaN"))
-
-        # ScamAdviser -> review.py
-        sa_results = review.scamadviser(self.domain)
-        self.features.append(sa_results.get("rating", "NaN"))
-        self.features.append(sa_results.get("backlinks", "NaN"))
-        self.features.append(sa_results.get("website_speed", "NaN"))
-        self.features.append(sa_results.get("ssl_certificate_valid", "NaN"))
-
-        # VirusTotal -> review.py REMOVED DUE TO API LIMITS.
-        # vt_results = review.virustotal(self.domain)
-        # self.features.append(vt_results.get("popularity", "NaN").get(
-        # "Statvoo",
-        #                                                              "NaN"
-        #                                                              )
-        #                      )
-        # self.features.append(vt_results.get("popularity", "NaN").get("Alexa",
-        #                                                              "NaN"
-        #                                                              )
-        #                      )
-        # self.features.append(
-        #         vt_results.get("popularity", "NaN").get("Cisco Umbrella",
-        #                                                 "NaN"
-        #                                                 )
-        #         )
-        #
-        # self.features.append(vt_results.get("security", "NaN").get(
-        # "harmless",
-        #                                                            "NaN"
-        #                                                            )
-        #                      )
-        # self.features.append(vt_results.get("security", "NaN").get(
-        # "malicious",
-        #                                                            "NaN"
-        #                                                            )
-        #                      )
-        # self.features.append(
-        #         vt_results.get("security", "NaN").get("suspicious",
-        #                                               "NaN"
-        #                                               )
-        #         )
+        :param judge: Function taking features and names and returning
+            the probability that the website is trustworthy (e.g.
+            ai.predict). Default: no early stop.
+        :param progress: Function called with the name of a feature
+            group and its status ('cached', 'done', 'failed' or
+            'skipped') as soon as the group is finished.
+        """
 
-        # GetSafeOnline -> review.py
-        gso_results = review.getsafeonline(self.domain)
-        self.features.append(gso_results.get("Maltiverse", "NaN"))
-        self.features.append(gso_results.get("APWG", "NaN"))
-        self.features.append(gso_results.get("Complytron", "NaN"))
-        self.features.append(gso_results.get("DNSFilter", "NaN"))
-        self.features.append(gso_results.get("FlashStart", "NaN"))
-        self.features.append(gso_results.get("IQ Global", "NaN"))
-        self.features.append(gso_results.get("Pulsedive", "NaN"))
-        self.features.append(gso_results.get("Quad9", "NaN"))
+        progress = progress or (lambda name, status: None)
 
-        # PageRank -> review.py
-        pr_results = review.pagerank(self.domain)
-        self.features.append(pr_results.get("global_rank", "NaN"))
-        self.features.append(pr_results.get("page_rank", "NaN"))
+        start_time = time.perf_counter()
 
-        # URLVoid -> review.py
-        uv_results = review.urlvoid(self.domain)
-        self.features.append(uv_results.get("detections", "NaN"))
-        self.features.append(uv_results.get("sites_hosted_same_ip", "NaN"))
-        self.features.append(uv_results.get("sites_hosted_same_ip_detections", "NaN"))
+        # Take all groups that are still fresh from the cache.
+        groups = {}
+        if not self.refresh:
+            for name, _ in self.feature_groups:
+                values = FEATURE_CACHE.get((self.domain, name))
+                if values is not None:
+                    groups[name] = values
+
+        self.groups_cached = list(groups)
+        for name in groups:
+            progress(name, "cached")
+
+        # Recompute the stale groups. Fetch the website first, to make
+        # sure it is still reachable.
+        if len(groups) < len(self.feature_groups):
+            self.initialization()
+
+            if self.alive:
+                LOGGER.info("Website is reachable. Starting feature extraction " "...")
+            else:
+                LOGGER.info("----------------- SKIPPING -----------------")
+                return
+
+            for stage, names in self.feature_stages:
+                for name in names:
+                    if name not in groups:
+                        groups[name] = self._extract_group(name)
+                        if name in self.groups_skipped:
+                            progress(name, "skipped")
+                        elif name in self.groups_failed:
+                            progress(name, "failed")
+                        else:
+                            progress(name, "done")
+
+                if judge is None or stage == self.feature_stages[-1][0]:
+                    continue
+
+                probability = judge(self.merge(groups, normalize=True), self.features_names)
+                if not const.CASCADE_LOW < probability < const.CASCADE_HIGH:
+                    LOGGER.info(f"Verdict is clear after stage '{stage}' ({probability:.2f}).")
+                    self.stopped_after = stage
+                    for name, _ in self.feature_groups:
+                        if name not in groups:
+                            progress(name, "skipped")
+                    break
 
-        # TrustedShops -> review.py
-        ts_results = review.trustedshops(self.domain)
-        self.features.append(ts_results.get("trusted", "NaN"))
-        self.features.append(ts_results.get("rating", "NaN"))
-        self.features.append(ts_results.get("reviews_count", "NaN"))
+        else:
+            LOGGER.info(f"All feature groups of {self.domain} are cached.")
+            self.alive = True
 
-        # WHOIS -> registrar.py
-        whois_results = registrar.whois_info(self.domain)
-        self.features.append(whois_results.get("created_months", "NaN"))
-        self.features.append(whois_results.get("last_updated_months", "NaN"))
-        self.features.append(whois_results.get("expires_in_months", "NaN"))
-        self.features.append(whois_results.get("dnssec", "NaN"))
-        self.features.append(whois_results.get("country", "NaN"))
-        self.features.append(whois_results.get("domain_privacy", "NaN"))
+        # Merge the groups into one feature vector.
+        self.features = self.merge(groups)
 
         end_time = time.perf_counter()
         elapsed_time = end_time - start_time
@@ -293,10 +299,215 @@ class WebsiteFeatures:
                 # Save modified feature back into list.
                 self.features[index] = feature * 1
 
+        self.features_skipped = list(self.budget.skipped)
+        if self.features_skipped:
+            LOGGER.info(f"Skipped due to scan budget: {', '.join(self.features_skipped)}")
+
+        LOGGER.info(
+            f"Feature groups: {len(self.groups_fetched)} fetched, "
+            f"{len(self.groups_cached)} cached."
+        )
         LOGGER.info(f"Features (without NaN): {self.features_count}/" f"{self.features_count_nan}")
+        LOGGER.info(f"Budget used: {self.budget.summary()}")
         LOGGER.info(f"Total Time elapsed: {elapsed_time:.2f} s")
         LOGGER.info("------------------- END --------------------")
 
+    def _extract_group(self, name: str) -> list:
+        """
+        Compute a feature group and cache it for its TTL. Groups that
+        are complete are cached. Groups skipped because of the budget,
+        failed groups (no value) and partly filled groups are not, so
+        the next scan computes them again.
+
+        :param name: The name of the group (see feature_groups).
+        :type name: str
+        :return: The feature values of the group.
+        :rtype: list
+        :raises: ValueError if the group has the wrong number of values.
+        """
+
+        requests_before = self.budget.requests
+        skipped_before = len(self.budget.skipped)
+        with SOURCE_SECONDS.time(name), trace.span(f"group.{name}"):
+            values = getattr(self, f"_group_{name}")()
+
+        # A wrong size would shift all following features of the vector.
+        if len(values) != dict(self.feature_groups)[name]:
+            raise ValueError(f"Feature group '{name}' has {len(values)} values.")
+
+        self.groups_fetched.append(name)
+        self.groups_requests[name] = self.budget.requests - requests_before
+
+        # A source of the group (named after the group or not, e.g. the
+        # favicon of misc) was skipped because of the budget.
+        if name in self.budget.skipped or len(self.budget.skipped) > skipped_before:
+            self.groups_skipped.append(name)
+            SOURCE_SKIPS.labels(name).inc()
+            return values
+
+        missing = sum(value in (None, "", "NaN") for value in values)
+        if missing == len(values):
+            self.groups_failed.append(name)
+            SOURCE_FAILURES.labels(name).inc()
+        elif missing == 0:
+            FEATURE_CACHE.set((self.domain, name), values, ttl=const.FEATURE_TTLS[name])
+
+        return values
+
+    @classmethod
+    def merge(cls, groups: dict, normalize: bool = False) -> list:
+        """
+        Merge feature groups into one vector in the order of
+        features_names. Missing groups are filled with "NaN".
+
+        :param groups: Group name -> feature values.
+        :type groups: dict
+        :param normalize: Pass True to also replace None and "" with
+            "NaN" and convert bool to int, as done for the final vector.
+        :type normalize: bool
+        :return: The feature vector.
+        :rtype: list
+        """
+
+        features = []
+        for name, size in cls.feature_groups:
+            features.extend(groups.get(name, ["NaN"] * size))
+
+        if normalize:
+            for index, value in enumerate(features):
+                if value is None or value == "":
+                    features[index] = "NaN"
+                elif value in [True, False]:
+                    features[index] = value * 1
+
+        return features
+
+    def _group_domain_url(self) -> list:
+        # Domain specific features -> domain.py
+        return [
+            domain_url.length_domain(self.domain),
+            domain_url.subdomain(self.domain),
+            domain_url.port(self.domain),
+            domain_url.at_symbol(self.domain),
+            domain_url.pre_suffix(self.domain),
+            domain_url.https_hostname(self.domain),
+            domain_url.ip_addr(self.domain),
+            domain_url.shortening_service(self.domain),
+            domain_url.redirecting(self.domain),
+            domain_url.suspicious_tld(self.domain),
+        ]
+
+    def _group_https_ssl(self) -> list:
+        # Security and HTML-Header features -> https.py
+        encr = https_ssl.https_encrypted(self.domain, budget=self.budget)
+        if encr is None:
+            values = ["NaN", "NaN"]  # Skipped or timed out (unknown)
+        elif encr:
+            values = [True, encr.get("wildcard", True)]  # HTTPS enabled (good)
+        else:
+            values = [False, True]  # HTTPS disabled, wildcard enabled (bad)
+
+        sec_headers = https_ssl.security_headers(self.response)
+        return values + [
+            sec_headers.get("strict-transport-security", "NaN"),
+            sec_headers.get("content-security-policy", "NaN"),
+            sec_headers.get("x-content-type-options", "NaN"),
+            sec_headers.get("x-frame-options", "NaN"),
+            sec_headers.get("secure-cookies", "NaN"),
+        ]
+
+    def _group_script(self) -> list:
+        # Script features -> script.py
+        return [
+            script.statusbar_mouseover(self.response),
+            script.rightclick_disabled(self.response),
+            script.popup_window(self.response),
+            script.i_frame(self.response),
+        ]
+
+    def _group_misc(self) -> list:
+        # General Website/HTML-Body features -> misc.py
+        return [
+            misc.favicon_external(self.domain, self.soup, self.budget),
+            misc.website_traffic(self.response),
+            misc.forwarding(self.response),
+        ]
+
+    def _group_trustpilot(self) -> list:
+        # TrustPilot -> review.py
+        tp_results = review.trustpilot(self.domain, budget=self.budget)
+        return [
+            tp_results.get("rating", "NaN"),
+            tp_results.get("reviews_count", "NaN"),
+        ]
+
+    def _group_scamadviser(self) -> list:
+        # ScamAdviser -> review.py
+        sa_results = review.scamadviser(self.domain, budget=self.budget)
+        return [
+            sa_results.get("rating", "NaN"),
+            sa_results.get("backlinks", "NaN"),
+            sa_results.get("website_speed", "NaN"),
+            sa_results.get("ssl_certificate_valid", "NaN"),
+        ]
+
+    # VirusTotal -> review.py REMOVED DUE TO API LIMITS.
+    # vt_results = review.virustotal(self.domain)
+    # "Statvoo", "Alexa", "Cisco Umbrella" (popularity) and "harmless",
+    # "malicious", "suspicious" (security).
+
+    def _group_getsafeonline(self) -> list:
+        # GetSafeOnline -> review.py
+        gso_results = review.getsafeonline(self.domain, budget=self.budget)
+        return [
+            gso_results.get("Maltiverse", "NaN"),
+            gso_results.get("APWG", "NaN"),
+            gso_results.get("Complytron", "NaN"),
+            gso_results.get("DNSFilter", "NaN"),
+            gso_results.get("FlashStart", "NaN"),
+            gso_results.get("IQ Global", "NaN"),
+            gso_results.get("Pulsedive", "NaN"),
+            gso_results.get("Quad9", "NaN"),
+        ]
+
+    def _group_pagerank(self) -> list:
+        # PageRank -> review.py
+        pr_results = review.pagerank(self.domain, budget=self.budget)
+        return [
+            pr_results.get("global_rank", "NaN"),
+            pr_results.get("page_rank", "NaN"),
+        ]
+
+    def _group_urlvoid(self) -> list:
+        # URLVoid -> review.py
+        uv_results = review.urlvoid(self.domain, budget=self.budget)
+        return [
+            uv_results.get("detections", "NaN"),
+            uv_results.get("sites_hosted_same_ip", "NaN"),
+            uv_results.get("sites_hosted_same_ip_detections", "NaN"),
+        ]
+
+    def _group_trustedshops(self) -> list:
+        # TrustedShops -> review.py
+        ts_results = review.trustedshops(self.domain, budget=self.budget)
+        return [
+            ts_results.get("trusted", "NaN"),
+            ts_results.get("rating", "NaN"),
+            ts_results.get("reviews_count", "NaN"),
+        ]
+
+    def _group_whois(self) -> list:
+        # WHOIS -> registrar.py
+        whois_results = registrar.whois_info(self.domain, budget=self.budget)
+        return [
+            whois_results.get("created_months", "NaN"),
+            whois_results.get("last_updated_months", "NaN"),
+            whois_results.get("expires_in_months", "NaN"),
+            whois_results.get("dnssec", "NaN"),
+            whois_results.get("country", "NaN"),
+            whois_results.get("domain_privacy", "NaN"),
+        ]
+
 
 if __name__ == "__main__":
     # obj = WebsiteFeatures("11trikots.com")
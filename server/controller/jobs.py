@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+"""
+jobs.py: Durable scan job queue and scan worker processes.
+
+With const.JOB_QUEUE, API workers do not scan themselves. They put a
+job into a queue stored in SQLite and answer right away (202 and the
+job id), while a separate pool of scan worker processes takes jobs from
+the queue, scans and stores the result. Clients poll the job for the
+result. This way the number of API workers and the number of
+concurrent scans can be scaled independently. Jobs survive restarts,
+and jobs of crashed workers are picked up again after
+const.JOB_TIMEOUT seconds.
+
+Start the scan workers with: python -m server.controller.jobs [n]
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-23"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from server import const
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    domain TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_domain
+    ON jobs (domain) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """
+    Scan jobs stored in a SQLite database, shared by all processes on
+    this host. Every job is one of: queued, running, done or failed.
+    There is at most one queued or running job per domain.
+
+    :ivar str path: The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str = const.JOB_DB_FILE) -> None:
+        self.path = path
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        """
+        Open a connection for one transaction. Connections are not
+        shared, so the queue can be used from threads and forked
+        processes alike.
+        """
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+
+        try:
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._ready = True
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def submit(self, domain: str) -> str:
+        """
+        Queue a scan of a domain. If the domain is already queued or
+        being scanned, the existing job is returned instead.
+
+        :param domain: The canonical domain.
+        :type domain: str
+        :return: The id of the job.
+        :rtype: str
+        """
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE domain = ? AND status IN ('queued', 'running')",
+                (domain,),
+            ).fetchone()
+            if row is not None:
+                return row["id"]
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (id, domain, status, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, domain, now, now),
+            )
+
+        LOGGER.debug(f"Queued scan job {job_id} for {domain}.")
+        return job_id
+
+    def claim(self, worker: str) -> dict or None:
+        """
+        Take the oldest queued job and mark it as running.
+
+        :param worker: The name of the claiming worker.
+        :type worker: str
+        :return: The job (id, domain, attempts), or None if the queue
+            is empty.
+        :rtype: dict | None
+        """
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, domain, attempts FROM jobs WHERE status = 'queued' "
+                "ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (worker, time.time(), row["id"]),
+            )
+
+        return dict(row)
+
+    def complete(self, job_id: str, result: dict) -> None:
+        """
+        Mark a job as done and store its result.
+
+        :param job_id: The id of the job.
+        :type job_id: str
+        :param result: The response data for the client.
+        :type result: dict
+        :return: None
+        """
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(result, default=str), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        """
+        Mark a job as failed.
+
+        :param job_id: The id of the job.
+        :type job_id: str
+        :param error: A description of the error.
+        :type error: str
+        :return: None
+        """
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (error, time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> dict or None:
+        """
+        Look up a job.
+
+        :param job_id: The id of the job.
+        :type job_id: str
+        :return: The job (id, domain, status, result, error), or None.
+        :rtype: dict | None
+        """
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, domain, status, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def recover(self) -> int:
+        """
+        Requeue jobs running longer than const.JOB_TIMEOUT seconds (the
+        worker probably crashed), or fail them after
+        const.JOB_MAX_ATTEMPTS attempts. Also delete finished jobs older
+        than const.JOB_RESULT_TTL seconds.
+
+        :return: Number of requeued jobs.
+        :rtype: int
+        """
+
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'timeout', updated_at = ? "
+                "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                (now, now - const.JOB_TIMEOUT, const.JOB_MAX_ATTEMPTS),
+            )
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, updated_at = ? "
+                "WHERE status = 'running' AND updated_at < ?",
+                (now, now - const.JOB_TIMEOUT),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (now - const.JOB_RESULT_TTL,),
+            )
+
+        if requeued:
+            LOGGER.warning(f"Requeued {requeued} scan jobs of unresponsive workers.")
+
+        return requeued
+
+    def stats(self) -> dict:
+        """
+        Return the number of jobs per status.
+
+        :return: A dict with queued, running, done and failed.
+        :rtype: dict
+        """
+
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+            counts = {row["status"]: row["n"] for row in rows}
+
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
+
+
+# The job queue of this host.
+JOBS = JobQueue()
+
+
+def worker(stop=None) -> None:
+    """
+    Scan worker loop: Take jobs from the queue, scan the domain, store
+    the score and the job result. Runs until stop is set.
+
+    :param stop: Event stopping the loop. Default: run forever.
+    :return: None
+    """
+
+    # Imported here, so the API process can import the queue without
+    # loading the scanners and the model.
+    from . import controller
+
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    last_recover = 0.0
+    LOGGER.info(f"Scan worker {name} started.")
+
+    while stop is None or not stop.is_set():
+        if time.monotonic() - last_recover > const.JOB_TIMEOUT / 2:
+            JOBS.recover()
+            last_recover = time.monotonic()
+
+        job = JOBS.claim(name)
+        if job is None:
+            time.sleep(const.JOB_POLL)
+            continue
+
+        try:
+            entry = controller.scan(job["domain"])
+            if entry is None:
+                result = controller.unknown(job["domain"])
+            else:
+                result = controller.response(entry)
+            JOBS.complete(job["id"], result)
+
+        except Exception as e:
+            LOGGER.error(f"Scan job {job['id']} failed: {e.__class__.__name__}: {e}")
+            JOBS.fail(job["id"], f"{e.__class__.__name__}: {e}")
+
+
+def _worker_process(stop) -> None:
+    # The parent handles Ctrl+C and stops all workers through the event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker(stop)
+
+
+def run(workers: int = const.JOB_WORKERS) -> None:
+    """
+    Start a pool of scan worker processes and wait for them.
+
+    :param workers: Number of worker processes.
+    :type workers: int
+    :return: None
+    """
+
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    processes = [
+        ctx.Process(target=_worker_process, args=(stop,), name=f"scan-worker-{i}")
+        for i in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else const.JOB_WORKERS)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""
+scheduler.py: Refresh popular score entries before they expire.
+
+Entries older than secrets.DB_RETENTION days are rescanned when they
+are requested. For popular domains that rescan should happen before,
+not on a user's request. Every process counts the requests per domain
+and adds them to the entries in the database each round, where they
+decay over time. One process, the holder of the database lease
+const.REFRESH_LEASE, then refreshes the most requested entries close to
+expiry, most popular and closest to expiry first. The refreshes run on
+the worker pool of the score store, at a limited rate.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-22"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import errors
+
+from server import const
+from server.secrets import secrets
+from server.utils.limiter import TokenBucket
+from .store import STORE
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """
+    Request counter and background loop refreshing score entries that
+    are about to expire.
+
+    :ivar TokenBucket bucket: Limits the rate of refreshes.
+    :ivar bool leader: True if this process held the refresh lease in
+        the last round.
+    :ivar int rounds: Finished scheduling rounds.
+    :ivar int scheduled: Refreshes handed to the score store.
+    """
+
+    def __init__(self) -> None:
+        self.bucket = TokenBucket(rate=const.REFRESH_RATE, capacity=const.REFRESH_BURST)
+        self.leader = False
+        self.rounds = 0
+        self.scheduled = 0
+
+        # Domain -> requests not yet added to the database.
+        self._hits = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._compute = None
+
+    def touch(self, domain: str) -> None:
+        """
+        Count a request for a domain.
+
+        :param domain: The canonical domain.
+        :type domain: str
+        :return: None
+        """
+
+        with self._lock:
+            # Drop new domains if too many wait for the next round.
+            if domain in self._hits or len(self._hits) < const.REFRESH_TRACKED:
+                self._hits[domain] = self._hits.get(domain, 0) + 1
+
+    def flush(self) -> int:
+        """
+        Add the requests counted since the last round to the entries in
+        the database. Counts are dropped if the database fails.
+
+        :return: Number of domains counted.
+        :rtype: int
+        """
+
+        with self._lock:
+            hits, self._hits = self._hits, {}
+
+        try:
+            STORE.add_hits(hits)
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not store request counts: {str(e)}.")
+
+        return len(hits)
+
+    def candidates(self) -> list[tuple[float, str]]:
+        """
+        Find the most requested domains in the database whose entries
+        expire within const.REFRESH_WINDOW seconds (or have already
+        expired).
+
+        :return: (priority, domain) pairs, highest priority first. The
+            priority grows with the request count and shrinks with the
+            time left until expiry.
+        :rtype: list[tuple[float, str]]
+        :raises: pymongo.errors.PyMongoError if the database fails.
+        """
+
+        entries = STORE.expiring(
+            const.REFRESH_WINDOW, const.REFRESH_MIN_HITS, const.REFRESH_CANDIDATES
+        )
+
+        retention = timedelta(days=secrets.DB_RETENTION)
+        result = []
+        for entry in entries:
+            left = (entry["updated_at"] + retention - datetime.now()).total_seconds()
+            result.append((entry["hits"] / (1 + max(left, 0) / 3600), entry["domain"]))
+
+        result.sort(reverse=True)
+        return result
+
+    def run_once(self) -> int:
+        """
+        Run one scheduling round: Store the request counts. If this
+        process holds the refresh lease, let all counts decay and
+        refresh the candidates in order of priority, at most
+        const.REFRESH_BATCH and at the rate of the token bucket.
+
+        :return: Number of refreshes started.
+        :rtype: int
+        """
+
+        self.flush()
+
+        # The lease outlives a round of refreshes and the pause after
+        # it, but not a dead holder for long.
+        ttl = 2 * const.REFRESH_INTERVAL + const.REFRESH_BATCH / const.REFRESH_RATE
+        self.leader = STORE.acquire_lease(const.REFRESH_LEASE, ttl=ttl)
+        if not self.leader:
+            with self._lock:
+                self.rounds += 1
+            return 0
+
+        STORE.decay_hits(0.5 ** (const.REFRESH_INTERVAL / const.REFRESH_HALF_LIFE))
+
+        started = 0
+        for priority, domain in self.candidates()[: const.REFRESH_BATCH]:
+            if self._stop.wait(self.bucket.reserve()):
+                break
+
+            if STORE.refresh(domain, self._compute):
+                started += 1
+                LOGGER.debug(f"Scheduled refresh of {domain} (priority {priority:.2f}).")
+
+        with self._lock:
+            self.rounds += 1
+            self.scheduled += started
+
+        return started
+
+    def _run(self) -> None:
+        while not self._stop.wait(const.REFRESH_INTERVAL):
+            try:
+                self.run_once()
+            except Exception as e:
+                LOGGER.error(f"Refresh scheduler round failed: {e.__class__.__name__}: {e}")
+
+    def start(self, compute) -> None:
+        """
+        Start the scheduler thread. Safe to call twice.
+
+        :param compute: Function taking the domain, which rescans and
+            stores it (see ScoreStore.refresh).
+        :return: None
+        """
+
+        self._compute = compute
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="refresh-scheduler", daemon=True)
+        self._thread.start()
+        LOGGER.debug("Started refresh scheduler.")
+
+    def stop(self) -> None:
+        """
+        Stop the scheduler thread after the current refresh.
+
+        :return: None
+        """
+
+        self._stop.set()
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the scheduler.
+
+        :return: A dict with tracked (domains with requests not yet
+            stored), leader, rounds and scheduled.
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                "tracked": len(self._hits),
+                "leader": self.leader,
+                "rounds": self.rounds,
+                "scheduled": self.scheduled,
+            }
+
+
+# The process-wide refresh scheduler.
+SCHEDULER = RefreshScheduler()
@@ -16,6 +16,7 @@ __status__ = "Development"
 __github__ = "https://github.com/Lennolium/simple-header"
 
 # Imports.
+import functools
 import os.path
 import pathlib
 import json
@@ -24,16 +25,17 @@ import re
 import random
 
 import httpx
-import cloudscraper
-import waybackpy
 
-import simple_header
+# cloudscraper, waybackpy and simple_header are imported where they are
+# first used: together they take about half a second to import.
 from bs4 import BeautifulSoup
 from urllib.parse import quote
 
-from server.utils import log
+from server.utils import cache, canonical, limiter, log, metrics, trace
 from server import const
 from server.data import exceptions
+from server.scan import initialization
+from server.controller.budget import ScanBudget
 
 # Root logger and log counter.
 if __name__ == "__main__":
@@ -45,6 +47,171 @@ else:
     LOGGER = logging.getLogger(__name__)
 
 
+# Verdicts of domains that failed recently (domain -> exception). Each
+# exception class is cached for its own TTL (const.NEGATIVE_TTLS).
+NEGATIVE_CACHE = cache.TTLCache(maxsize=const.NEGATIVE_CACHE_SIZE)
+
+# Attempts to get past Cloudflare, per tool or service and result.
+BYPASSES = metrics.Counter("bypass_attempts", "Cloudflare bypass attempts.", ("service", "result"))
+
+
+def negative_ttl(error: Exception) -> float or None:
+    """
+    Look up how long the verdict of an exception is cached. Subclasses
+    inherit the TTL of their closest configured base class.
+
+    :param error: The exception that ended the scraping process.
+    :type error: Exception
+    :return: The TTL in seconds, or None if it is not cached.
+    :rtype: float | None
+    """
+
+    for cls in type(error).__mro__:
+        if cls.__name__ in const.NEGATIVE_TTLS:
+            return const.NEGATIVE_TTLS[cls.__name__]
+
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def user_agents() -> tuple:
+    """
+    The 10 most common user agents, the pool our request headers are
+    generated from. Read once per process.
+
+    :return: The user agents.
+    :rtype: tuple
+    """
+
+    import simple_header
+
+    return tuple(simple_header.sua.get(num=10, mobile=False, force_cached=True))
+
+
+# Headers describing the transfer of the original body, which do not
+# apply to the decoded (and maybe truncated) body we keep.
+_TRANSFER_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def _read_body(chunks, max_body_size: int, url) -> tuple[bytes, bool, bool]:
+    """
+    Read decoded body chunks up to max_body_size bytes. The first bytes
+    are checked for Cloudflare signatures before the rest is read.
+
+    :param chunks: Iterator over the decoded body chunks.
+    :param max_body_size: Maximum number of bytes to keep.
+    :type max_body_size: int
+    :param url: The url of the response (for the exception).
+    :return: The body, True if it was truncated, and True if it is a
+        Cloudflare challenge page (the download stops there).
+    :rtype: tuple[bytes, bool, bool]
+    :raises: CloudflareFlaggedError.
+    """
+
+    body = bytearray()
+    truncated = challenge = checked = False
+
+    for chunk in chunks:
+        body.extend(chunk)
+
+        if not checked and len(body) >= const.SIGNATURE_WINDOW:
+            checked = True
+            challenge = ResponseHandler.signature_check(bytes(body), url)
+            if challenge:
+                break
+
+        if len(body) > max_body_size:
+            del body[max_body_size:]
+            truncated = True
+            break
+
+    if not checked:
+        challenge = ResponseHandler.signature_check(bytes(body), url)
+
+    return bytes(body), truncated, challenge
+
+
+def fetch(client: httpx.Client, method: str, url: str, max_body_size: int = None, **kwargs):
+    """
+    Send a request with httpx and stream the body instead of loading it
+    into memory at once. At most max_body_size decoded bytes are kept.
+    The returned response has two extra attributes: 'truncated' (body
+    cut at the size limit) and 'challenge' (Cloudflare challenge page).
+
+    :param client: The httpx client to send the request with.
+    :type client: httpx.Client
+    :param method: The HTTP method, e.g. "GET".
+    :type method: str
+    :param url: The url of the request.
+    :type url: str
+    :param max_body_size: Maximum body size in bytes. Default:
+        const.MAX_BODY_SIZE.
+    :type max_body_size: int
+    :param kwargs: Passed on to httpx.Client.stream.
+    :return: A response object holding the (maybe truncated) body.
+    :rtype: httpx.Response
+    :raises: CloudflareFlaggedError, httpx.HTTPError.
+    """
+
+    if max_body_size is None:
+        max_body_size = const.MAX_BODY_SIZE
+
+    with client.stream(method, url, **kwargs) as streamed:
+        body, truncated, challenge = _read_body(streamed.iter_bytes(), max_body_size, streamed.url)
+
+    headers = [
+        (key, value)
+        for key, value in streamed.headers.multi_items()
+        if key.lower() not in _TRANSFER_HEADERS
+    ]
+    response = httpx.Response(
+        status_code=streamed.status_code,
+        headers=headers,
+        content=body,
+        request=streamed.request,
+        history=streamed.history,
+    )
+    response.truncated = truncated
+    response.challenge = challenge
+
+    if truncated:
+        LOGGER.info(f"Body of '{url}' truncated at {max_body_size} bytes.")
+
+    return response
+
+
+def read_capped(response, max_body_size: int = None):
+    """
+    Same as fetch() for a requests response sent with stream=True (used
+    by cloudscraper): Read at most max_body_size bytes of the body.
+
+    :param response: A requests response sent with stream=True.
+    :type response: requests.Response
+    :param max_body_size: Maximum body size in bytes. Default:
+        const.MAX_BODY_SIZE.
+    :type max_body_size: int
+    :return: The same response with the (maybe truncated) body loaded.
+    :rtype: requests.Response
+    :raises: CloudflareFlaggedError.
+    """
+
+    if max_body_size is None:
+        max_body_size = const.MAX_BODY_SIZE
+
+    try:
+        chunks = response.iter_content(chunk_size=const.SIGNATURE_WINDOW)
+        body, truncated, challenge = _read_body(chunks, max_body_size, response.url)
+    finally:
+        response.close()
+
+    # Hand the body to requests, so .content and .text work as usual.
+    response._content = body
+    response.truncated = truncated
+    response.challenge = challenge
+
+    return response
+
+
 class WebScraperContext:
     """
     This class serves as the context for the WebScraper object. It is
@@ -55,12 +222,19 @@ class WebScraperContext:
         website.
     :ivar int timeout_tools: Timeout for the internal scraping tools.
     :ivar int timeout_services: Timeout for external scraping services.
+    :ivar int max_body_size: Maximum number of bytes read from a body.
     :ivar str domain: The domain of the website to be scraped.
     :ivar bool force_services: If True, only use external services.
+    :ivar bool learn_aliases: If True, learn aliases from the redirects
+        of the website (see canonical.learn).
+    :ivar ScanBudget budget: The resource budget of the scan, charged
+        for every outbound request.
     :ivar str url: The URL of the website to be scraped.
     :ivar str url_encoded: The URL of the website to be scraped, encoded
         for use in a URL.
     :ivar dict headers: The headers used for the request to the website.
+    :ivar ProbeResult probe: The cached result of the reachability
+        probe (protocol, TLS verification, Cloudflare).
     :ivar bool success: True if the scraping process was successful,
         otherwise False.
     :ivar httpx.Response response: The response object of the website.
@@ -71,16 +245,20 @@ class WebScraperContext:
     timeout_connect = None
     timeout_tools = None
     timeout_services = None
+    max_body_size = None
 
     def __init__(self) -> None:
         # Input.
         self.domain = None
         self.force_services = None
+        self.learn_aliases = None
+        self.budget = None
 
         # Properties.
         self.url = None
         self.url_encoded = None
         self.headers = None
+        self.probe = None
         self.success = None
 
         # Results.
@@ -99,9 +277,12 @@ class WebScraperContext:
             f"WebScraperContext("
             f"domain={self.domain!r}, "
             f"force_services={self.force_services!r}, "
+            f"learn_aliases={self.learn_aliases!r}, "
+            f"budget={self.budget!s}, "
             f"url={self.url!r}, "
             f"url_encoded={self.url_encoded!r}, "
             f"headers={self.headers!r}, "
+            f"probe={self.probe!s}, "
             f"success={self.success!r}, "
             f"response={self.response!r}, "
             f"soup={self.soup!r})"
@@ -140,10 +321,12 @@ class ConnectionManager:
         :rtype: list[dict[str, str]]
         """
 
+        import simple_header
+
         # Getting the 10 most common user agents and their corresponding
         # plausible, fake browser headers.
         headers = []
-        for i, ua in enumerate(simple_header.sua.get(num=10, mobile=False, force_cached=True)):
+        for i, ua in enumerate(user_agents()):
             headers.append(
                 simple_header.get_dict(url=url, user_agent=ua, seed=None if i < 7 else i)
             )
@@ -160,28 +343,62 @@ class ConnectionManager:
         :type domain: str
         :return: A response object if successful, otherwise exception.
         :rtype: httpx.Response | NotReachableError.
-        :raises: NotReachableError.
+        :raises: NotReachableError, BudgetExceededError if the website
+            did not answer within a timeout shortened by the budget (no
+            verdict on the website, so it is not cached).
         """
 
         if domain.startswith(("http://", "https://")):
             domain = domain.split("://", maxsplit=1)[1]
 
-        for protocol in ("https://", "http://"):
-            ssl_verify = True if protocol == "https://" else False
+        # The probe is cached per domain, so repeated connections (e.g.
+        # to review sites) do not figure out protocol and TLS again.
+        probe = initialization.probe(domain, budget=self.ctx.budget)
+        self.ctx.probe = probe
+
+        if not probe.reachable:
+            if probe.clamped:
+                raise exceptions.BudgetExceededError("time")
+            raise exceptions.NotReachableError(domain)
+
+        # Like the probe: A GET failing within a timeout shortened by
+        # the budget says nothing about the website.
+        clamped = False
+
+        def get(client, url, timeout, **kwargs):
+            nonlocal clamped
+            clamped = clamped or timeout < self.ctx.timeout_connect
+            return fetch(client, "GET", url, timeout=timeout, **kwargs)
+
+        # Start with the protocol that answered the probe. Plain HTTP
+        # stays the fallback if HTTPS answers the probe but not the GET.
+        if probe.protocol == "https://":
+            protocols = ("https://", "http://")
+        else:
+            protocols = ("http://",)
+
+        for protocol in protocols:
+            ssl_verify = probe.verify_ok if protocol == "https://" else False
             url = f"{protocol}{domain}"
 
             # Take the most plausible and common header. Otherwise,
             # shuffle the headers and take a random one.
             headers = random.SystemRandom().choice(self.generate_headers(url=url))
 
+            self.ctx.budget.check()
+
             try:
                 with httpx.Client(verify=ssl_verify) as client:
-                    response = client.get(
-                        url=url,
+                    response = limiter.call(
+                        functools.partial(get, client),
+                        url,
+                        max_body_size=self.ctx.max_body_size,
                         headers=headers,
+                        budget=self.ctx.budget,
                         timeout=self.ctx.timeout_connect,
                         follow_redirects=True,
                     )
+                self.ctx.budget.charge(nbytes=len(response.content))
 
                 # Failed status code: Try next without SSL.
                 if response.status_code != 200:
@@ -203,6 +420,8 @@ class ConnectionManager:
                 continue
 
         else:
+            if clamped:
+                raise exceptions.BudgetExceededError("time")
             raise exceptions.NotReachableError(domain)
 
 
@@ -225,6 +444,31 @@ class ResponseHandler:
         """
         self.ctx = ctx
 
+    @staticmethod
+    def signature_check(snippet: bytes or str, url) -> bool:
+        """
+        Checks the beginning of a page for Cloudflare signatures. This
+        only needs the first chunk of the body, so it runs before the
+        rest is downloaded.
+
+        :param snippet: The first bytes (or characters) of the body.
+        :type snippet: bytes | str
+        :param url: The url of the page (for the exception).
+        :return: True if the page is a Cloudflare challenge page.
+        :rtype: bool
+        :raises: CloudflareFlaggedError.
+        """
+
+        if isinstance(snippet, str):
+            snippet = snippet.encode(errors="ignore")
+        snippet = snippet[: const.SIGNATURE_WINDOW].lower()
+
+        if any(signature in snippet for signature in const.PHISHING_SIGNATURES):
+            LOGGER.debug(f"The website is flagged as phishing by CloudFlare.")
+            raise exceptions.CloudflareFlaggedError(url)
+
+        return any(signature in snippet for signature in const.CHALLENGE_SIGNATURES)
+
     @staticmethod
     def cloudflare_flagged(response: httpx.Response) -> None:
         """
@@ -236,19 +480,10 @@ class ResponseHandler:
         :raises: CloudflareFlaggedError.
         """
 
-        try:
-            response_snippet = response.content[250:450]
+        snippet = getattr(response, "content", None) or response.text or b""
+        url = getattr(response, "url", None)
 
-            if b"suspected phishing site | cloudflare" in response_snippet.lower():
-                LOGGER.debug(f"The website is flagged as phishing by CloudFlare.")
-                raise exceptions.CloudflareFlaggedError(response.url)
-
-        except AttributeError:
-            response_snippet = response.text[250:450]
-
-            if "suspected phishing site | cloudflare" in response_snippet.lower():
-                LOGGER.debug(f"The website is flagged as phishing by CloudFlare.")
-                raise exceptions.CloudflareFlaggedError(response.url)
+        ResponseHandler.signature_check(snippet[: const.SIGNATURE_WINDOW], url)
 
     @staticmethod
     def cloudflare_check(response: httpx.Response) -> bool:
@@ -265,7 +500,7 @@ class ResponseHandler:
 
         heads = response.headers
         server_info = heads.get("Server", "")
-        result = "cloudflare" in server_info.lower()
+        result = "cloudflare" in server_info.lower() or getattr(response, "challenge", False)
 
         if result:
             LOGGER.debug(
@@ -337,6 +572,10 @@ class ToolManager:
         :raises: CloudScraperError.
         """
 
+        import cloudscraper
+
+        self.ctx.budget.check()
+
         try:
             if self.ctx.url.startswith("http://"):
                 ssl = False
@@ -345,15 +584,21 @@ class ToolManager:
             scraper = cloudscraper.create_scraper()
             response = scraper.get(
                 url=self.ctx.url,
-                timeout=self.ctx.timeout_tools,
+                timeout=self.ctx.budget.timeout(self.ctx.timeout_tools),
                 verify=ssl,
+                stream=True,
             )
+            response = read_capped(response, self.ctx.max_body_size)
+            self.ctx.budget.charge(nbytes=len(response.content))
 
             if response.status_code != 200:
                 raise exceptions.CloudScraperError(f"Status code: {response.status_code}")
 
             return response
 
+        except exceptions.CloudflareFlaggedError:
+            raise
+
         except Exception as e:
             raise exceptions.CloudScraperError(f"{e.__class__.__name__}: {e}")
 
@@ -411,10 +656,15 @@ class ToolManager:
         :raises: WaybackArchiveError.
         """
 
+        import simple_header
+        import waybackpy
+
         class FakeResponse:
             status_code = 200
             text = None
 
+        self.ctx.budget.check()
+
         ua = simple_header.sua.get(num=5, shuffle=True, force_cached=True)[0].string
 
         # Force a refresh of the website in archive (Cache refresh).
@@ -442,11 +692,15 @@ class ToolManager:
         # Fetch the website from the Wayback Machine.
         try:
             with httpx.Client() as client:
-                response = client.get(
-                    url=wayback_url,
-                    timeout=self.ctx.timeout_tools,
+                response = fetch(
+                    client,
+                    "GET",
+                    wayback_url,
+                    max_body_size=self.ctx.max_body_size,
+                    timeout=self.ctx.budget.timeout(self.ctx.timeout_tools),
                     follow_redirects=True,
                 )
+            self.ctx.budget.charge(requests=2, nbytes=len(response.content))
 
             if response.status_code != 200:
                 raise exceptions.WaybackArchiveError(f"Status code: {response.status_code}")
@@ -522,15 +776,21 @@ class ServiceManager:
 
         endpoint = "https://dripcrawler.p.rapidapi.com/"
 
+        self.ctx.budget.check()
+
         try:
             with httpx.Client() as client:
-                response = client.post(
-                    url=endpoint,
+                response = fetch(
+                    client,
+                    "POST",
+                    endpoint,
+                    max_body_size=self.ctx.max_body_size,
                     json=payload,
                     headers=api_headers,
-                    timeout=self.ctx.timeout_services,
+                    timeout=self.ctx.budget.timeout(self.ctx.timeout_services),
                     follow_redirects=True,
                 )
+            self.ctx.budget.charge(nbytes=len(response.content))
 
             if response.status_code != 200:
                 raise exceptions.DripCrawlerFailedError(f"Status code: {response.status_code}")
@@ -543,7 +803,7 @@ class ServiceManager:
 
             return fake_response
 
-        except (httpx.HTTPError, ConnectionError) as e:
+        except (httpx.HTTPError, ConnectionError, ValueError, KeyError) as e:
             raise exceptions.DripCrawlerFailedError(f"{e.__class__.__name__}: {e}")
 
     def service_scrapingant(self) -> httpx.Response:
@@ -592,13 +852,19 @@ class ServiceManager:
             f"&return_page_source=true"
         )
 
+        self.ctx.budget.check(paid=True)
+
         try:
             with httpx.Client() as client:
-                response = client.get(
-                    url=endpoint,
-                    timeout=self.ctx.timeout_services,
+                response = fetch(
+                    client,
+                    "GET",
+                    endpoint,
+                    max_body_size=self.ctx.max_body_size,
+                    timeout=self.ctx.budget.timeout(self.ctx.timeout_services),
                     follow_redirects=True,
                 )
+            self.ctx.budget.charge(nbytes=len(response.content), paid=True)
 
             if response.status_code != 200:
                 raise exceptions.ScrapingAntFailedError(f"Status code: {response.status_code}")
@@ -626,14 +892,20 @@ class ServiceManager:
 
         endpoint = "http://api.scrapeup.com"
 
+        self.ctx.budget.check(paid=True)
+
         try:
             with httpx.Client() as client:
-                response = client.get(
-                    url=endpoint,
+                response = fetch(
+                    client,
+                    "GET",
+                    endpoint,
+                    max_body_size=self.ctx.max_body_size,
                     params=payload,
-                    timeout=self.ctx.timeout_services,
+                    timeout=self.ctx.budget.timeout(self.ctx.timeout_services),
                     follow_redirects=True,
                 )
+            self.ctx.budget.charge(nbytes=len(response.content), paid=True)
 
             if response.status_code != 200:
                 raise exceptions.ScrapeUpFailedError(f"Status code: {response.status_code}")
@@ -649,11 +921,14 @@ class WebScraper:
     timeout_connect = 10
     timeout_tools = 30
     timeout_services = 60
+    max_body_size = const.MAX_BODY_SIZE
 
     def __init__(
         self,
         domain: str,
         force_services: bool = False,
+        budget: ScanBudget = None,
+        learn_aliases: bool = False,
     ):
         """
         Initialize the WebScraper object to start the scraping process.
@@ -662,6 +937,12 @@ class WebScraper:
         :type domain: str
         :param force_services: Pass True to only use external services.
         :type force_services: bool
+        :param budget: The resource budget of the scan. Default: no
+            limits.
+        :type budget: ScanBudget
+        :param learn_aliases: Pass True if domain is the scanned website
+            (not a review site), to learn its aliases from redirects.
+        :type learn_aliases: bool
         """
 
         # Create the context object for shared settings and properties.
@@ -671,10 +952,13 @@ class WebScraper:
         self.ctx.timeout_connect = self.timeout_connect
         self.ctx.timeout_tools = self.timeout_tools
         self.ctx.timeout_services = self.timeout_services
+        self.ctx.max_body_size = self.max_body_size
 
         # Pass the input to the context object.
         self.ctx.domain = domain
         self.ctx.force_services = force_services
+        self.ctx.learn_aliases = learn_aliases
+        self.ctx.budget = budget or ScanBudget.unlimited()
 
         # Create all manager and handler objects.
         self.cm = ConnectionManager(ctx=self.ctx)
@@ -682,6 +966,18 @@ class WebScraper:
         self.tm = ToolManager(ctx=self.ctx)
         self.sm = ServiceManager(ctx=self.ctx)
 
+        # The exception that ended the scraping process, if any.
+        self.error = None
+
+        # Domain failed recently: Return the cached verdict instead of
+        # running through all connections, tools and services again.
+        key = domain.rstrip(".").lower()
+        if (verdict := NEGATIVE_CACHE.get(key)) is not None:
+            LOGGER.info(f"Cached verdict for '{domain}': {verdict.__class__.__name__}.")
+            self.error = verdict
+            self.success = False
+            return
+
         # Start the scraping process.
         try:
             self.response = self.start()
@@ -690,10 +986,19 @@ class WebScraper:
 
             self.success = True
 
+        except exceptions.BudgetExceededError as e:
+            self.ctx.budget.skip(self.ctx.domain, str(e))
+            self.error = e
+            self.success = False
+
         except exceptions.WebScraperException as e:
             LOGGER.error(f"Error while creating WebScra" f"per: {e.__class__.__name__}: {e}")
+            self.error = e
             self.success = False
 
+            if ttl := negative_ttl(e):
+                NEGATIVE_CACHE.set(key, e, ttl=ttl)
+
     def start(self):
         """
         Start the scraping process for the object.
@@ -708,24 +1013,34 @@ class WebScraper:
         # headers will be set as instance attributes. Check for every
         # response, if it is flagged as phishing by Cloudflare.
         LOGGER.debug(f"Trying to connect to '{self.ctx.domain}' ...")
-        response = self.cm.connect(domain=self.ctx.domain)
+        with trace.span("scrape.connect"):
+            response = self.cm.connect(domain=self.ctx.domain)
         self.response = response
 
+        # Remember where the website redirects to, so all its aliases
+        # share one score entry.
+        if self.ctx.learn_aliases:
+            canonical.learn(self.ctx.domain, response)
+
         self.rh.cloudflare_flagged(response=response)
         LOGGER.info("Not flagged as phishing by CloudFlare.")
 
-        # 2. Check from the response if the website is protected by
-        # cloudflare. If so, we have several options to bypass it.
-        if self.rh.cloudflare_check(response=response):
+        # 2. Check from the probe or the response if the website is
+        # protected by cloudflare. If so, we have several options to
+        # bypass it.
+        if self.ctx.probe.cloudflare or self.rh.cloudflare_check(response=response):
             LOGGER.info("The website is protected by CloudFlare.")
 
             # 2.1. Try local tool first: Cloudscraper.
             if not self.ctx.force_services:
                 try:
                     LOGGER.info("Trying to bypass with Cloudscraper.")
-                    response = self.tm.tool_cloudscraper()
+                    with trace.span("bypass.cloudscraper"):
+                        response = self.tm.tool_cloudscraper()
+                    BYPASSES.labels("cloudscraper", "success").inc()
                     self.rh.cloudflare_flagged(response=response)
                 except exceptions.CloudScraperError as e:
+                    BYPASSES.labels("cloudscraper", "failed").inc()
                     LOGGER.warning(f"{e.__class__.__name__}: {e}")
 
             # 2.2. Try external services. Choose the order of services
@@ -744,7 +1059,9 @@ class WebScraper:
                     LOGGER.info(
                         f"Trying to bypass with " f"{service.__name__.split('_')[-1]} ({i}/3)."
                     )
-                    response = service()
+                    with trace.span(f"bypass.{service.__name__.split('_')[-1]}"):
+                        response = service()
+                    BYPASSES.labels(service.__name__.split("_")[-1], "success").inc()
 
                     # If worked, check if the website is flagged as
                     # phishing by Cloudflare, do not catch (see below).
@@ -754,6 +1071,7 @@ class WebScraper:
 
                 except exceptions.ScrapingServicesError as e:
                     # Service failed, try next.
+                    BYPASSES.labels(service.__name__.split("_")[-1], "failed").inc()
                     LOGGER.warning(f"{e.__class__.__name__}: {e}")
                     continue
 
@@ -780,6 +1098,8 @@ class WebScraper:
         cls,
         domain: str,
         force_services: bool = False,
+        budget: ScanBudget = None,
+        learn_aliases: bool = False,
     ):
         """
         Convenience function to create a ready-to-go WebScraper object.
@@ -791,11 +1111,22 @@ class WebScraper:
         :type domain: str
         :param force_services: Pass True to only use external services.
         :type force_services: bool
+        :param budget: The resource budget of the scan. Default: no
+            limits.
+        :type budget: ScanBudget
+        :param learn_aliases: Pass True if domain is the scanned website
+            (not a review site), to learn its aliases from redirects.
+        :type learn_aliases: bool
         :return: A WebScraper object.
         :rtype: WebScraper
         """
 
-        return cls(domain=domain, force_services=force_services)
+        return cls(
+            domain=domain,
+            force_services=force_services,
+            budget=budget,
+            learn_aliases=learn_aliases,
+        )
 
 
 get = WebScraper.get
@@ -894,6 +1225,8 @@ if __name__ == "__main__":
     url = "http://0532lx.com"
     dom = "0532lx.com"
 
+    import simple_header
+
     ua = simple_header.sua.get(num=1)[0]
     print("User-Agent:", ua)
 
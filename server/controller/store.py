@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+"""
+store.py: Two-tier score store (in-process LRU in front of MongoDB).
+
+Scores are looked up in a bounded in-process LRU cache first, then in
+the database. Entries older than secrets.DB_RETENTION days are still
+served right away (stale-while-revalidate), while one background
+rescan per domain refreshes them for the next request.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-16"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import errors
+
+from server import const
+from server.secrets import secrets
+from server.utils import cache
+from ..database import database
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+class ScoreStore:
+    """
+    Score entries of websites, cached in memory (tier 1) and stored in
+    MongoDB (tier 2). If the database is not available, the store keeps
+    working with the memory tier only.
+
+    :ivar TTLCache memory: Tier 1, domain -> entry (dict).
+    :ivar int db_hits: Lookups answered by the database.
+    :ivar int db_misses: Lookups the database had no entry for.
+    :ivar int refreshes: Background rescans started for stale entries.
+    """
+
+    def __init__(self) -> None:
+        self.memory = cache.TTLCache(maxsize=const.SCORE_CACHE_SIZE, ttl=const.SCORE_CACHE_TTL)
+        self.db_hits = 0
+        self.db_misses = 0
+        self.refreshes = 0
+
+        self._db = None
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=const.SCORE_REFRESH_WORKERS, thread_name_prefix="score-refresh"
+        )
+
+    @property
+    def db(self) -> database.DatabaseManager:
+        """
+        The database manager, created on first use. It uses the pooled
+        client of the current process, also after forking.
+
+        :rtype: DatabaseManager
+        """
+
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = database.DatabaseManager(
+                        secrets.DB_URI,
+                        secrets.DB_NAME,
+                        secrets.DB_COLLECTION,
+                    )
+        return self._db
+
+    @staticmethod
+    def is_stale(entry: dict) -> bool:
+        """
+        Check if an entry is older than secrets.DB_RETENTION days.
+
+        :param entry: The score entry.
+        :type entry: dict
+        :return: True if the entry needs a rescan.
+        :rtype: bool
+        """
+
+        updated_at = entry.get("updated_at")
+        if updated_at is None:
+            return True
+
+        return datetime.now() - updated_at >= timedelta(days=secrets.DB_RETENTION)
+
+    def get(self, domain: str, cached: bool = True) -> tuple[dict or None, bool]:
+        """
+        Look up the entry of a domain in memory, then in the database.
+
+        :param domain: The domain to look up.
+        :type domain: str
+        :param cached: False to skip the memory tier and read the
+            database, e.g. to see entries stored by other processes.
+        :type cached: bool
+        :return: The entry (or None) and True if it is stale.
+        :rtype: tuple[dict | None, bool]
+        """
+
+        if cached:
+            entry = self.memory.get(domain)
+            if entry is not None:
+                return entry, self.is_stale(entry)
+
+        try:
+            entry = self.db.get_by_domain(domain)
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not read '{domain}' from database: {str(e)}.")
+            return None, False
+
+        with self._lock:
+            if entry is None:
+                self.db_misses += 1
+                return None, False
+            self.db_hits += 1
+
+        self.memory.set(domain, entry)
+        return entry, self.is_stale(entry)
+
+    def put(self, entry: dict) -> dict:
+        """
+        Store an entry in memory and in the database (one atomic
+        upsert, see DatabaseManager.upsert_entry).
+
+        :param entry: The score entry, see WebsiteScoreEntry.to_dict().
+        :type entry: dict
+        :return: The stored entry with its timestamps.
+        :rtype: dict
+        """
+
+        domain = entry["domain"]
+
+        try:
+            if self.db.upsert_entry(entry):
+                LOGGER.debug(f"Created new entry for {domain} in database.")
+            else:
+                LOGGER.debug(f"Updated entry for {domain} in database.")
+
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not write '{domain}' to database: {str(e)}.")
+            now = datetime.now()
+            entry.setdefault("created_at", now)
+            entry["updated_at"] = now
+
+        self.memory.set(domain, entry)
+        return entry
+
+    def ensure_indexes(self) -> list[str]:
+        """
+        Create and verify the indexes of the score collection.
+
+        :return: The names of the indexes.
+        :rtype: list[str]
+        :raises: pymongo.errors.PyMongoError if the database fails or an
+            index is missing.
+        """
+
+        return self.db.ensure_indexes()
+
+    def open_pool(self) -> int:
+        """
+        Open const.DB_MIN_POOL_SIZE pooled database connections, so the
+        first requests need no handshake.
+
+        :return: Number of pings answered.
+        :rtype: int
+        :raises: pymongo.errors.PyMongoError if the database fails.
+        """
+
+        return self.db.open_pool(const.DB_MIN_POOL_SIZE)
+
+    def warm(self, limit: int) -> int:
+        """
+        Load the most requested entries from the database into memory,
+        so a fresh worker answers popular domains without a database
+        round trip. The request counts are stored by the refresh
+        scheduler (see scheduler.py). If fewer entries were requested,
+        the most recently updated ones fill up the rest.
+
+        :param limit: The maximum number of entries to load.
+        :type limit: int
+        :return: Number of entries loaded.
+        :rtype: int
+        :raises: pymongo.errors.PyMongoError if the database fails.
+        """
+
+        limit = min(limit, const.SCORE_CACHE_SIZE)
+        entries = self.db.get_popular(limit)
+        if len(entries) < limit:
+            loaded = {entry["domain"] for entry in entries}
+            recent = self.db.get_recent(limit)
+            entries += [entry for entry in recent if entry["domain"] not in loaded]
+            entries = entries[:limit]
+
+        # Least requested first, so the most requested are evicted last.
+        for entry in reversed(entries):
+            self.memory.set(entry["domain"], entry)
+
+        LOGGER.debug(f"Loaded {len(entries)} score entries into memory.")
+        return len(entries)
+
+    def acquire_lease(self, domain: str, ttl: float = const.SCAN_LEASE_TTL) -> bool:
+        """
+        Take the scan lease of a domain in the database, so only one
+        worker process scans it. If the database is not available,
+        every process scans on its own.
+
+        :param domain: The domain to scan (or another key, e.g.
+            const.REFRESH_LEASE).
+        :type domain: str
+        :param ttl: Seconds after which the lease expires, unless it is
+            taken again by this process.
+        :type ttl: float
+        :return: True if this process may scan the domain.
+        :rtype: bool
+        """
+
+        try:
+            return self.db.acquire_lease(domain, _owner(), ttl, const.SCAN_LEASE_COLLECTION)
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not take scan lease of '{domain}': {str(e)}.")
+            return True
+
+    def release_lease(self, domain: str) -> None:
+        """
+        Give up the scan lease of a domain.
+
+        :param domain: The scanned domain.
+        :type domain: str
+        :return: None
+        """
+
+        try:
+            self.db.release_lease(domain, _owner(), const.SCAN_LEASE_COLLECTION)
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not release scan lease of '{domain}': {str(e)}.")
+
+    def mark_failed(self, domain: str) -> None:
+        """
+        Tell the other worker processes waiting for the scan lease of a
+        domain that its scan failed, for const.SCAN_FAILED_TTL seconds,
+        so they do not scan it again one after another.
+
+        :param domain: The domain that could not be scanned.
+        :type domain: str
+        :return: None
+        """
+
+        try:
+            self.db.set_marker(
+                f"failed:{domain}", const.SCAN_FAILED_TTL, const.SCAN_LEASE_COLLECTION
+            )
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not mark the scan of '{domain}' as failed: {str(e)}.")
+
+    def failed(self, domain: str) -> bool:
+        """
+        Check if another worker process failed to scan a domain within
+        the last const.SCAN_FAILED_TTL seconds (see mark_failed).
+
+        :param domain: The domain to scan.
+        :type domain: str
+        :return: True if the scan failed recently.
+        :rtype: bool
+        """
+
+        try:
+            return self.db.has_marker(f"failed:{domain}", const.SCAN_LEASE_COLLECTION)
+        except errors.PyMongoError as e:
+            LOGGER.error(f"Could not read the scan marker of '{domain}': {str(e)}.")
+            return False
+
+    def add_hits(self, hits: dict) -> int:
+        """
+        Add request counts to the entries in the database, so all
+        processes rank domains by the same counts.
+
+        :param hits: Domain -> number of requests.
+        :type hits: dict
+        :return: Number of entries updated.
+        :rtype: int
+        :raises: pymongo.errors.PyMongoError if the database fails.
+        """
+
+        return self.db.add_hits(hits)
+
+    def decay_hits(self, factor: float) -> int:
+        """
+        Let the request counts in the database decay by a factor.
+
+        :param factor: The factor, between 0 and 1.
+        :type factor: float
+        :return: Number of entries updated.
+        :rtype: int
+        :raises: pymongo.errors.PyMongoError if the database fails.
+        """
+
+        return self.db.decay_hits(factor)
+
+    def expiring(self, within: float, min_hits: float, limit: int) -> list[dict]:
+        """
+        Find the most requested entries in the database that expire
+        within some seconds (or have already expired).
+
+        :param within: Seconds until expiry.
+        :type within: float
+        :param min_hits: The minimum request count.
+        :type min_hits: float
+        :param limit: The maximum number of entries.
+        :type limit: int
+        :return: The entries (domain, hits, updated_at), most requested
+            first.
+        :rtype: list[dict]
+        :raises: pymongo.errors.PyMongoError if the database fails.
+        """
+
+        before = datetime.now() - timedelta(days=secrets.DB_RETENTION, seconds=-within)
+        return self.db.get_expiring(before, min_hits, limit)
+
+    def refresh(self, domain: str, compute) -> bool:
+        """
+        Rescan a domain in the background and store the new entry. Only
+        one refresh per domain runs at a time.
+
+        :param domain: The domain to refresh.
+        :type domain: str
+        :param compute: Function taking the domain, which rescans and
+            stores it (e.g. with put).
+        :return: True if a refresh was started, False if one is running.
+        :rtype: bool
+        """
+
+        with self._lock:
+            if domain in self._refreshing:
+                return False
+            self._refreshing.add(domain)
+            self.refreshes += 1
+
+        def _run():
+            try:
+                if compute(domain) is not None:
+                    LOGGER.debug(f"Refreshed stale entry for {domain}.")
+            except Exception as e:
+                LOGGER.error(f"Background refresh of '{domain}' failed: {e.__class__.__name__}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(domain)
+
+        self._executor.submit(_run)
+        return True
+
+    def stats(self) -> dict:
+        """
+        Return hit and miss counters of both tiers.
+
+        :return: A dict with the counters of 'memory' and 'database',
+            and the number of background refreshes.
+        :rtype: dict
+        """
+
+        with self._lock:
+            lookups = self.db_hits + self.db_misses
+            db_stats = {
+                "hits": self.db_hits,
+                "misses": self.db_misses,
+                "hit_ratio": self.db_hits / lookups if lookups else 0.0,
+            }
+            refreshes = self.refreshes
+
+        return {"memory": self.memory.stats(), "database": db_stats, "refreshes": refreshes}
+
+
+def _owner() -> str:
+    # Evaluated per call, as worker processes are forked after import.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# The process-wide score store.
+STORE = ScoreStore()
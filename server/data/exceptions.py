@@ -22,6 +22,8 @@ Hierarchy:
     + ScrapeUpFailedError
     + DripCrawlerFailedError
 
+  x BudgetExceededError
+
 """
 
 # Header.
@@ -128,3 +130,10 @@ class DripCrawlerFailedError(ScrapingServicesError):
     """
     DripCrawler free service failed to fetch the website.
     """
+
+
+class BudgetExceededError(WebScraperException):
+    """
+    The resource budget of the scan (time, requests, bytes or paid
+    service calls) is used up, so we stop scraping early.
+    """
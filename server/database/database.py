@@ -17,15 +17,76 @@ __status__ = "Prototype"
 
 # Imports.
 import logging
+import os
+import threading
 import uuid
 from abc import ABC, abstractmethod
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from pymongo import MongoClient, errors
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne, errors
+
+from server import const
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
+# The MongoDB clients of this process, by URL (see client).
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# Indexes of the score collection: name -> (keys, options).
+INDEXES = {
+    "domain_unique": ([("domain", ASCENDING)], {"unique": True}),
+    "uuid": ([("uuid", ASCENDING)], {}),
+    "updated_at": ([("updated_at", DESCENDING)], {}),
+    "hits": ([("hits", DESCENDING)], {"sparse": True}),
+}
+
+
+def client(db_url: str) -> MongoClient:
+    """
+    Return the MongoDB client of this process for a URL. A client is
+    thread-safe and pools its connections, so one per process serves
+    all requests. It connects on first use, so a client created before
+    forking opens no sockets the workers would share.
+
+    :param db_url: The URL of the MongoDB database
+    :type db_url: str
+    :return: The shared client
+    :rtype: MongoClient
+    """
+
+    mongo = _CLIENTS.get(db_url)
+    if mongo is None:
+        with _CLIENTS_LOCK:
+            mongo = _CLIENTS.get(db_url)
+            if mongo is None:
+                mongo = _CLIENTS[db_url] = MongoClient(
+                    db_url,
+                    connect=False,
+                    maxPoolSize=const.DB_MAX_POOL_SIZE,
+                    minPoolSize=const.DB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=const.DB_MAX_IDLE_MS,
+                    connectTimeoutMS=const.DB_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=const.DB_SERVER_SELECTION_TIMEOUT_MS,
+                    waitQueueTimeoutMS=const.DB_WAIT_QUEUE_TIMEOUT_MS,
+                )
+                LOGGER.debug(f"Created MongoDB client of process {os.getpid()}.")
+    return mongo
+
+
+def _after_fork() -> None:
+    # The sockets and monitor threads of the parent's clients are of no
+    # use in the child. They are dropped, not closed: closing would end
+    # the sessions of the parent.
+    global _CLIENTS_LOCK
+    _CLIENTS.clear()
+    _CLIENTS_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
 
 class DatabaseManager:
     """
@@ -47,7 +108,8 @@ class DatabaseManager:
     ) -> None:
         """
         Initializes the DatabaseManager with the specified database URL,
-        name, and collection, along with an optional TLS certificate.
+        name, and collection. The connection is taken from the client
+        of this process (see client), so creating a manager is cheap.
 
         :param db_url: The URL of the MongoDB database
         :type db_url: str
@@ -57,17 +119,55 @@ class DatabaseManager:
         :type db_collection: str
         """
 
-        self.client = MongoClient(db_url)
+        self.db_url = db_url
+        self.db_name = db_name
+        self.db_collection = db_collection
+        self._pid = None
+
+    def _bind(self) -> None:
+        # A manager created before a fork takes the child's own client.
+        if self._pid != os.getpid():
+            self._client = client(self.db_url)
+            self._db = self._client[self.db_name]
+            self._collection = self._db[self.db_collection]
+            self._pid = os.getpid()
+
+    @property
+    def client(self) -> MongoClient:
+        self._bind()
+        return self._client
+
+    @property
+    def db(self):
+        self._bind()
+        return self._db
+
+    @property
+    def collection(self):
+        self._bind()
+        return self._collection
+
+    def ensure_indexes(self) -> list[str]:
+        """
+        Creates the indexes of the collection (see INDEXES) unless they
+        exist, and verifies that they do.
 
-        # Check if server is available, ping does not require auth.
-        try:
-            self.client.admin.command("ping")
-            LOGGER.debug("Successfully connected to MongoDB server.")
-        except errors.ConnectionFailure as e:
-            LOGGER.error("Could not connect to MongoDB server. Error: " f"{str(e)}")
+        :return: The names of the indexes of the collection
+        :rtype: list[str]
+        :raises: pymongo.errors.OperationFailure if an index is missing,
+            e.g. because duplicate domains prevent the unique index
+        """
+
+        for name, (keys, options) in INDEXES.items():
+            self.collection.create_index(keys, name=name, **options)
 
-        self.db = self.client[db_name]
-        self.collection = self.db[db_collection]
+        names = sorted(self.collection.index_information())
+        missing = sorted(set(INDEXES) - set(names))
+        if missing:
+            raise errors.OperationFailure(f"Missing indexes: {', '.join(missing)}")
+
+        LOGGER.debug(f"Indexes of {self.db_collection}: {', '.join(names)}.")
+        return names
 
     def insert_entry(self, data: dict) -> None:
         """
@@ -87,7 +187,8 @@ class DatabaseManager:
         data["updated_at"] = now
         self.collection.insert_one(data)
 
-        LOGGER.debug(f"Inserted entry into database: {data}")
+        # Formatted lazily, only if the record is written.
+        LOGGER.debug("Inserted entry into database: %s", data)
 
     def update_entry(self, data: dict) -> None:
         """
@@ -105,7 +206,39 @@ class DatabaseManager:
         domain = data.get("domain")
         self.collection.update_one({"domain": domain}, {"$set": data})
 
-        LOGGER.debug(f"Updated entry into database: {data}")
+        LOGGER.debug("Updated entry into database: %s", data)
+
+    def upsert_entry(self, data: dict) -> bool:
+        """
+        Inserts the entry of a domain or updates it, in one atomic
+        operation: concurrent writers of a new domain can not both try
+        to insert it and collide on the unique index. created_at is
+        only set on insert, updated_at on every write. The timestamps
+        are added to the dictionary (created_at only if inserted).
+
+        :param data: The entry, with its domain
+        :type data: dict
+        :return: True if the entry was inserted, False if updated
+        :rtype: bool
+        """
+
+        now = datetime.now()
+        fields = {key: value for key, value in data.items() if key not in ("_id", "created_at")}
+        fields["updated_at"] = now
+
+        result = self.collection.update_one(
+            {"domain": data["domain"]},
+            {"$set": fields, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        )
+
+        data["updated_at"] = now
+        inserted = result.upserted_id is not None
+        if inserted:
+            data["created_at"] = now
+
+        LOGGER.debug("Upserted entry into database: %s", data)
+        return inserted
 
     def get_by_uuid(self, uuid: str) -> dict:
         """
@@ -131,12 +264,211 @@ class DatabaseManager:
 
         return self.collection.find_one({"domain": domain})
 
+    def get_recent(self, limit: int) -> list[dict]:
+        """
+        Retrieves the most recently updated entries of the collection.
+
+        :param limit: The maximum number of entries
+        :type limit: int
+        :return: The entries, most recently updated first
+        :rtype: list[dict]
+        """
+
+        return list(self.collection.find({}, sort=[("updated_at", -1)], limit=limit))
+
+    def get_popular(self, limit: int) -> list[dict]:
+        """
+        Retrieves the most requested entries of the collection (see
+        add_hits). Entries never requested are not returned.
+
+        :param limit: The maximum number of entries
+        :type limit: int
+        :return: The entries, most requested first
+        :rtype: list[dict]
+        """
+
+        return list(
+            self.collection.find({"hits": {"$gt": 0}}, sort=[("hits", -1)], limit=limit)
+        )
+
+    def open_pool(self, size: int) -> int:
+        """
+        Opens pooled connections to the database ahead of the requests,
+        by sending pings in parallel: each ping checks out a connection
+        of its own, unless a finished one is free again.
+
+        :param size: The number of parallel pings
+        :type size: int
+        :return: The number of pings answered
+        :rtype: int
+        :raises: pymongo.errors.PyMongoError if the database fails
+        """
+
+        admin = self.client.admin
+        with ThreadPoolExecutor(max_workers=size, thread_name_prefix="db-pool") as pool:
+            list(pool.map(lambda _: admin.command("ping"), range(size)))
+
+        return size
+
+    def add_hits(self, hits: dict) -> int:
+        """
+        Adds request counts to the entries of the domains, in one batch.
+        Domains without an entry are skipped.
+
+        :param hits: Domain -> number of requests
+        :type hits: dict
+        :return: The number of updated entries
+        :rtype: int
+        """
+
+        if not hits:
+            return 0
+
+        requests = [
+            UpdateOne({"domain": domain}, {"$inc": {"hits": count}})
+            for domain, count in hits.items()
+        ]
+        return self.collection.bulk_write(requests, ordered=False).modified_count
+
+    def decay_hits(self, factor: float) -> int:
+        """
+        Multiplies the request counts of all entries by a factor, so
+        older requests weigh less.
+
+        :param factor: The factor, between 0 and 1
+        :type factor: float
+        :return: The number of updated entries
+        :rtype: int
+        """
+
+        return self.collection.update_many(
+            {"hits": {"$gt": 0}}, {"$mul": {"hits": factor}}
+        ).modified_count
+
+    def get_expiring(self, before: datetime, min_hits: float, limit: int) -> list[dict]:
+        """
+        Retrieves the most requested entries last updated before a
+        point in time.
+
+        :param before: Only entries updated before this time
+        :type before: datetime
+        :param min_hits: Only entries with at least this request count
+        :type min_hits: float
+        :param limit: The maximum number of entries
+        :type limit: int
+        :return: The entries (domain, hits, updated_at), most requested
+            first
+        :rtype: list[dict]
+        """
+
+        return list(
+            self.collection.find(
+                {"updated_at": {"$lt": before}, "hits": {"$gte": min_hits}},
+                {"_id": 0, "domain": 1, "hits": 1, "updated_at": 1},
+                sort=[("hits", -1)],
+                limit=limit,
+            )
+        )
+
+    def acquire_lease(self, key: str, owner: str, ttl: float, collection: str = "leases") -> bool:
+        """
+        Try to take a lease on key, so only one worker process does the
+        work for it. A lease is free if nobody holds it or if it has
+        expired (e.g. because its holder crashed).
+
+        :param key: The key of the lease (e.g. the domain).
+        :type key: str
+        :param owner: A unique name of the caller (host and process).
+        :type owner: str
+        :param ttl: Seconds after which the lease expires.
+        :type ttl: float
+        :param collection: The collection holding the leases.
+        :type collection: str
+        :return: True if the caller holds the lease now.
+        :rtype: bool
+        """
+
+        now = datetime.now()
+
+        # Matches only a free lease. If another owner holds it, the
+        # upsert tries to insert a second document with the same _id.
+        try:
+            self.db[collection].update_one(
+                {"_id": key, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True,
+            )
+        except errors.DuplicateKeyError:
+            return False
+
+        return True
+
+    def release_lease(self, key: str, owner: str, collection: str = "leases") -> None:
+        """
+        Give up a lease taken with acquire_lease. Leases held by other
+        owners are left alone.
+
+        :param key: The key of the lease.
+        :type key: str
+        :param owner: The name used to acquire the lease.
+        :type owner: str
+        :param collection: The collection holding the leases.
+        :type collection: str
+        :return: None
+        """
+
+        self.db[collection].delete_one({"_id": key, "owner": owner})
+
+    def set_marker(self, key: str, ttl: float, collection: str = "leases") -> None:
+        """
+        Set a marker that all worker processes see until it expires
+        (e.g. a scan that failed).
+
+        :param key: The key of the marker.
+        :type key: str
+        :param ttl: Seconds after which the marker expires.
+        :type ttl: float
+        :param collection: The collection holding the markers.
+        :type collection: str
+        :return: None
+        """
+
+        self.db[collection].update_one(
+            {"_id": key},
+            {"$set": {"expires_at": datetime.now() + timedelta(seconds=ttl)}},
+            upsert=True,
+        )
+
+    def has_marker(self, key: str, collection: str = "leases") -> bool:
+        """
+        Check for a marker set with set_marker that has not expired.
+
+        :param key: The key of the marker.
+        :type key: str
+        :param collection: The collection holding the markers.
+        :type collection: str
+        :return: True if the marker is set.
+        :rtype: bool
+        """
+
+        marker = self.db[collection].find_one(
+            {"_id": key, "expires_at": {"$gte": datetime.now()}}, {"_id": 1}
+        )
+        return marker is not None
+
     def close_connection(self) -> None:
         """
-        Closes the connection to the MongoDB database.
+        Closes the connection to the MongoDB database. The client is
+        shared by all managers of this process, the next use creates a
+        new one.
         """
 
-        self.client.close()
+        with _CLIENTS_LOCK:
+            _CLIENTS.pop(self.db_url, None)
+
+        if self._pid == os.getpid():
+            self._client.close()
+        self._pid = None
         LOGGER.debug("Closed connection to MongoDB server ...")
 
 
@@ -14,14 +14,113 @@ __version__ = "0.0.1"
 __date__ = "2023-11-07"
 __status__ = "Prototype/Development/Production"
 
-import random
+# Imports.
+import logging
+import threading
 
+from server import const
+from server.model import fast
+from server.utils import trace
 
-# Imports.
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# Model and scaler, loaded once per process on first use.
+_MODEL = None
+_SCALER = None
+_LOCK = threading.Lock()
+
+
+def load() -> tuple:
+    """
+    Load the trained model and the feature scaler. Both are kept in
+    memory, so only the first call reads them from disk.
+
+    :return: The keras model and the fitted scaler.
+    :rtype: tuple
+    """
+
+    global _MODEL, _SCALER
+
+    if _MODEL is None:
+        with _LOCK:
+            if _MODEL is None:
+                # Imported here, TensorFlow alone takes seconds to
+                # import and most requests never reach the model.
+                import joblib
+                from tensorflow.keras.models import load_model
+
+                _SCALER = joblib.load(const.SCALER_FILE)
+                _MODEL = load_model(const.MODEL_FILE)
+                LOGGER.debug("Loaded AI model and scaler.")
+
+    return _MODEL, _SCALER
+
+
+def prepare(features: list, names: list) -> "numpy.ndarray":
+    """
+    Convert a feature vector into the scaled model input.
+
+    :param features: The feature values (see WebsiteFeatures).
+    :type features: list
+    :param names: The feature names, in the same order.
+    :type names: list
+    :return: The scaled features, one row.
+    :rtype: numpy.ndarray
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    _, scaler = load()
+
+    df = pd.DataFrame([features], columns=names)
+    df["WHOIS_COUNTRY"] = df["WHOIS_COUNTRY"].replace(const.COUNTRY_MAP)
+
+    # Replace NaN values with 0.
+    df.replace("NaN", np.nan, inplace=True)
+    df = df.infer_objects(copy=False)
+    df.fillna(0, inplace=True)
+
+    # Convert all columns to numeric.
+    df = df.apply(pd.to_numeric)
+    df = df.select_dtypes(include=[np.number])
+
+    # Standardize and normalize the features.
+    return scaler.transform(df)
+
+
+def predict(features: list, names: list) -> float:
+    """
+    Predict how trustworthy a website is.
+
+    :param features: The feature values (see WebsiteFeatures).
+    :type features: list
+    :param names: The feature names, in the same order.
+    :type names: list
+    :return: The model output between 0 (scam) and 1 (trustworthy).
+    :rtype: float
+    """
+
+    model, _ = load()
+
+    with fast.INFERENCE_SECONDS.time("ai"), trace.span("model.ai"):
+        prediction = model.predict(prepare(features, names), verbose=0)
+
+    return float(prediction[0][0])
+
+
+def generate_score(features: list, names: list) -> int:
+    """
+    Generate the score (0 = F ... 15 = A+) of a website from its
+    features.
 
-def generate_score(scanner_data: dict) -> int:
-    # TODO: implement the AI to generate a score based on scanner data.
-    #  For now, just return a random number between 0 and 15.
-    score = random.randint(0, 15)
+    :param features: The feature values (see WebsiteFeatures).
+    :type features: list
+    :param names: The feature names, in the same order.
+    :type names: list
+    :return: The score between 0 and 15.
+    :rtype: int
+    """
 
-    return score
+    return int(round(predict(features, names) * 15))
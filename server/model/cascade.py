@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+cascade.py: Evaluate the scoring cascade on the known scores.
+
+With a judge, WebsiteFeatures stops after a stage once the model is
+confident (see const.CASCADE_LOW and const.CASCADE_HIGH). Stopping
+early saves outbound requests but may cost accuracy. This script scans
+a sample of testset.csv once with all stages, records the feature
+groups and the requests each group needed, and then replays the
+cascade for several thresholds offline:
+
+    python -m server.model.cascade [sample size] [records.json]
+
+The recorded scans are saved to records.json (default:
+/tmp/cascade_records.json) and reused on the next run.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-21"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import json
+import logging
+import os
+import random
+import sys
+
+from server.controller.features import WebsiteFeatures
+from server.model import ai, fast
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# Thresholds (low, high) to compare. (0, 1) never stops early.
+THRESHOLDS = [(0.0, 1.0), (0.02, 0.98), (0.05, 0.95), (0.1, 0.9), (0.2, 0.8)]
+
+
+def record(domains: list[tuple[str, int]]) -> list[dict]:
+    """
+    Scan domains with all stages and record their feature groups.
+
+    :param domains: (domain, known score) pairs.
+    :type domains: list[tuple[str, int]]
+    :return: One record per reachable domain with domain, score,
+        groups (name -> values) and requests (name -> count).
+    :rtype: list[dict]
+    """
+
+    records = []
+    for i, (domain, score) in enumerate(domains, start=1):
+        obj = WebsiteFeatures(domain, refresh=True)
+        obj.feature_extraction()
+
+        if not obj.alive:
+            LOGGER.info(f"({i}/{len(domains)}) {domain}: not reachable.")
+            continue
+
+        groups, offset = {}, 0
+        for name, size in obj.feature_groups:
+            groups[name] = obj.features[offset : offset + size]
+            offset += size
+
+        records.append(
+            {
+                "domain": domain,
+                "score": score,
+                "groups": groups,
+                "requests": obj.groups_requests,
+            }
+        )
+        requests = sum(obj.groups_requests.values())
+        LOGGER.info(f"({i}/{len(domains)}) {domain}: {requests} requests.")
+
+    return records
+
+
+def replay(records: list[dict], low: float, high: float) -> dict:
+    """
+    Replay the cascade on recorded scans.
+
+    :param records: The recorded scans (see record).
+    :type records: list[dict]
+    :param low: Stop if the probability is at most low.
+    :type low: float
+    :param high: Stop if the probability is at least high.
+    :type high: float
+    :return: A dict with the verdict accuracy, the average number of
+        requests per scan and the share of scans stopped per stage.
+    :rtype: dict
+    """
+
+    stages = WebsiteFeatures.feature_stages
+    correct = requests = 0
+    stopped = {stage: 0 for stage, _ in stages}
+
+    for rec in records:
+        groups = {}
+        for stage, names in stages:
+            for name in names:
+                groups[name] = rec["groups"][name]
+                requests += rec["requests"].get(name, 0)
+
+            features = WebsiteFeatures.merge(groups, normalize=True)
+            probability = ai.predict(features, WebsiteFeatures.features_names)
+            if stage == stages[-1][0] or not low < probability < high:
+                stopped[stage] += 1
+                break
+
+        correct += (probability >= 0.5) == (rec["score"] >= 8)
+
+    n = len(records) or 1
+    return {
+        "accuracy": round(correct / n, 3),
+        "requests": round(requests / n, 1),
+        "stopped": {stage: round(count / n, 2) for stage, count in stopped.items()},
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    path = sys.argv[2] if len(sys.argv) > 2 else "/tmp/cascade_records.json"
+
+    if os.path.exists(path):
+        with open(path) as f:
+            records = json.load(f)
+    else:
+        known = [(row["domain"], int(row["score"])) for row in fast.read_known()]
+        records = record(random.Random(0).sample(known, size))
+        with open(path, "w") as f:
+            json.dump(records, f)
+
+    print(f"Cascade on {len(records)} scanned domains:")
+    for low, high in THRESHOLDS:
+        print(f"  ({low:.2f}, {high:.2f}): {replay(records, low, high)}")
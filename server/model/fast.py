@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+"""
+fast.py: Lightweight model for provisional scores.
+
+A full scan takes seconds, mostly waiting for third-party sites. The
+fast model scores a domain from the features that are computed locally
+from its name (domain_url.py) within microseconds: a logistic
+regression, trained offline on testset.csv and stored as JSON, so
+answering needs neither the network nor TensorFlow. Its score is only
+provisional until the full scan has finished, and only given if the
+model is confident enough (const.FAST_MIN_CONFIDENCE).
+
+Train (and evaluate) it with: python -m server.model.fast
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-20"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import csv
+import json
+import logging
+import math
+import threading
+import time
+
+from server import const
+from server.scan import domain_url
+from server.utils import metrics
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# Features of the fast model, all computed from the domain name.
+FEATURES = [
+    ("DOMAIN_LENGTH", domain_url.length_domain),
+    ("SUBDOMAIN", domain_url.subdomain),
+    ("PORT", domain_url.port),
+    ("AT_SYMBOL", domain_url.at_symbol),
+    ("PRE_SUFFIX", domain_url.pre_suffix),
+    ("HTTPS_HOSTNAME", domain_url.https_hostname),
+    ("IP_ADDR", domain_url.ip_addr),
+    ("SHORTENING", domain_url.shortening_service),
+    ("REDIRECTING", domain_url.redirecting),
+    ("SUSPICIOUS_TLD", domain_url.suspicious_tld),
+]
+
+# Inference time per model ("fast" and "ai", see ai.py).
+INFERENCE_SECONDS = metrics.Histogram(
+    "model_inference_seconds",
+    "Time to predict one website.",
+    ("model",),
+    buckets=(0.00001, 0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Model parameters, loaded on first use.
+_MODEL = None
+_LOCK = threading.Lock()
+
+
+def extract(domain: str) -> list[float]:
+    """
+    Compute the features of the fast model.
+
+    :param domain: The domain (e.g. "shop.de").
+    :type domain: str
+    :return: The feature values, in the order of FEATURES.
+    :rtype: list[float]
+    """
+
+    return [float(func(domain)) for _, func in FEATURES]
+
+
+def load() -> dict:
+    """
+    Load the model parameters (see train) from const.FAST_MODEL_FILE.
+
+    :return: The model parameters.
+    :rtype: dict
+    """
+
+    global _MODEL
+
+    if _MODEL is None:
+        with _LOCK:
+            if _MODEL is None:
+                with open(const.FAST_MODEL_FILE) as f:
+                    _MODEL = json.load(f)
+                LOGGER.debug(f"Loaded fast model ({_MODEL['samples']} samples).")
+
+    return _MODEL
+
+
+def _sigmoid(z: float) -> float:
+    if z < 0:
+        return math.exp(z) / (1 + math.exp(z))
+    return 1 / (1 + math.exp(-z))
+
+
+def predict(domain: str, model: dict = None) -> float:
+    """
+    Predict how trustworthy a website is from its domain name only.
+
+    :param domain: The domain (e.g. "shop.de").
+    :type domain: str
+    :param model: The model parameters. Default: load().
+    :type model: dict
+    :return: The probability between 0 (scam) and 1 (trustworthy).
+    :rtype: float
+    """
+
+    start = time.perf_counter()
+    model = model or load()
+
+    z = model["bias"]
+    for x, mean, scale, weight in zip(
+        extract(domain), model["mean"], model["scale"], model["weights"]
+    ):
+        z += weight * (x - mean) / scale
+
+    probability = _sigmoid(z)
+    INFERENCE_SECONDS.labels("fast").observe(time.perf_counter() - start)
+    return probability
+
+
+def confidence(probability: float) -> float:
+    """
+    Measure how sure a prediction is: 0 at a probability of 0.5, 1 at
+    0 or 1.
+
+    :param probability: The probability, see predict.
+    :type probability: float
+    :return: The confidence between 0 and 1.
+    :rtype: float
+    """
+
+    return abs(2 * probability - 1)
+
+
+def generate_score(domain: str) -> int:
+    """
+    Generate a provisional score (0 = F ... 15 = A+) of a website.
+
+    :param domain: The domain (e.g. "shop.de").
+    :type domain: str
+    :return: The score between 0 and 15.
+    :rtype: int
+    """
+
+    return int(round(predict(domain) * 15))
+
+
+def read_known(path: str = const.KNOWN_SCORES_FILE) -> list[dict]:
+    """
+    Read a csv file with the columns domain and score (0-15).
+
+    :param path: The csv file. Default: const.KNOWN_SCORES_FILE.
+    :type path: str
+    :return: The rows of the file.
+    :rtype: list[dict]
+    """
+
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def train(
+    rows: list[dict],
+    epochs: int = 2000,
+    learning_rate: float = 0.5,
+    l2: float = 0.001,
+) -> dict:
+    """
+    Train the fast model on known scores by gradient descent on the
+    logistic loss.
+
+    :param rows: The known scores (see read_known).
+    :type rows: list[dict]
+    :param epochs: Number of gradient descent steps.
+    :type epochs: int
+    :param learning_rate: Step size of the gradient descent.
+    :type learning_rate: float
+    :param l2: Strength of the L2 regularization of the weights.
+    :type l2: float
+    :return: The model parameters.
+    :rtype: dict
+    """
+
+    import numpy as np
+
+    x = np.array([extract(row["domain"]) for row in rows])
+    y = np.array([int(row["score"]) / 15 for row in rows])
+
+    mean = x.mean(axis=0)
+    scale = x.std(axis=0)
+    scale[scale == 0] = 1.0
+    x = (x - mean) / scale
+
+    weights = np.zeros(x.shape[1])
+    bias = 0.0
+    for _ in range(epochs):
+        p = 1 / (1 + np.exp(-(x @ weights + bias)))
+        weights -= learning_rate * (x.T @ (p - y) / len(y) + l2 * weights)
+        bias -= learning_rate * float(np.mean(p - y))
+
+    return {
+        "features": [name for name, _ in FEATURES],
+        "mean": mean.tolist(),
+        "scale": scale.tolist(),
+        "weights": weights.tolist(),
+        "bias": bias,
+        "samples": len(rows),
+    }
+
+
+def evaluate(model: dict, rows: list[dict], min_confidence: float = 0.0) -> dict:
+    """
+    Measure the fast model against known scores.
+
+    :param model: The model parameters.
+    :type model: dict
+    :param rows: The known scores (see read_known).
+    :type rows: list[dict]
+    :param min_confidence: Only count predictions at least this
+        confident (see confidence), like the API does.
+    :type min_confidence: float
+    :return: A dict with the mean absolute error (in score points), the
+        accuracy of the verdict (score >= 8 is trustworthy), the share
+        of rows confident enough to count (coverage) and the average
+        prediction time in microseconds.
+    :rtype: dict
+    """
+
+    errors = correct = counted = 0
+    start = time.perf_counter()
+    for row in rows:
+        probability = predict(row["domain"], model)
+        if confidence(probability) < min_confidence:
+            continue
+        score = int(round(probability * 15))
+        known = int(row["score"])
+        errors += abs(score - known)
+        correct += (score >= 8) == (known >= 8)
+        counted += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mae": round(errors / counted, 2) if counted else None,
+        "accuracy": round(correct / counted, 3) if counted else None,
+        "coverage": round(counted / len(rows), 3),
+        "predict_us": round(elapsed / len(rows) * 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    rows = read_known()
+
+    # Evaluate on every 5th row, held out from training.
+    train_rows = [row for i, row in enumerate(rows) if i % 5]
+    test_rows = rows[::5]
+    held_out_model = train(train_rows)
+    held_out = evaluate(held_out_model, test_rows)
+    print(f"Held-out evaluation ({len(test_rows)} domains): {held_out}")
+    confident = evaluate(held_out_model, test_rows, const.FAST_MIN_CONFIDENCE)
+    print(f"At confidence >= {const.FAST_MIN_CONFIDENCE}: {confident}")
+
+    # The shipped model is trained on all known scores.
+    model = train(rows)
+    model["evaluation"] = held_out
+
+    with open(const.FAST_MODEL_FILE, "w") as f:
+        json.dump(model, f, indent=2)
+        f.write("\n")
+
+    print(f"Saved fast model to {const.FAST_MODEL_FILE}.")
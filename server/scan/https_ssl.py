@@ -26,23 +26,35 @@ import requests
 from OpenSSL import SSL
 
 from server import const
+from server.controller.budget import ScanBudget
+from server.utils import trace
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
 
-def https_encrypted(domain: str) -> dict or bool:
+@trace.traced()
+def https_encrypted(domain: str, budget: ScanBudget = None) -> dict or bool or None:
+    # None: Skipped because of the budget or timed out, no verdict.
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("https_ssl"):
+        return None
+
     try:
         context = SSL.Context(SSL.SSLv23_METHOD)
-        socket.setdefaulttimeout(const.TIMEOUT)
-        sock = socket.create_connection((domain, 443))
+        # Pass the timeout to this socket only, setdefaulttimeout would
+        # change it for every socket of the process.
+        with trace.span("tls.connect"):
+            sock = socket.create_connection((domain, 443), timeout=budget.timeout(const.TIMEOUT))
+        budget.charge()
         connection = SSL.Connection(context, sock)
         connection.set_connect_state()
         connection.set_tlsext_host_name(domain.encode())
         # We need to set blocking to True after connecting, otherwise
         # the handshake will fail (well known Python SSL bug).
         sock.setblocking(True)
-        connection.do_handshake()
+        with trace.span("tls.handshake"):
+            connection.do_handshake()
         cert = connection.get_peer_certificate()
 
         # Get certificate details
@@ -67,6 +79,11 @@ def https_encrypted(domain: str) -> dict or bool:
             "signature_algorithm": signature_algorithm,
         }
 
+    # No answer in time (maybe a timeout shortened by the budget).
+    except socket.timeout:
+        LOGGER.info(f"TLS connection to '{domain}' timed out.")
+        return None
+
     # No HTTPS enabled (insecure).
     except:
         return False
@@ -15,84 +15,227 @@ __date__ = "2023-11-25"
 __status__ = "Prototype/Development/Production"
 
 # Imports.
+import functools
 import logging
+import ssl
 
+import httpx
 import requests
 from urllib.parse import quote
 
 from server import const
+from server.controller.budget import ScanBudget
+from server.utils import cache, limiter
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
 
-def server_reachable(url: str) -> bool:
-    try:
-        response = requests.head(
-            url=url,
-            allow_redirects=True,
-            timeout=const.INIT_TIMEOUT,
+class ProbeResult:
+    """
+    Small record holding everything we learn from the first request to
+    a website: if it answers at all, which protocol works, if the TLS
+    certificate verifies, and if it sits behind Cloudflare.
+
+    :ivar str domain: The probed domain (without protocol).
+    :ivar bool reachable: True if the server answered with any status.
+    :ivar str protocol: The working protocol ("https://" or "http://"),
+        None if not reachable.
+    :ivar bool verify_ok: True if the TLS certificate was verified.
+    :ivar int status_code: The final status code after redirects.
+    :ivar str server: The value of the 'Server' response header.
+    :ivar bool cloudflare: True if the website is served by Cloudflare.
+    :ivar str redirect: The final URL if we were redirected, else None.
+    :ivar bool clamped: True if the budget shortened a timeout of the
+        probe. Then an unreachable website may just have been too slow.
+    """
+
+    __slots__ = (
+        "domain",
+        "reachable",
+        "protocol",
+        "verify_ok",
+        "status_code",
+        "server",
+        "cloudflare",
+        "redirect",
+        "clamped",
+    )
+
+    def __init__(self, domain: str) -> None:
+        self.domain = domain
+        self.reachable = False
+        self.protocol = None
+        self.verify_ok = False
+        self.status_code = None
+        self.server = ""
+        self.cloudflare = False
+        self.redirect = None
+        self.clamped = False
+
+    @property
+    def ok(self) -> bool:
+        """
+        True if the website is reachable and answered with status 200.
+
+        :rtype: bool
+        """
+
+        return self.reachable and self.status_code == 200
+
+    def __str__(self) -> str:
+        """
+        Return a string representation of the object.
+
+        :return: A string representation of the object.
+        :rtype: str
+        """
+
+        return (
+            f"ProbeResult("
+            f"domain={self.domain!r}, "
+            f"reachable={self.reachable!r}, "
+            f"protocol={self.protocol!r}, "
+            f"verify_ok={self.verify_ok!r}, "
+            f"status_code={self.status_code!r}, "
+            f"server={self.server!r}, "
+            f"cloudflare={self.cloudflare!r}, "
+            f"redirect={self.redirect!r}, "
+            f"clamped={self.clamped!r})"
         )
-        if response.status_code != 200:
-            LOGGER.warning("Website is NOT reachable. Status code: " f"{response.status_code}.")
-            return False
-        else:
+
+
+# Probe results per domain, kept for a short time only.
+PROBE_CACHE = cache.TTLCache(maxsize=const.PROBE_CACHE_SIZE, ttl=const.PROBE_TTL)
+
+
+def _tls_failure(exc: BaseException) -> bool:
+    """
+    Walk the exception chain and check if a connection error was caused
+    by the TLS handshake or certificate verification.
+
+    :param exc: The exception raised by httpx.
+    :type exc: BaseException
+    :return: True if TLS caused the error.
+    :rtype: bool
+    """
+
+    while exc is not None:
+        if isinstance(exc, ssl.SSLError):
             return True
+        exc = exc.__cause__ or exc.__context__
+
+    return False
+
+
+def probe(url: str, refresh: bool = False, budget: ScanBudget = None) -> ProbeResult:
+    """
+    Probe a website with a single HEAD request and cache the result per
+    domain. A second request is only made if the first one fails: an
+    unverified retry if the certificate is invalid, or plain HTTP if
+    HTTPS does not answer at all.
+
+    :param url: The url or domain of the website to be probed.
+    :type url: str
+    :param refresh: Pass True to ignore a cached result.
+    :type refresh: bool
+    :param budget: The resource budget of the scan. Default: no limits.
+    :type budget: ScanBudget
+    :return: The probe result (also cached for unreachable websites).
+    :rtype: ProbeResult
+    :raises: BudgetExceededError if the budget is used up.
+    """
+
+    domain = url.split("://", maxsplit=1)[-1].split("/", maxsplit=1)[0].lower()
+
+    if not refresh:
+        cached = PROBE_CACHE.get(domain)
+        if cached is not None:
+            return cached
+
+    budget = budget or ScanBudget.unlimited()
+    result = ProbeResult(domain)
+    attempts = [("https://", True), ("http://", False)]
+
+    # A timeout shortened by the budget says nothing about the website,
+    # so such a failed probe is not cached. The limiter clamps the
+    # timeout once the request slot is taken.
+    def head(client, url, timeout, **kwargs):
+        result.clamped = result.clamped or timeout < const.INIT_TIMEOUT
+        return client.head(url, timeout=timeout, **kwargs)
+
+    while attempts:
+        protocol, verify = attempts.pop(0)
+        budget.check()
+        budget.charge()
 
-    except Exception as e:
-        LOGGER.warning(f"Connection with SSL failed. Retrying " f"without SSL now ... {str(e)}")
         try:
-            response2 = requests.head(
-                url=url,
-                allow_redirects=True,
-                timeout=const.INIT_TIMEOUT,
-                verify=False,
-            )
-            if response2.status_code != 200:
-                LOGGER.warning(
-                    "Website is NOT reachable. Status code: " f"{response2.status_code}."
+            with httpx.Client(verify=verify) as client:
+                response = limiter.call(
+                    functools.partial(head, client),
+                    f"{protocol}{domain}",
+                    budget=budget,
+                    timeout=const.INIT_TIMEOUT,
+                    follow_redirects=True,
                 )
-                return False
-            else:
-                return True
 
-        except Exception as e:
-            LOGGER.warning(f"Website is NOT reachable: {str(e)}.")
-            return False
+        except httpx.HTTPError as e:
+            # Invalid certificate: The server is there, retry once
+            # without verification before falling back to plain HTTP.
+            if verify and _tls_failure(e):
+                LOGGER.info(f"TLS verification failed for '{domain}'. Retrying without SSL now.")
+                attempts.insert(0, ("https://", False))
+            continue
 
+        result.reachable = True
+        result.protocol = protocol
+        result.verify_ok = verify
+        result.status_code = response.status_code
+        result.server = response.headers.get("Server", "")
+        result.cloudflare = "cloudflare" in result.server.lower()
+        if response.history:
+            result.redirect = str(response.url)
+        break
 
-def cloudflare_protected(url: str) -> bool or None:
+    if not result.reachable:
+        LOGGER.warning(f"Website '{domain}' is NOT reachable.")
+    elif result.status_code != 200:
+        LOGGER.warning(f"Website '{domain}' answered with status code: {result.status_code}.")
+
+    if result.reachable or not result.clamped:
+        PROBE_CACHE.set(domain, result)
+
+    return result
+
+
+def server_reachable(url: str) -> bool:
     """
-    Checks if a website is protected by cloudflare, and we thus need to
-    use a different approach to scan the website or fetch the data.
+    Checks if a website is reachable and answers with status code 200.
 
     :param url: Pass the url of the website to be checked
     :return: A boolean value
     """
 
-    try:
-        response = requests.head(url, timeout=const.CF_TIMEOUT, allow_redirects=True)
+    return probe(url).ok
 
-        if response.status_code != 200:
-            LOGGER.error(
-                "Could not check if website is cloudflare protected. "
-                f"Response status code: {response.status_code}."
-                f"Response: {response.content}."
-            )
-            # Some other kind of access restriction -> bypass needed.
-            return True
 
-        headers = response.headers
-        server_info = headers.get("Server", "")
+def cloudflare_protected(url: str) -> bool or None:
+    """
+    Checks if a website is protected by cloudflare, and we thus need to
+    use a different approach to scan the website or fetch the data.
 
-        return "cloudflare" in server_info.lower()
+    :param url: Pass the url of the website to be checked
+    :return: A boolean value
+    """
 
-    except Exception as e:
-        LOGGER.error(
-            f"An error occurred while checking if website is cloudflare " f"protected: {str(e)}."
-        )
+    result = probe(url)
+
+    # Some other kind of access restriction -> bypass needed.
+    if not result.ok:
         return True
 
+    return result.cloudflare
+
 
 def cloudflare_bypass(url: str) -> requests.Response or None:
     encoded_url = quote(url, safe="")
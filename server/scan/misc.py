@@ -23,12 +23,13 @@ import requests
 from bs4 import BeautifulSoup
 
 from server import const
+from server.controller.budget import ScanBudget
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
 
-def get_favicon(domain: str, soup: BeautifulSoup) -> str or None:
+def get_favicon(domain: str, soup: BeautifulSoup, budget: ScanBudget = None) -> str or None:
     """
     The get_favicon function takes in a domain and BeautifulSoup object
     as parameters. It then searches the BeautifulSoup object for any
@@ -39,14 +40,22 @@ def get_favicon(domain: str, soup: BeautifulSoup) -> str or None:
 
     :param domain: str: Specify the domain of the website
     :param soup: BeautifulSoup: Pass the beautifulsoup object
+    :param budget: ScanBudget: The resource budget of the scan
     :return: The favicon url of the website
     """
 
     for item in soup.find_all("link", attrs={"rel": re.compile("^(shortcut icon|icon)$", re.I)}):
         return item.get("href")
 
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("favicon"):
+        return None
+
     try:
-        testing = requests.get(f"https://{domain}/favicon.ico", timeout=const.TIMEOUT)
+        testing = requests.get(
+            f"https://{domain}/favicon.ico", timeout=budget.timeout(const.TIMEOUT)
+        )
+        budget.charge(nbytes=len(testing.content))
         if testing.status_code == 200:
             return f"{domain}/favicon.ico"
 
@@ -54,17 +63,18 @@ def get_favicon(domain: str, soup: BeautifulSoup) -> str or None:
         return None
 
 
-def favicon_external(domain: str, soup: BeautifulSoup) -> bool or None:
+def favicon_external(domain: str, soup: BeautifulSoup, budget: ScanBudget = None) -> bool or None:
     """
     This function checks if the favicon is loaded from an external
     domain. This is a sign of phishing.
 
     :param soup: BeautifulSoup: Pass the beautifulsoup object
     :param domain: str: Specify the domain to be checked
+    :param budget: ScanBudget: The resource budget of the scan
     :return: True if the favicon is loaded from an external domain
     """
 
-    favicon = get_favicon(domain, soup)
+    favicon = get_favicon(domain, soup, budget)
 
     # No favicon found.
     if favicon is None:
@@ -93,13 +103,18 @@ def website_traffic(response: requests.Response) -> int or None:
     """
     The website_traffic function takes in a requests.Response object and
     returns the number of bytes in the response content as an integer or
-    None if there is no content.
+    None if there is no content. If the WebScraper truncated the body at
+    its size limit, the result is a lower bound of the real size.
 
     :param response: requests.Response: Pass in the response object
     :return: The length/size of the response content in bytes
     """
     try:
         traffic = int(len(response.content))
+
+        if getattr(response, "truncated", False):
+            LOGGER.info(f"Body was truncated, website traffic is at least {traffic} bytes.")
+
         return traffic
 
     except:
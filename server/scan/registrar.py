@@ -16,29 +16,74 @@ __date__ = "2023-11-07"
 __status__ = "Prototype"
 
 # Imports.
+import functools
 import logging
 from datetime import datetime, timezone
 
-import country_converter
-import pypywhois as whois
+from server import const
+from server.controller.budget import ScanBudget
+from server.utils import cache, canonical, trace
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
-# Valid TLDs for whois.
-VALID_TLDS = whois.validTlds()
 
 
-def whois_info(domain: str) -> dict:
+@functools.lru_cache(maxsize=1)
+def valid_tlds() -> frozenset:
+    """
+    The TLDs WHOIS lookups are supported for, read from the table in
+    const.WHOIS_TLDS_FILE (precomputed with write_tlds, as building it
+    from pypywhois takes long at import).
+
+    :return: The TLDs.
+    :rtype: frozenset
+    """
+
+    with open(const.WHOIS_TLDS_FILE) as f:
+        return frozenset(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+
+def write_tlds() -> None:
+    """
+    Regenerate const.WHOIS_TLDS_FILE from pypywhois, after updating it.
+
+    :return: None
+    """
+
+    import pypywhois as whois
+
+    with open(const.WHOIS_TLDS_FILE, "w") as f:
+        f.write("# TLDs supported by pypywhois (pypywhois.validTlds()).\n")
+        f.write("# Regenerate with: python -m server.scan.registrar --tlds\n")
+        f.writelines(f"{tld}\n" for tld in whois.validTlds())
+
+
+@trace.traced()
+@cache.memoize(
+    ttl=const.DOMAIN_SOURCE_TTLS["whois"],
+    maxsize=const.DOMAIN_SOURCE_CACHE_SIZE,
+    key=canonical.registrable,
+)
+def whois_info(domain: str, budget: ScanBudget = None) -> dict:
     # Split domain and tld.
     tld = domain.rsplit(".", 1)[-1]
 
-    if tld not in VALID_TLDS:
+    if tld not in valid_tlds():
         LOGGER.info(f"Unsupported TLD '{tld}' for WHOIS lookup.")
         return {}
 
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("whois"):
+        return {}
+
+    # Imported on first use, it takes long to import.
+    import pypywhois as whois
+
     try:
-        whois_full = whois.query(domain).__dict__
+        budget.charge()
+        # WHOIS knows registrable domains only (not www.shop.de).
+        whois_full = whois.query(canonical.registrable(domain)).__dict__
 
         # Early exit if WHOIS info is not available.
         if whois_full is None:
@@ -121,6 +166,8 @@ def whois_info(domain: str) -> dict:
 
             # Convert country to ISO 3166-1 alpha-2 code if it not already.
             if len(country) != 2:
+                import country_converter
+
                 country = country_converter.convert(names=country, to='ISO2',
                                                     not_found="NaN"
                                                     )
@@ -185,6 +232,12 @@ def whois_info(domain: str) -> dict:
 
 
 if __name__ == "__main__":
+    import sys
+
+    if "--tlds" in sys.argv:
+        write_tlds()
+        sys.exit()
+
     website_domain = "0000-programasnet.blogspot.com"
 
     whois_result = whois_info(website_domain)
@@ -18,26 +18,52 @@ __status__ = "Prototype"
 # Imports.
 import json
 import logging
-import re
 import time
 from typing import Any, Dict
-from urllib.parse import urlparse
-import subprocess
 
 import requests
 from bs4 import BeautifulSoup
-from importlib import import_module
 import http.client
 from urllib.parse import quote
 
 from server import const
 from server.controller import scrape
+from server.controller.budget import ScanBudget
+from server.data import exceptions
+from server.utils import cache, canonical, limiter, trace
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
 
 
-def trustpilot(domain: str) -> dict:
+def _scrape(url: str, budget: ScanBudget) -> scrape.WebScraper:
+    """
+    Scrape a review site. The WebScraper stops at the end of the budget
+    instead of raising, so its BudgetExceededError is raised here: the
+    caller records its source as skipped, not as failed.
+
+    :param url: The url of the review page.
+    :type url: str
+    :param budget: The resource budget of the scan.
+    :type budget: ScanBudget
+    :return: The WebScraper object.
+    :rtype: WebScraper
+    :raises: BudgetExceededError.
+    """
+
+    response = scrape.get(domain=url, budget=budget)
+    if isinstance(response.error, exceptions.BudgetExceededError):
+        raise response.error
+    return response
+
+
+@trace.traced()
+@cache.memoize(
+    ttl=const.DOMAIN_SOURCE_TTLS["trustpilot"],
+    maxsize=const.DOMAIN_SOURCE_CACHE_SIZE,
+    key=canonical.registrable,
+)
+def trustpilot(domain: str, budget: ScanBudget = None) -> dict:
     """
     Get the trustpilot reviews for the specified domain.
 
@@ -45,11 +71,15 @@ def trustpilot(domain: str) -> dict:
     a paid API (200 USD per month).
     """
 
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("trustpilot"):
+        return {}
+
     url = f"https://de.trustpilot.com/review/{domain}"
 
     try:
         # response = requests.get(url, timeout=const.TIMEOUT)
-        response = scrape.get(domain=url)
+        response = _scrape(url, budget)
 
         if response.success is False:
             LOGGER.error(
@@ -94,12 +124,22 @@ def trustpilot(domain: str) -> dict:
         else:
             return {}
 
+    except exceptions.BudgetExceededError as e:
+        budget.skip("trustpilot", str(e))
+        return {}
+
     except Exception as e:
         LOGGER.error("An error occurred while fetching the trustpilot rating:" f" {str(e)}.")
         return {}
 
 
-def scamadviser(domain: str) -> dict:
+@trace.traced()
+@cache.memoize(
+    ttl=const.DOMAIN_SOURCE_TTLS["scamadviser"],
+    maxsize=const.DOMAIN_SOURCE_CACHE_SIZE,
+    key=canonical.registrable,
+)
+def scamadviser(domain: str, budget: ScanBudget = None) -> dict:
     """
     Get the scamadviser score and more data for the specified domain.
 
@@ -111,11 +151,15 @@ def scamadviser(domain: str) -> dict:
 
     """
 
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("scamadviser"):
+        return {}
+
     url = f"https://www.scamadviser.com/check-website/{domain}"
 
     try:
         # response = requests.get(url, timeout=const.TIMEOUT)
-        response = scrape.get(domain=url)
+        response = _scrape(url, budget)
 
         if response.success is False:
             raise RuntimeError("Force no ssl.")
@@ -123,12 +167,25 @@ def scamadviser(domain: str) -> dict:
         else:
             soup = response.soup
 
+    except exceptions.BudgetExceededError as e:
+        budget.skip("scamadviser", str(e))
+        return {}
+
     except Exception as e1:
         LOGGER.warning("Could not fetch scamadviser rating. Trying again with" "out SSL ...")
+        if not budget.allows("scamadviser"):
+            return {}
+
         try:
-            response = requests.get(
-                url=url, timeout=const.TIMEOUT, verify=False, allow_redirects=True
+            response = limiter.call(
+                requests.get,
+                url,
+                budget=budget,
+                timeout=const.TIMEOUT,
+                verify=False,
+                allow_redirects=True,
             )
+            budget.charge(nbytes=len(response.content))
 
             if response.status_code != 200:
                 LOGGER.error(
@@ -139,6 +196,10 @@ def scamadviser(domain: str) -> dict:
 
             soup = BeautifulSoup(response.text, "html.parser")
 
+        except exceptions.BudgetExceededError as e:
+            budget.skip("scamadviser", str(e))
+            return {}
+
         except Exception as e2:
             LOGGER.error(
                 "Final try to fetch scamadviser rating failed." f"Both errors: {str(e1)}{str(e2)}."
@@ -200,12 +261,17 @@ def scamadviser(domain: str) -> dict:
         return {}
 
 
-def virustotal(domain: str) -> dict:
+@trace.traced()
+def virustotal(domain: str, budget: ScanBudget = None) -> dict:
     """
     Get the virustotal report for the specified domain.
     API-Limit: 500 requests a day, 4 requests a minute.
     """
 
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("virustotal", paid=True):
+        return {}
+
     url = f"https://www.virustotal.com/api/v3/domains/{domain}"
 
     headers = {
@@ -213,7 +279,8 @@ def virustotal(domain: str) -> dict:
         "x-apikey": const.API_KEY_VT,
     }
     try:
-        response = requests.get(url, headers=headers, timeout=const.TIMEOUT)
+        response = requests.get(url, headers=headers, timeout=budget.timeout(const.TIMEOUT))
+        budget.charge(nbytes=len(response.content), paid=True)
 
         if response.status_code != 200:
             LOGGER.error(
@@ -241,16 +308,21 @@ def virustotal(domain: str) -> dict:
         return {}
 
 
-def getsafeonline(domain: str) -> dict[bool] or dict[None]:
+@trace.traced()
+def getsafeonline(domain: str, budget: ScanBudget = None) -> dict[bool] or dict[None]:
     """
     Get the getsafeonline check for the specified domain.
     """
 
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("getsafeonline"):
+        return {}
+
     url = f"https://check.getsafeonline.org/check/{domain}"
 
     try:
         # response = requests.get(url, timeout=const.TIMEOUT)
-        response = scrape.get(domain=url)
+        response = _scrape(url, budget)
 
         if response.response.status_code != 200:
             LOGGER.error(
@@ -285,18 +357,33 @@ def getsafeonline(domain: str) -> dict[bool] or dict[None]:
 
         return results
 
+    except exceptions.BudgetExceededError as e:
+        budget.skip("getsafeonline", str(e))
+        return {}
+
     except Exception as e:
         LOGGER.error("An error occurred while fetching the getsafeonline " f"checks: {str(e)}.")
         return {}
 
 
-def pagerank(domain: str) -> dict:
+@trace.traced()
+@cache.memoize(
+    ttl=const.DOMAIN_SOURCE_TTLS["pagerank"],
+    maxsize=const.DOMAIN_SOURCE_CACHE_SIZE,
+    key=canonical.registrable,
+)
+def pagerank(domain: str, budget: ScanBudget = None) -> dict:
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("pagerank"):
+        return {}
+
     url = "https://openpagerank.com/api/v1.0/getPageRank?domains%5B0%5D" f"={domain}"
 
     headers = {"API-OPR": const.API_KEY_PR}
 
     try:
-        response = requests.get(url, headers=headers, timeout=const.TIMEOUT)
+        response = requests.get(url, headers=headers, timeout=budget.timeout(const.TIMEOUT))
+        budget.charge(nbytes=len(response.content))
 
         if response.status_code != 200:
             LOGGER.error(
@@ -326,7 +413,12 @@ def pagerank(domain: str) -> dict:
         return {}
 
 
-def urlvoid(domain: str) -> dict:
+@trace.traced()
+def urlvoid(domain: str, budget: ScanBudget = None) -> dict:
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("urlvoid"):
+        return {}
+
     url = "https://www.urlvoid.com/"
     scan_url = f"https://www.urlvoid.com/scan/{domain}/"
 
@@ -335,7 +427,15 @@ def urlvoid(domain: str) -> dict:
     headers = {"Referer": scan_url}
 
     try:
-        response = requests.post(url, data=payload, headers=headers)
+        response = limiter.call(
+            requests.post,
+            url,
+            data=payload,
+            headers=headers,
+            budget=budget,
+            timeout=const.TIMEOUT,
+        )
+        budget.charge(nbytes=len(response.content))
 
         if response.status_code != 200:
             LOGGER.error(
@@ -369,7 +469,11 @@ def urlvoid(domain: str) -> dict:
 
         ip_link = soup.find("a", string="Find Websites")["href"]
 
-        response2 = requests.get(ip_link, timeout=const.TIMEOUT)
+        if not budget.allows("urlvoid"):
+            return {}
+
+        response2 = limiter.call(requests.get, ip_link, budget=budget, timeout=const.TIMEOUT)
+        budget.charge(nbytes=len(response2.content))
 
         if response2.status_code != 200:
             LOGGER.error(
@@ -401,116 +505,31 @@ def urlvoid(domain: str) -> dict:
 
         return results
 
+    except exceptions.BudgetExceededError as e:
+        budget.skip("urlvoid", str(e))
+        return {}
+
     except Exception as e:
         LOGGER.error("An error occurred while fetching URLVoid data:" f" {str(e)}.")
         return {}
 
 
-def social(domain: str) -> dict or None:
-    """
-    Get the social media profiles for the specified domain.
-    """
-
-    # Search for profiles with url.tld and url (shop.com and shop).
-    domain_strip = ".".join(domain.split(".")[:-1])
-
-    # Need to import social-analyzer dynamically because it has a
-    # '-' in its name.
-    social_analyzer = import_module("social-analyzer").SocialAnalyzer()
-
-    results = {"all_count": 0, "social_count": 0, "all": [], "social": []}
-    for name in [domain, domain_strip]:
-        result = social_analyzer.run_as_object(
-            username=name,
-            top=30,
-            silent=True,
-            output="json",
-            filter="good",
-            metadata=False,
-            timeout=2,
-            profiles="detected",
-            trim=True,
-            method="find",
-            extract=False,
-            options="link, " "type",
-        )["detected"]
-
-        for item in result:
-
-            # 'https://my.shop.com/buy/this' -> 'shop'.
-            domain_name = urlparse(item["link"]).netloc.split(".")[-2]
-
-            # Save pretty name of social media platform and count.
-            if domain_name not in results["all"]:
-                results["all_count"] += 1
-
-                results["all"].append(domain_name)
-
-                if "Social" in item["type"]:
-                    results["social"].append(domain_name)
-                    results["social_count"] += 1
-
-    return results
-
-
-def social2(domain: str) -> dict or None:
-    domain_strip = ".".join(domain.split(".")[:-1])
-
-    sherlock_local_path = f"{const.APP_PATH}/utils/sherlock/sherlock.py"
-    opt_arguments = "--no-color"
-    timeout_arg = "--timeout"
-    timeout_val = "20"
-    output_arg = "--output"
-    output_val = ""
-
-    results = {"social_count": 0, "social": []}
-
-    try:
-        result = subprocess.run(
-            [
-                "python3",
-                sherlock_local_path,
-                domain_strip,
-                opt_arguments,
-                timeout_arg,
-                timeout_val,
-                output_arg,
-                output_val,
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=300,
-        )
-
-        # print(result.stdout)
-
-        # Regular expression (only name of social media platform).
-        pattern = re.compile(r"\[\+\] (\w+):")
-
-        matches = pattern.findall(result.stdout)
-
-        for match in matches:
-            results["social_count"] += 1
-
-            results["social"].append(match)
-
-        return results
-
-    except subprocess.CalledProcessError as e:
-        LOGGER.error(
-            "An error occurred while fetching the social media "
-            f"profiles: {str(e), str(e.output)}."
-        )
-        return None
-
+@trace.traced()
+@cache.memoize(
+    ttl=const.DOMAIN_SOURCE_TTLS["trustedshops"],
+    maxsize=const.DOMAIN_SOURCE_CACHE_SIZE,
+    key=canonical.registrable,
+)
+def trustedshops(domain: str, budget: ScanBudget = None) -> dict:
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("trustedshops"):
+        return {}
 
-def trustedshops(domain: str) -> dict:
     url = f"https://www.trustedshops.de/shops/?q={domain}"
 
     try:
         # response = requests.get(url, timeout=const.TIMEOUT)
-        response = scrape.get(domain=url)
+        response = _scrape(url, budget)
 
         if response.response.status_code != 200:
             LOGGER.error(
@@ -537,7 +556,11 @@ def trustedshops(domain: str) -> dict:
             )
             return {"trusted": False}
 
-        response2 = requests.get(link, timeout=const.TIMEOUT)
+        if not budget.allows("trustedshops"):
+            return {}
+
+        response2 = limiter.call(requests.get, link, budget=budget, timeout=const.TIMEOUT)
+        budget.charge(nbytes=len(response2.content))
 
         if response2.status_code != 200:
             LOGGER.error(
@@ -570,6 +593,10 @@ def trustedshops(domain: str) -> dict:
 
         return {"trusted": True, "rating": rating, "reviews_count": reviews_count}
 
+    except exceptions.BudgetExceededError as e:
+        budget.skip("trustedshops", str(e))
+        return {}
+
     # Shop is not a TrustedShops partner.
     except Exception as e:
         LOGGER.error(
@@ -23,6 +23,7 @@ from importlib import import_module
 from urllib.parse import urlparse
 
 from server import const
+from server.controller.budget import ScanBudget
 
 # Child logger.
 LOGGER = logging.getLogger(__name__)
@@ -75,7 +76,11 @@ def social(domain: str) -> dict or None:
     return results
 
 
-def social2(domain: str) -> dict or None:
+def social2(domain: str, budget: ScanBudget = None) -> dict or None:
+    budget = budget or ScanBudget.unlimited()
+    if not budget.allows("social"):
+        return None
+
     domain_strip = ".".join(domain.split(".")[:-1])
 
     sherlock_local_path = f"{const.APP_PATH}/utils/sherlock/sherlock.py"
@@ -102,7 +107,7 @@ def social2(domain: str) -> dict or None:
             capture_output=True,
             text=True,
             check=True,
-            timeout=300,
+            timeout=budget.timeout(300),
         )
 
         # print(result.stdout)
@@ -125,3 +130,7 @@ def social2(domain: str) -> dict or None:
             f"profiles: {str(e)} {str(e.output)}."
         )
         return None
+
+    except subprocess.TimeoutExpired:
+        budget.skip("social", "time")
+        return None
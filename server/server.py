@@ -19,8 +19,10 @@ __status__ = "Prototype"
 import signal
 import sys
 
+from server import const
 from server.api import api
-from server.utils import log
+from server.controller import controller
+from server.utils import log, resolver
 
 # Root logger and log counter.
 LOG_COUNT = log.LogCount()
@@ -77,10 +79,91 @@ def exception_handler(exc_type, exc_value, exc_traceback):
     exit_handler(error=True)
 
 
-def main():
-    # Register handlers for clean exit of program.
-    for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGQUIT]:
-        signal.signal(sig, exit_handler)
+def preload() -> None:
+    """
+    Load the read-only, pure-Python data that the workers share: the
+    fast model, the known-score index and the user agent pool for the
+    request headers. Called before forking, so the workers share this
+    memory copy-on-write instead of loading it each.
+
+    The AI model is not preloaded: TensorFlow starts threads and holds
+    locks that do not survive fork(). Each worker loads it after
+    forking, during its warm-up (see controller.warm_up).
+
+    :return: None
+    """
+
+    from server.controller import scrape
+    from server.model import fast
+
+    fast.load()
+    controller.known_scores()
+    scrape.user_agents()
+
+    LOGGER.info("Preloaded fast model, known scores and header pool.")
+
+
+def _post_fork(server, worker) -> None:
+    # Threads do not survive fork: start the background work per worker.
+    # All workers store their request counts, but only the holder of the
+    # refresh lease refreshes (see scheduler.py).
+    controller.start_refresh()
+
+
+def _post_worker_init(worker) -> None:
+    # Readiness gate: the worker takes traffic once it is warmed up.
+    api.start_warm_up()
+
+
+def serve() -> None:
+    """
+    Run the API in production with gunicorn: const.SERVER_WORKERS
+    preforked worker processes with const.SERVER_THREADS threads each.
+    The application is preloaded once in the master process. Workers
+    are replaced gracefully after const.SERVER_MAX_REQUESTS requests
+    (plus jitter, so they do not restart at once).
+
+    :return: None
+    """
+
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def __init__(self, options: dict) -> None:
+            self.options = options
+            super().__init__()
+
+        def load_config(self) -> None:
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            preload()
+            return api.app
+
+    Application(
+        {
+            "bind": const.SERVER_BIND,
+            "workers": const.SERVER_WORKERS,
+            "threads": const.SERVER_THREADS,
+            "worker_class": "gthread",
+            "preload_app": True,
+            "max_requests": const.SERVER_MAX_REQUESTS,
+            "max_requests_jitter": const.SERVER_MAX_REQUESTS_JITTER,
+            "timeout": const.SERVER_TIMEOUT,
+            "graceful_timeout": const.SERVER_GRACEFUL_TIMEOUT,
+            "post_fork": _post_fork,
+            "post_worker_init": _post_worker_init,
+        }
+    ).run()
+
+
+def main(production: bool = False):
+    # Register handlers for clean exit of program. In production,
+    # gunicorn handles the signals (graceful shutdown of the workers).
+    if not production:
+        for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGQUIT]:
+            signal.signal(sig, exit_handler)
 
     # Set the exception hook.
     sys.excepthook = exception_handler
@@ -93,16 +176,24 @@ def main():
     LOGGER.info("Starting 1Guard server and running startup checks ...")
     LOGGER.info(f"You are running 1Guard server version: {__version__} " f"({__build__}).")
 
-    # Start API flask server.
-    api.start()
+    # Route all DNS lookups (httpx, requests, sockets, WHOIS) through
+    # the shared caching resolver.
+    resolver.install()
 
-    # TODO: Implement startup checks here.
+    if production:
+        # Start the preforked gunicorn workers.
+        serve()
+        return api.app
 
-    # All startup checks finished without critical errors.
-    LOGGER.info("Startup checks done and 1Guard server ready to run!")
+    # Refresh popular score entries before they expire.
+    controller.start_refresh()
+
+    # Start API flask server. The startup checks run as warm-up, see
+    # /readyz.
+    api.start()
 
     return api.app
 
 
 if __name__ == "__main__":
-    app = main()
+    app = main(production="--production" in sys.argv or const.SERVER_PRODUCTION)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""
+cache.py: Small thread-safe in-process caches.
+
+A bounded LRU cache with per-entry time-to-live, shared by the scan
+modules to avoid repeating network work for the same domain within a
+short time window, and a decorator to memoize functions with it.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-12"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded least-recently-used cache where every entry expires after a
+    time-to-live. All operations are guarded by a lock, so one instance
+    can be shared between threads.
+
+    :ivar int maxsize: Maximum number of entries kept in the cache.
+    :ivar float ttl: Default time-to-live of an entry in seconds.
+    :ivar int hits: Number of lookups that found a valid entry.
+    :ivar int misses: Number of lookups that found nothing or an
+        expired entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        """
+        Initialize the cache with its capacity and default TTL.
+
+        :param maxsize: Maximum number of entries kept in the cache.
+        :type maxsize: int
+        :param ttl: Default time-to-live of an entry in seconds.
+        :type ttl: float
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        # Key -> (expires_at, value), ordered from oldest to newest use.
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key, or default if there is no
+        entry or the entry is expired.
+
+        :param key: The key to look up.
+        :param default: Value returned on a miss. Default: None.
+        :return: The cached value or default.
+        """
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = item
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None) -> None:
+        """
+        Store value for key. Evicts the least recently used entry if the
+        cache is full.
+
+        :param key: The key to store the value under.
+        :param value: The value to store.
+        :param ttl: Time-to-live in seconds for this entry. Default:
+            the TTL of the cache.
+        :type ttl: float
+        :return: None
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        """
+        Remove the entry for key if present.
+
+        :param key: The key to remove.
+        :return: None
+        """
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all entries and reset the counters.
+
+        :return: None
+        """
+
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Return the hit and miss counters of the cache.
+
+        :return: A dict with hits, misses, size and hit_ratio.
+        :rtype: dict
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and time.monotonic() < item[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+def memoize(ttl: float, maxsize: int = 1024, key=None):
+    """
+    Decorator caching the results of a function taking a domain as its
+    first argument. Empty results ({}, None) are not cached, so failed
+    or skipped lookups are retried next time. The cache is available
+    as the 'cache' attribute of the decorated function.
+
+    :param ttl: Time-to-live of a result in seconds.
+    :type ttl: float
+    :param maxsize: Maximum number of cached results.
+    :type maxsize: int
+    :param key: Function mapping the domain to the cache key. Default:
+        the domain itself.
+    """
+
+    def decorator(func):
+        results = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        @functools.wraps(func)
+        def wrapper(domain, *args, **kwargs):
+            cache_key = key(domain) if key is not None else domain
+
+            result = results.get(cache_key)
+            if result is None:
+                result = func(domain, *args, **kwargs)
+                if result:
+                    results.set(cache_key, result)
+
+            return result
+
+        wrapper.cache = results
+        return wrapper
+
+    return decorator
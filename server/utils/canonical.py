@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+"""
+canonical.py: Canonical names of domains.
+
+The same shop reaches us as "https://www.Shop.de/", "shop.de:443",
+"bücher.de" or "xn--bcher-kva.de". Every cache and database row is
+keyed by the canonical name, so all spellings share one entry: the host
+is lower-cased, IDNA-encoded (punycode), stripped of port and a leading
+"www." label, and mapped through the aliases learned from redirects.
+The canonical name is a key only, websites are scanned under the host
+the user gave (see scan_hosts).
+
+Registrable domains (eTLD+1, e.g. "shop.co.uk") are determined with the
+public suffix list shipped in server/data, so no network access is
+needed.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-19"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import functools
+import ipaddress
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import idna
+
+from server import const
+from server.utils import cache
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# Rules of the public suffix list, loaded on first use.
+_RULES = None
+_LOCK = threading.Lock()
+
+# Learned aliases: canonical host -> canonical host it redirects to.
+ALIASES = cache.TTLCache(maxsize=const.ALIAS_CACHE_SIZE, ttl=const.ALIAS_TTL)
+
+
+def _load_rules() -> tuple[set, set, set]:
+    """
+    Parse the public suffix list into plain rules, wildcard rules
+    ("*.ck" -> "ck") and exception rules ("!www.ck" -> "www.ck"). All
+    rules are IDNA-encoded, like the hosts we look up.
+
+    :return: The plain, wildcard and exception rules.
+    :rtype: tuple[set, set, set]
+    """
+
+    global _RULES
+
+    if _RULES is None:
+        with _LOCK:
+            if _RULES is None:
+                rules, wildcards, exceptions = set(), set(), set()
+
+                with open(const.PSL_FILE, encoding="utf-8") as f:
+                    for line in f:
+                        rule = line.strip()
+                        if not rule or rule.startswith("//"):
+                            continue
+
+                        if not rule.isascii():
+                            prefix = rule[: len(rule) - len(rule.lstrip("!*."))]
+                            try:
+                                name = idna.encode(rule[len(prefix):], uts46=True).decode()
+                            except idna.IDNAError:
+                                continue
+                            rule = prefix + name
+
+                        if rule.startswith("!"):
+                            exceptions.add(rule[1:])
+                        elif rule.startswith("*."):
+                            wildcards.add(rule[2:])
+                        else:
+                            rules.add(rule)
+
+                _RULES = (rules, wildcards, exceptions)
+                LOGGER.debug(f"Loaded {len(rules) + len(wildcards)} public suffix rules.")
+
+    return _RULES
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def hostname(domain: str) -> str:
+    """
+    Extract the host of a url or domain and normalize it: lower case,
+    IDNA (punycode), no port, credentials or trailing dot.
+
+    :param domain: A url or domain (e.g. "https://Bücher.de:443/x").
+    :type domain: str
+    :return: The normalized host (e.g. "xn--bcher-kva.de").
+    :rtype: str
+    """
+
+    domain = domain.strip()
+    if "://" not in domain:
+        domain = f"//{domain}"
+
+    host = (urlsplit(domain).hostname or "").rstrip(".")
+
+    if host.isascii():
+        return host.lower()
+
+    try:
+        return idna.encode(host, uts46=True).decode()
+    except idna.IDNAError:
+        return host.lower()
+
+
+def public_suffix(domain: str) -> str:
+    """
+    Return the public suffix (eTLD) of a domain, e.g. "co.uk" for
+    "shop.co.uk". Unlisted TLDs count as public suffix (rule "*").
+
+    :param domain: A url or domain.
+    :type domain: str
+    :return: The public suffix.
+    :rtype: str
+    """
+
+    host = hostname(domain)
+    rules, wildcards, exceptions = _load_rules()
+    labels = host.split(".")
+
+    # The first (longest) matching candidate wins.
+    for i in range(len(labels)):
+        candidate = ".".join(labels[i:])
+        if candidate in exceptions:
+            return ".".join(labels[i + 1:])
+        if candidate in rules or ".".join(labels[i + 1:]) in wildcards:
+            return candidate
+
+    return labels[-1]
+
+
+def registrable(domain: str) -> str:
+    """
+    Return the registrable domain (eTLD+1) of a domain, e.g.
+    "shop.co.uk" for "www.shop.co.uk". Domain-level sources (WHOIS,
+    reviews, rankings) describe this name, not a single host.
+
+    :param domain: A url or domain.
+    :type domain: str
+    :return: The registrable domain, or the host itself if it is an IP
+        address or a public suffix.
+    :rtype: str
+    """
+
+    host = hostname(domain)
+    if _is_ip(host):
+        return host
+
+    suffix = public_suffix(host)
+    if host == suffix:
+        return host
+
+    label = host[: -len(suffix) - 1].rsplit(".", 1)[-1]
+    return f"{label}.{suffix}"
+
+
+def canonical(domain: str) -> str:
+    """
+    Return the canonical name of a domain, under which its score is
+    cached and stored.
+
+    :param domain: A url or domain (e.g. "https://www.Shop.de:443/").
+    :type domain: str
+    :return: The canonical name (e.g. "shop.de").
+    :rtype: str
+    """
+
+    host = _strip_www(hostname(domain))
+    return ALIASES.get(host, host)
+
+
+def scan_hosts(domain: str, host: str = None) -> list[str]:
+    """
+    Return the hosts to scan for a canonical name, in order, until one
+    is reachable. The canonical name is only a cache key: sites that
+    answer under "www." only are scanned under the host the user gave
+    or, if no host is known (e.g. background refreshes), under the
+    "www." form as fallback.
+
+    :param domain: The canonical name (e.g. "shop.de").
+    :type domain: str
+    :param host: The host the user asked for, see hostname().
+    :type host: str
+    :return: The hosts to try (e.g. ["shop.de", "www.shop.de"]).
+    :rtype: list[str]
+    """
+
+    if host:
+        return [host]
+
+    www = f"www.{domain}"
+    if domain.startswith("www.") or _strip_www(www) != domain:
+        return [domain]
+    return [domain, www]
+
+
+def _strip_www(host: str) -> str:
+    if host.startswith("www.") and host != registrable(host):
+        return host[4:]
+    return host
+
+
+def learn(domain: str, response) -> None:
+    """
+    Learn aliases from the redirect chain of a response: every host the
+    request passed through becomes an alias of the final host. Only pass
+    responses of the scanned website itself, not of review sites. Aliases
+    to other registrable domains are only learned with
+    const.ALIAS_CROSS_DOMAIN, as redirects can be cloaked.
+
+    :param domain: The requested domain.
+    :type domain: str
+    :param response: A httpx or requests response (with 'history').
+    :return: None
+    """
+
+    if response is None or response.status_code >= 400:
+        return
+
+    target = _strip_www(hostname(str(response.url)))
+    if not target:
+        return
+
+    hops = [domain] + [str(r.url) for r in getattr(response, "history", [])]
+    for hop in hops:
+        alias = _strip_www(hostname(hop))
+        if not alias or alias == target:
+            continue
+        if not const.ALIAS_CROSS_DOMAIN and registrable(alias) != registrable(target):
+            continue
+
+        if ALIASES.get(alias) != target:
+            ALIASES.set(alias, target)
+            LOGGER.debug(f"Learned alias '{alias}' -> '{target}'.")
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+"""
+limiter.py: Per-host politeness and concurrency limiter.
+
+All scan workers share the same third-party review sites. Without
+coordination they hit them in bursts, get answered with 429 or banned,
+and the features end up as "NaN". Every host listed in
+const.HOST_LIMITS gets a fair (FIFO) concurrency cap, a token bucket
+for the request rate, and is paused as requested by 'Retry-After'.
+Requests wait in line instead of failing.
+
+The limits are kept in the memory of each process and are not shared:
+with N worker processes, a host gets up to N times the configured
+limit. The queue statistics are exported per host by /metrics.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-14"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from server import const
+from server.data import exceptions
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations. A reservation always
+    succeeds and returns how long the caller has to wait, so callers
+    are served strictly in the order they reserve.
+
+    :ivar float rate: Tokens added per second.
+    :ivar float capacity: Maximum number of tokens (burst size).
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens from the bucket, going into debt if necessary.
+
+        :param tokens: Number of tokens to take. Default: 1.
+        :type tokens: float
+        :return: Seconds to wait until the reservation is covered.
+        :rtype: float
+        """
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def level(self) -> float:
+        """
+        :return: The number of tokens currently in the bucket (negative
+            while reservations are in debt).
+        :rtype: float
+        """
+
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def try_take(self, tokens: float = 1.0) -> tuple[bool, float]:
+        """
+        Take tokens only if enough are available.
+
+        :param tokens: Number of tokens to take. Default: 1.
+        :type tokens: float
+        :return: (True, remaining tokens) on success, otherwise (False,
+            seconds until enough tokens are available).
+        :rtype: tuple[bool, float]
+        """
+
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True, self._tokens
+            return False, (tokens - self._tokens) / self.rate
+
+
+class HostLimit:
+    """
+    Limits for one host: FIFO concurrency slots, a token bucket and a
+    pause set by 'Retry-After'. Also keeps the queue statistics.
+
+    :ivar str host: The host (or parent domain) the limit applies to.
+    :ivar int concurrency: Maximum number of parallel requests.
+    :ivar TokenBucket bucket: The request rate limit.
+    """
+
+    def __init__(self, host: str, concurrency: int, rate: float, burst: int) -> None:
+        self.host = host
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate=rate, capacity=burst)
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._active = 0
+        self._paused_until = 0.0
+
+        # Statistics.
+        self.requests = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self, timeout: float = None) -> float:
+        """
+        Wait for a free slot in FIFO order, then for the rate limit and
+        a possible 'Retry-After' pause.
+
+        :param timeout: Maximum seconds to wait in total. Default: wait
+            forever.
+        :type timeout: float
+        :return: Seconds spent waiting.
+        :rtype: float
+        :raises: TimeoutError if no slot became free in time, or the
+            rate limit or pause would exceed the timeout.
+        """
+
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        ticket = object()
+
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or self._active >= self.concurrency:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No free slot for '{self.host}' after {timeout} s.")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+
+            self._queue.popleft()
+            self._active += 1
+            self._cond.notify_all()
+            pause = self._paused_until - time.monotonic()
+
+        delay = max(pause, 0.0, self.bucket.reserve())
+        if deadline is not None and time.monotonic() + delay > deadline:
+            # Give back the token and the slot, nobody waits in vain.
+            self.bucket.reserve(-1.0)
+            self.release()
+            raise TimeoutError(f"'{self.host}' is paused longer than {timeout} s.")
+        if delay:
+            time.sleep(delay)
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self.requests += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+        return waited
+
+    def release(self) -> None:
+        """
+        Free the slot taken by acquire().
+
+        :return: None
+        """
+
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Pause all requests to this host, e.g. after a 429 response.
+
+        :param seconds: Seconds to pause.
+        :type seconds: float
+        :return: None
+        """
+
+        with self._cond:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        """
+        Return the queue statistics of this host.
+
+        :return: A dict with requests, throttled, active, queued and
+            the total, max and average wait time in seconds.
+        :rtype: dict
+        """
+
+        with self._cond:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "active": self._active,
+                "queued": len(self._queue),
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+                "wait_avg": self.wait_total / self.requests if self.requests else 0.0,
+            }
+
+
+# One limit per configured host, shared by all threads of the process.
+LIMITS = {
+    host: HostLimit(host, concurrency, rate, burst)
+    for host, (concurrency, rate, burst) in const.HOST_LIMITS.items()
+}
+
+
+def get_limit(url: str) -> HostLimit or None:
+    """
+    Find the limit for the host of a url. Subdomains share the limit of
+    their configured parent (de.trustpilot.com -> trustpilot.com).
+
+    :param url: The url or host name.
+    :type url: str
+    :return: The matching HostLimit, or None if the host is unlimited.
+    :rtype: HostLimit | None
+    """
+
+    host = (urlparse(url).hostname if "://" in url else url.split("/")[0]) or ""
+    host = host.lower()
+
+    while host:
+        if host in LIMITS:
+            return LIMITS[host]
+        host = host.partition(".")[2]
+
+    return None
+
+
+@contextmanager
+def slot(url: str, budget=None):
+    """
+    Context manager that holds a request slot for the host of url.
+    Unlimited hosts pass through immediately. Waits at most
+    const.HOST_LIMIT_MAX_WAIT seconds, and no longer than the remaining
+    time of the scan.
+
+    :param url: The url of the request.
+    :type url: str
+    :param budget: The ScanBudget of the scan. Default: no budget.
+    :raises: TimeoutError if no slot became free in time,
+        BudgetExceededError if the scan ran out of time waiting.
+    """
+
+    limit = get_limit(url)
+    if limit is None:
+        yield 0.0
+        return
+
+    timeout = const.HOST_LIMIT_MAX_WAIT
+    if budget is not None and budget.remaining() < timeout:
+        timeout = budget.remaining()
+        try:
+            waited = limit.acquire(timeout=timeout)
+        except TimeoutError:
+            raise exceptions.BudgetExceededError("time") from None
+    else:
+        waited = limit.acquire(timeout=timeout)
+    if waited >= 0.1:
+        LOGGER.debug(f"Waited {waited:.2f} s for a request slot at '{limit.host}'.")
+
+    try:
+        yield waited
+    finally:
+        limit.release()
+
+
+def retry_after(response) -> float:
+    """
+    Read the 'Retry-After' header of a response (seconds or HTTP date).
+
+    :param response: A httpx or requests response object.
+    :return: Seconds to wait, clamped to const.HOST_LIMIT_MAX_BACKOFF.
+    :rtype: float
+    """
+
+    value = response.headers.get("Retry-After", "")
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+            seconds = (date - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            seconds = const.HOST_LIMIT_BACKOFF
+
+    return min(max(seconds, 0.0), const.HOST_LIMIT_MAX_BACKOFF)
+
+
+def call(send, url: str, budget=None, **kwargs):
+    """
+    Send a request through the limiter of its host. Responses with
+    status 429 pause the host for 'Retry-After' seconds and the request
+    queues up again, instead of failing. With a budget, waiting and
+    pausing stop at the end of the scan, and the request timeout is
+    clamped to the time left once the slot is taken.
+
+    :param send: The function sending the request, e.g. requests.get
+        or httpx.Client.get. Called as send(url, **kwargs).
+    :param url: The url of the request.
+    :type url: str
+    :param budget: The ScanBudget of the scan. Default: no budget.
+    :return: The response of the last attempt.
+    :raises: TimeoutError if no slot became free in time,
+        BudgetExceededError if the scan ran out of time waiting.
+    """
+
+    timeout = kwargs.get("timeout")
+    limit = get_limit(url)
+
+    for attempt in range(const.HOST_LIMIT_RETRIES + 1):
+        with slot(url, budget):
+            if budget is not None and timeout is not None:
+                kwargs["timeout"] = budget.timeout(timeout)
+            response = send(url, **kwargs)
+
+        if limit is None or response.status_code != 429 or attempt == const.HOST_LIMIT_RETRIES:
+            return response
+
+        delay = retry_after(response)
+        LOGGER.warning(f"Rate limited by '{limit.host}'. Pausing for {delay:.0f} s.")
+        limit.pause(delay)
+
+        # The pause would outlast the scan: no point in queueing again.
+        if budget is not None and delay >= budget.remaining():
+            return response
+
+    return response
+
+
+def stats() -> dict:
+    """
+    Return the queue statistics of all limited hosts.
+
+    :return: Host -> statistics (see HostLimit.stats).
+    :rtype: dict
+    """
+
+    return {host: limit.stats() for host, limit in LIMITS.items()}
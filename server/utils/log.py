@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 """
-log.py: TODO: Headline...
+log.py: Logging setup of the server.
 
-TODO: Description...
+Log records are put into a queue by the logging thread and written to
+the log file and stdout by a background thread (QueueListener), as
+text or JSON lines. Chatty loggers are sampled below WARNING, and
+warnings, errors and criticals are counted (see /metrics).
 """
 
 # Header.
@@ -16,62 +19,211 @@ __date__ = "2023-10-09"
 __status__ = "Development"
 
 # Imports.
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from .. import const
+from . import metrics
 
+# Log messages per level, exported by /metrics.
+MESSAGES = metrics.Counter("log_messages", "Log messages per level.", ("level",))
 
-# Custom logging handler to count warnings, errors and criticals.
-class LogCount(logging.Handler):
+# The background writer of this process (see create_logger).
+_LISTENER = None
+_LISTENER_LOCK = threading.Lock()
+
+
+# Counter of warnings, errors and criticals. Attached as a filter, so it
+# counts in the logging thread without a lock, and by level number.
+class LogCount(logging.Filter):
     def __init__(self):
         super().__init__()
-        self.warnings = 0
-        self.errors = 0
-        self.criticals = 0
+        self._levels = {
+            logging.WARNING: MESSAGES.labels("warning"),
+            logging.ERROR: MESSAGES.labels("error"),
+            logging.CRITICAL: MESSAGES.labels("critical"),
+        }
+
+    def filter(self, record):
+        counter = self._levels.get(record.levelno)
+        if counter is not None:
+            counter.inc()
+        return True
+
+    @property
+    def warnings(self):
+        return self._levels[logging.WARNING].get()
+
+    @property
+    def errors(self):
+        return self._levels[logging.ERROR].get()
+
+    @property
+    def criticals(self):
+        return self._levels[logging.CRITICAL].get()
+
+
+# Drops a share of the records below WARNING of chatty loggers, before
+# they are queued. Rates per logger name (or parent) in const.LOG_SAMPLING.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            prefix = name
+            while prefix and prefix not in self.rates:
+                prefix = prefix.rpartition(".")[0]
+            rate = self._resolved[name] = self.rates.get(prefix, 1.0)
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+# One JSON object per line: time, level, logger, file, line, thread,
+# message and the exception, if any.
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+# Queues the records with their message rendered (the arguments may
+# change or not be picklable later), keeping the exception apart, so
+# the JSON output can put it into its own field.
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _formatter():
+    if const.LOG_FORMAT == "json":
+        return JsonFormatter()
+
+    # Define format (level, timestamp, filename, line number, message).
+    return logging.Formatter(
+        fmt="%(levelname)s | %(asctime)s | %(filename)s:%(lineno)s | %(" "message)s",
+        datefmt="%Y-%m-%dT%H:%M:%SZ",
+    )
+
+
+def _start_listener(queue_handler):
+    global _LISTENER
+
+    with _LISTENER_LOCK:
+        # Log file: Rotate log file every 2 MB and keep 5 old log files.
+        file_handler = RotatingFileHandler(const.LOG_FILE, backupCount=5, maxBytes=2000000)
+
+        # Stdout: Print log messages to stdout (only for testing).
+        stdout_handler = logging.StreamHandler(stream=sys.stdout)
+
+        # Set the format for the handlers.
+        fmt = _formatter()
+        file_handler.setFormatter(fmt)
+        stdout_handler.setFormatter(fmt)
+
+        # The background thread writing the queued records.
+        queue_handler.queue = queue.SimpleQueue()
+        _LISTENER = QueueListener(queue_handler.queue, file_handler, stdout_handler)
+        _LISTENER.start()
 
-    def emit(self, record):
-        if record.levelname == "WARNING":
-            self.warnings += 1
-        elif record.levelname == "ERROR":
-            self.errors += 1
-        elif record.levelname == "CRITICAL":
-            self.criticals += 1
+
+def _after_fork(queue_handler):
+    global _LISTENER, _LISTENER_LOCK
+
+    # The lock may have been held by another thread of the parent.
+    _LISTENER_LOCK = threading.Lock()
+    _LISTENER = None
+    _start_listener(queue_handler)
+
+
+def stop():
+    """
+    Write all queued records and stop the background writer.
+
+    :return: None
+    """
+
+    global _LISTENER
+
+    with _LISTENER_LOCK:
+        if _LISTENER is not None:
+            _LISTENER.stop()
+            _LISTENER = None
 
 
 def create_logger(counter):
+    """
+    Set up the root logger: Records are counted (counter), sampled
+    (const.LOG_SAMPLING) and put into a queue in the logging thread.
+    Formatting and writing to the log file and stdout happens in a
+    background thread, so logging never blocks on I/O.
+
+    :param counter: The LogCount of the process.
+    :type counter: LogCount
+    :return: The root logger.
+    :rtype: logging.Logger
+    """
+
     # Prepare directory for log file.
     os.makedirs(os.path.dirname(const.LOG_FILE), exist_ok=True)
 
     # Create root logger.
     logger = logging.getLogger()
 
-    # Log file: Rotate log file every 2 MB and keep 5 old log files.
-    file_handler = RotatingFileHandler(const.LOG_FILE, backupCount=5, maxBytes=2000000)
+    queue_handler = _QueueHandler(queue.SimpleQueue())
+    queue_handler.setFormatter(logging.Formatter())
+    queue_handler.addFilter(counter)
+    queue_handler.addFilter(SamplingFilter(const.LOG_SAMPLING))
+    _start_listener(queue_handler)
 
-    # Stdout: Print log messages to stdout (only for testing).
-    stdout_handler = logging.StreamHandler(stream=sys.stdout)
+    # Threads do not survive fork: forked workers need their own
+    # writer, or their records would pile up in the queue.
+    os.register_at_fork(after_in_child=lambda: _after_fork(queue_handler))
 
-    # Define format (level, timestamp, filename, line number, message).
-    fmt = logging.Formatter(
-        fmt="%(levelname)s | %(asctime)s | %(filename)s:%(lineno)s | %(" "message)s",
-        datefmt="%Y-%m-%dT%H:%M:%SZ",
-    )
-
-    # Set the format for the handlers.
-    file_handler.setFormatter(fmt)
-    stdout_handler.setFormatter(fmt)
-
-    # Add the handlers to the logger (error counter, file and stdout).
-    logger.addHandler(counter)
-    logger.addHandler(file_handler)
-    logger.addHandler(stdout_handler)
+    # Add the queue handler to the logger.
+    logger.addHandler(queue_handler)
 
     # Set the log level to default (INFO).
     logger.setLevel(logging.INFO)
 
+    # Write the remaining records on exit.
+    atexit.register(stop)
+
     return logger
 
 
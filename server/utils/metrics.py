@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""
+metrics.py: Counters and histograms in the Prometheus text format.
+
+Metrics are recorded on hot paths (every request, every source of a
+scan), so recording must not contend for a lock: every thread counts
+into its own cells, and the cells of all threads are only summed up
+when /metrics is scraped. Cells of finished threads are folded into a
+base, so short-lived threads do not pile up. Values read while threads
+are still counting may lag behind by a few observations, which is fine
+for monitoring.
+
+Gauges and the counters the modules already keep are read from
+callbacks at scrape time, so their stats() (caches, queues, limiters)
+are exported without extra work on the hot path.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-23"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds, from a cache hit to a full scan.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Cells:
+    """
+    Per-thread lists of numbers, summed up on read.
+
+    :ivar int size: Number of cells per thread.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._base = [0] * size
+        self._threads = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def mine(self) -> list:
+        """
+        :return: The cells of the current thread, to be updated without
+            a lock.
+        :rtype: list
+        """
+
+        cells = getattr(self._local, "cells", None)
+        if cells is None:
+            cells = self._local.cells = [0] * self.size
+            with self._lock:
+                self._threads.append((threading.current_thread(), cells))
+        return cells
+
+    def read(self) -> list:
+        """
+        :return: The sums of the cells of all threads.
+        :rtype: list
+        """
+
+        with self._lock:
+            alive = []
+            for thread, cells in self._threads:
+                if thread.is_alive():
+                    alive.append((thread, cells))
+                else:
+                    self._base = [a + b for a, b in zip(self._base, cells)]
+            self._threads = alive
+
+            total = list(self._base)
+            for _, cells in alive:
+                total = [a + b for a, b in zip(total, cells)]
+
+        return total
+
+
+class _Family:
+    """
+    A metric with a name, a help text and optional labels. Each
+    combination of label values has its own child.
+
+    :ivar str name: The metric name.
+    :ivar str help: The help text.
+    :ivar tuple labelnames: The label names.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        Return the child for label values (in the order of labelnames).
+
+        :return: The child metric.
+        """
+
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        """
+        :return: (name suffix, labels, value) of all children.
+        :rtype: list[tuple[str, dict, float]]
+        """
+
+        result = []
+        for values, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            result.extend((suffix, {**labels, **extra}, value) for suffix, extra, value in child)
+        return result
+
+
+class _CounterChild:
+    def __init__(self) -> None:
+        self._cells = _Cells(1)
+
+    def inc(self, amount: float = 1) -> None:
+        self._cells.mine()[0] += amount
+
+    def get(self) -> float:
+        return self._cells.read()[0]
+
+    def __iter__(self):
+        yield "_total", {}, self._cells.read()[0]
+
+
+class Counter(_Family):
+    """
+    Monotonic counter, e.g. of requests or errors.
+    """
+
+    kind = "counter"
+    _child = _CounterChild
+
+    def inc(self, amount: float = 1) -> None:
+        """
+        Increase the counter without labels.
+
+        :param amount: The amount. Default: 1.
+        :type amount: float
+        :return: None
+        """
+
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        # One cell per bucket, +Inf, then the sum.
+        self._cells = _Cells(len(buckets) + 2)
+
+    def observe(self, value: float) -> None:
+        cells = self._cells.mine()
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def __iter__(self):
+        cells = self._cells.read()
+        count = 0
+        for bound, n in zip(self.buckets + ("+Inf",), cells):
+            count += n
+            yield "_bucket", {"le": str(bound)}, count
+        yield "_count", {}, count
+        yield "_sum", {}, cells[-1]
+
+
+class Histogram(_Family):
+    """
+    Distribution of values, e.g. latencies in seconds.
+
+    :ivar tuple buckets: The upper bounds of the buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets=BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames)
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """
+        Record a value without labels.
+
+        :param value: The value.
+        :type value: float
+        :return: None
+        """
+
+        self.labels().observe(value)
+
+    @contextmanager
+    def time(self, *values):
+        """
+        Context manager recording the seconds its block took.
+
+        :param values: The label values.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.labels(*values).observe(time.perf_counter() - start)
+
+
+class Callback(_Family):
+    """
+    Metric read from a callback at scrape time, e.g. a queue depth or
+    the counters of a cache. The callback returns a number, or a dict
+    mapping tuples of label values to numbers.
+
+    :ivar str kind: The metric type, 'gauge' or 'counter'.
+    """
+
+    def __init__(
+        self, name: str, help: str, func, labelnames: tuple = (), kind: str = "gauge"
+    ) -> None:
+        self.func = func
+        self.kind = kind
+        super().__init__(name, help, labelnames)
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        value = self.func()
+        if not isinstance(value, dict):
+            return [("", {}, value)]
+
+        return [
+            ("", dict(zip(self.labelnames, (str(v) for v in values))), number)
+            for values, number in value.items()
+        ]
+
+
+# All metrics of the process, in the order of creation.
+REGISTRY = []
+
+
+def _format(name: str, labels: dict, value: float) -> str:
+    if labels:
+        pairs = ",".join(
+            '{}="{}"'.format(
+                key, str(val).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            )
+            for key, val in labels.items()
+        )
+        name = f"{name}{{{pairs}}}"
+
+    if isinstance(value, float) and not value.is_integer():
+        return f"{name} {value!r}"
+    return f"{name} {int(value)}"
+
+
+def render() -> str:
+    """
+    Render all metrics in the Prometheus text format (version 0.0.4).
+    A failing gauge callback is skipped, not the whole page.
+
+    :return: The text for the /metrics endpoint.
+    :rtype: str
+    """
+
+    lines = []
+    for metric in REGISTRY:
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            LOGGER.warning(f"Metric '{metric.name}' failed: {e.__class__.__name__}: {e}")
+            continue
+
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(
+            _format(metric.name + suffix, labels, value) for suffix, labels, value in samples
+        )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+"""
+ratelimit.py: Per-client rate limits of the API.
+
+Every client (its UUID if authenticated, otherwise its IP address) gets
+its own token bucket: secrets.API_THROTTLE requests per second with
+bursts of const.RATE_LIMIT_BURST. The buckets are spread over shards
+with a lock each, so clients rarely wait for each other. By default
+the buckets live in the memory of each process. With
+const.RATE_LIMIT_DB_FILE, they are kept in a SQLite database instead,
+so the limit holds across all API workers of the host.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-23"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import math
+import sqlite3
+import threading
+import time
+import zlib
+
+from server import const
+from server.utils.limiter import TokenBucket
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+class MemoryBuckets:
+    """
+    Token buckets of the clients in the memory of this process, spread
+    over shards by the hash of the client key.
+
+    :ivar int shards: Number of shards.
+    :ivar int max_clients: Number of buckets kept per shard before
+        full (idle) buckets are dropped.
+    """
+
+    def __init__(self, shards: int = 16, max_clients: int = 10000) -> None:
+        self.shards = shards
+        self.max_clients = max(1, max_clients // shards)
+        self._buckets = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+    def take(
+        self, key: str, rate: float, capacity: float, cost: float = 1.0
+    ) -> tuple[bool, float, float]:
+        """
+        Take tokens from the bucket of a client, all or none.
+
+        :param key: The client key.
+        :type key: str
+        :param rate: Tokens added per second.
+        :type rate: float
+        :param capacity: Maximum number of tokens (burst size).
+        :type capacity: float
+        :param cost: Number of tokens to take.
+        :type cost: float
+        :return: (True, remaining tokens, 0) on success, otherwise
+            (False, remaining tokens, seconds until enough tokens are
+            available).
+        :rtype: tuple[bool, float, float]
+        """
+
+        shard = zlib.crc32(key.encode()) % self.shards
+
+        with self._locks[shard]:
+            buckets = self._buckets[shard]
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self.max_clients:
+                    self._evict(buckets)
+                bucket = buckets[key] = TokenBucket(rate=rate, capacity=capacity)
+
+        allowed, value = bucket.try_take(cost)
+        if allowed:
+            return True, value, 0.0
+        return False, bucket.level(), value
+
+    def _evict(self, buckets: dict) -> None:
+        # Full buckets behave like new ones, forgetting them is free.
+        for key in [key for key, bucket in buckets.items() if bucket.level() >= bucket.capacity]:
+            del buckets[key]
+
+        # Everyone is active: drop the oldest half.
+        if len(buckets) >= self.max_clients:
+            for key in list(buckets)[: len(buckets) // 2]:
+                del buckets[key]
+
+
+class SQLiteBuckets:
+    """
+    Token buckets of the clients in a SQLite database, shared by all
+    processes on this host.
+
+    :ivar str path: The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, kept open: a request must not pay
+        # for opening the database.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(
+        self, key: str, rate: float, capacity: float, cost: float = 1.0
+    ) -> tuple[bool, float, float]:
+        """
+        Take tokens from the bucket of a client (see
+        MemoryBuckets.take).
+        """
+
+        conn = self._connection()
+        now = time.time()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,))
+            row = row.fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+
+            # Now and then, forget the clients whose buckets are full.
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - capacity / rate,))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return allowed, tokens, 0.0 if allowed else (cost - tokens) / rate
+
+
+class ClientLimiter:
+    """
+    Rate limit per client.
+
+    :ivar float rate: Requests per second per client.
+    :ivar float burst: Requests a client may send at once.
+    :ivar int allowed: Allowed requests.
+    :ivar int limited: Rejected requests.
+    """
+
+    def __init__(self, rate: float, burst: float, store=None) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+        self._store = store or MemoryBuckets(
+            shards=const.RATE_LIMIT_SHARDS, max_clients=const.RATE_LIMIT_MAX_CLIENTS
+        )
+
+    def check(self, key: str, cost: int = 1) -> tuple[bool, dict]:
+        """
+        Count a request of a client.
+
+        :param key: The client key (UUID or IP address).
+        :type key: str
+        :param cost: Number of requests it counts as (e.g. the domains
+            of a batch). At most the burst size.
+        :type cost: int
+        :return: Whether the request is allowed, and the 'RateLimit-*'
+            headers for the response (plus 'Retry-After' if it is not).
+        :rtype: tuple[bool, dict]
+        """
+
+        try:
+            allowed, tokens, wait = self._store.take(key, self.rate, self.burst, cost)
+        except sqlite3.Error as e:
+            # Better no limit than no API.
+            LOGGER.error(f"Rate limit store failed: {e.__class__.__name__}: {e}")
+            return True, {}
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+
+        headers = {
+            "RateLimit-Limit": str(int(self.burst)),
+            "RateLimit-Remaining": str(int(tokens)),
+            "RateLimit-Reset": str(math.ceil((self.burst - tokens) / self.rate)),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(wait)))
+
+        return allowed, headers
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the limiter.
+
+        :return: A dict with allowed and limited.
+        :rtype: dict
+        """
+
+        return {"allowed": self.allowed, "limited": self.limited}
+
+
+def create(rate: float) -> ClientLimiter:
+    """
+    Create the client limiter configured in const.
+
+    :param rate: Requests per second per client.
+    :type rate: float
+    :return: The limiter.
+    :rtype: ClientLimiter
+    """
+
+    store = SQLiteBuckets(const.RATE_LIMIT_DB_FILE) if const.RATE_LIMIT_DB_FILE else None
+    return ClientLimiter(rate=rate, burst=max(const.RATE_LIMIT_BURST, 1), store=store)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+"""
+resolver.py: Process-wide caching DNS resolver.
+
+A single scan resolves the same hosts through httpx, requests, pyOpenSSL
+sockets and the WHOIS client. Instead of teaching every transport about
+a cache, we replace socket.getaddrinfo once at startup. All of them end
+up there, so every lookup is answered from one cache that honors the
+record TTLs (queried with dnspython) and coalesces concurrent lookups
+for the same host. Names in the hosts file (const.DNS_HOSTS_FILE) and
+names DNS does not know (e.g. from other nsswitch sources) are left
+to the system resolver.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-13"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import ipaddress
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dns.exception
+import dns.resolver
+
+from server import const
+from server.utils import cache, trace
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# The original implementation, used for the real lookups.
+_SYSTEM_GETADDRINFO = socket.getaddrinfo
+
+
+class CachingResolver:
+    """
+    Resolves host names to IP addresses and caches them for the TTL of
+    the DNS records. Concurrent lookups for the same host wait for the
+    first one instead of querying again. Failed lookups are cached for
+    a short time as well.
+
+    :ivar TTLCache cache: Host -> list of addresses (or the gaierror).
+    :ivar int hits: Lookups answered from the cache.
+    :ivar int misses: Lookups that needed a DNS query.
+    :ivar int coalesced: Lookups that waited for a concurrent query.
+    """
+
+    def __init__(self) -> None:
+        self.cache = cache.TTLCache(maxsize=const.DNS_CACHE_SIZE, ttl=const.DNS_DEFAULT_TTL)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="dns-prefetch")
+        self._prefetching = 0
+
+    @staticmethod
+    def _query(host: str) -> tuple[list[str], int]:
+        """
+        Query the A and AAAA records of a host. Uses dnspython to get
+        the TTLs, and falls back to the system resolver (which also
+        knows the hosts file) for names in the hosts file and if DNS
+        finds nothing.
+
+        :param host: The host name to resolve.
+        :type host: str
+        :return: The addresses (IPv4 first) and their TTL in seconds.
+        :rtype: tuple[list[str], int]
+        :raises: socket.gaierror if the host can not be resolved.
+        """
+
+        if host not in hosts_file():
+            addresses = []
+            ttls = []
+            for rdtype in ("A", "AAAA"):
+                try:
+                    answer = dns.resolver.resolve(host, rdtype, lifetime=const.DNS_TIMEOUT)
+                    addresses.extend(rdata.to_text() for rdata in answer)
+                    ttls.append(answer.rrset.ttl)
+                except dns.exception.DNSException:
+                    continue
+
+            if addresses:
+                ttl = min(max(min(ttls), const.DNS_MIN_TTL), const.DNS_MAX_TTL)
+                return addresses, ttl
+
+        infos = _SYSTEM_GETADDRINFO(host, None, 0, socket.SOCK_STREAM)
+        addresses = []
+        for *_, sockaddr in sorted(infos, key=lambda i: i[0] != socket.AF_INET):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+
+        return addresses, const.DNS_DEFAULT_TTL
+
+    def resolve(self, host: str) -> list[str]:
+        """
+        Resolve a host name, using the cache if possible.
+
+        :param host: The host name to resolve.
+        :type host: str
+        :return: The IP addresses of the host (IPv4 first).
+        :rtype: list[str]
+        :raises: socket.gaierror if the host can not be resolved.
+        """
+
+        host = host.rstrip(".").lower()
+
+        waited = False
+        while True:
+            cached = self.cache.get(host)
+            if cached is not None:
+                if not waited:
+                    with self._lock:
+                        self.hits += 1
+                if isinstance(cached, socket.gaierror):
+                    raise cached
+                return cached
+
+            with self._lock:
+                event = self._inflight.get(host)
+                leader = event is None
+                if leader:
+                    event = self._inflight[host] = threading.Event()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            # Another thread is already querying this host: wait for it
+            # and read its result from the cache.
+            if not leader:
+                with trace.span("dns.wait", host=host):
+                    event.wait(timeout=const.DNS_TIMEOUT * 2)
+                waited = True
+                continue
+
+            try:
+                with trace.span("dns.query", host=host):
+                    addresses, ttl = self._query(host)
+                self.cache.set(host, addresses, ttl=ttl)
+                return addresses
+
+            except socket.gaierror as e:
+                self.cache.set(host, e, ttl=const.DNS_NEGATIVE_TTL)
+                raise
+
+            finally:
+                with self._lock:
+                    del self._inflight[host]
+                event.set()
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """
+        Drop-in replacement for socket.getaddrinfo that resolves the
+        host through the cache and lets the system build the address
+        tuples from the numeric addresses (no network round-trip).
+
+        :return: A list of (family, type, proto, canonname, sockaddr).
+        :rtype: list[tuple]
+        """
+
+        if isinstance(host, bytes):
+            host = host.decode("idna")
+
+        # Nothing to resolve or resolved locally anyway.
+        if (
+            not host
+            or flags & socket.AI_NUMERICHOST
+            or host.lower() == "localhost"
+            or _is_ip(host)
+            or host.rstrip(".").lower() in hosts_file()
+        ):
+            return _SYSTEM_GETADDRINFO(host, port, family, type, proto, flags)
+
+        results = []
+        for address in self.resolve(host):
+            address_family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            if family not in (socket.AF_UNSPEC, address_family):
+                continue
+
+            results.extend(
+                _SYSTEM_GETADDRINFO(
+                    address,
+                    port,
+                    address_family,
+                    type,
+                    proto,
+                    flags | socket.AI_NUMERICHOST,
+                )
+            )
+
+        if not results:
+            raise socket.gaierror(socket.EAI_NONAME, f"No address for {host} in requested family")
+
+        return results
+
+    def prefetch(self, host: str) -> None:
+        """
+        Resolve a host in the background, so the address is cached when
+        the scan connects to it. If const.DNS_PREFETCH_QUEUE prefetches
+        are already waiting, the prefetch is dropped: the scan resolves
+        the host itself then.
+
+        :param host: The host name to resolve.
+        :type host: str
+        :return: None
+        """
+
+        if not host or _is_ip(host) or host.rstrip(".").lower() in self.cache:
+            return
+
+        with self._lock:
+            if self._prefetching >= const.DNS_PREFETCH_QUEUE:
+                self.dropped += 1
+                return
+            self._prefetching += 1
+
+        def _run():
+            try:
+                self.resolve(host)
+            except (OSError, UnicodeError) as e:
+                LOGGER.debug(f"DNS prefetch for '{host}' failed: {str(e)}.")
+            finally:
+                with self._lock:
+                    self._prefetching -= 1
+
+        self._executor.submit(_run)
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the resolver.
+
+        :return: A dict with hits, misses, coalesced, dropped
+            (prefetches), size and hit_ratio.
+        :rtype: dict
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "size": len(self.cache),
+                "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
+
+
+# Names of the hosts file and its modification time, see hosts_file.
+_HOSTS = (None, frozenset())
+
+
+def hosts_file() -> frozenset:
+    """
+    Return the host names listed in const.DNS_HOSTS_FILE. The file is
+    read again when it changes.
+
+    :return: The lower case host names.
+    :rtype: frozenset
+    """
+
+    global _HOSTS
+
+    try:
+        mtime = os.stat(const.DNS_HOSTS_FILE).st_mtime
+    except OSError:
+        return frozenset()
+
+    if _HOSTS[0] != mtime:
+        names = set()
+        try:
+            with open(const.DNS_HOSTS_FILE) as f:
+                for line in f:
+                    names.update(name.lower() for name in line.split("#", 1)[0].split()[1:])
+        except OSError as e:
+            LOGGER.warning(f"Could not read '{const.DNS_HOSTS_FILE}': {str(e)}.")
+        _HOSTS = (mtime, frozenset(names))
+
+    return _HOSTS[1]
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+# The process-wide resolver.
+RESOLVER = CachingResolver()
+
+
+def install() -> None:
+    """
+    Route all name resolution of this process through the caching
+    resolver by replacing socket.getaddrinfo. Safe to call twice.
+
+    :return: None
+    """
+
+    if socket.getaddrinfo is not RESOLVER.getaddrinfo:
+        socket.getaddrinfo = RESOLVER.getaddrinfo
+        LOGGER.debug("Installed caching DNS resolver.")
+
+
+def uninstall() -> None:
+    """
+    Restore the system socket.getaddrinfo.
+
+    :return: None
+    """
+
+    socket.getaddrinfo = _SYSTEM_GETADDRINFO
+
+
+def prefetch(host: str) -> None:
+    """
+    Resolve a host in the background with the process-wide resolver.
+
+    :param host: The host name to resolve.
+    :type host: str
+    :return: None
+    """
+
+    RESOLVER.prefetch(host)
+
+
+def stats() -> dict:
+    """
+    Return the counters of the process-wide resolver.
+
+    :return: A dict with hits, misses, coalesced, size and hit_ratio.
+    :rtype: dict
+    """
+
+    return RESOLVER.stats()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+singleflight.py: Coalesce concurrent calls for the same key.
+
+When many clients ask for the same domain at once, only the first
+caller (the leader) runs the work. All others wait for it and share
+its result or its exception. Once the call is finished the key is free
+again, so later callers run the work anew (caching is up to the
+caller).
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-17"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import threading
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+class _Call:
+    """
+    A call in flight, shared by its leader and all waiting callers.
+    """
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Registry of calls in flight, keyed by an arbitrary hashable key.
+
+    :ivar int calls: Calls that actually ran the work.
+    :ivar int shared: Calls that waited for and shared another result.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.shared = 0
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs) -> tuple:
+        """
+        Run fn(*args, **kwargs) unless a call for key is already in
+        flight, in which case wait for that call and return its result.
+
+        :param key: The key identifying the work (e.g. the domain).
+        :param fn: The function doing the work.
+        :return: The result and True if it was shared with another call.
+        :rtype: tuple
+        :raises: Whatever fn raised, in the leader and all waiters.
+        """
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+
+        except BaseException as e:
+            call.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def inflight(self) -> int:
+        """
+        :return: Number of keys with a call in flight.
+        :rtype: int
+        """
+
+        with self._lock:
+            return len(self._inflight)
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the registry.
+
+        :return: A dict with calls, shared and inflight.
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "inflight": len(self._inflight)}
+
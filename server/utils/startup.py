@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+startup.py: Import time budget of the server.
+
+Cold starts (e.g. serverless deploys) pay for every module imported by
+the entry point. This script imports a module in a fresh interpreter
+with "python -X importtime", sums up the time and lists the slowest
+imports. It fails (exit code 1) if the total exceeds the budget, so a
+heavy import slipping back into the startup path is noticed:
+
+    python -m server.utils.startup [module] [budget in ms]
+
+Default: const.STARTUP_MODULE and const.STARTUP_BUDGET_MS.
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-23"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import logging
+import os
+import subprocess
+import sys
+
+from server import const
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+
+def measure(module: str) -> tuple[float, list[tuple[float, float, str]]]:
+    """
+    Import a module in a fresh interpreter and measure the imports.
+
+    :param module: The module to import (e.g. "server.server").
+    :type module: str
+    :return: The total import time in ms, and (self ms, cumulative ms,
+        name) of every imported module. Names of nested imports are
+        indented, as printed by -X importtime.
+    :rtype: tuple[float, list[tuple[float, float, str]]]
+    :raises: RuntimeError if the module can not be imported.
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(const.APP_PATH),
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing '{module}' failed:\n{result.stderr[-2000:]}")
+
+    # Lines: "import time: self [us] | cumulative | imported package".
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        own, cumulative, name = line[len("import time:") :].split("|", 2)
+        imports.append((int(own) / 1000, int(cumulative) / 1000, name.rstrip()))
+
+    total = sum(own for own, _, _ in imports)
+    return total, imports
+
+
+if __name__ == "__main__":
+    module = sys.argv[1] if len(sys.argv) > 1 else const.STARTUP_MODULE
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else const.STARTUP_BUDGET_MS
+
+    total, imports = measure(module)
+
+    print(f"Slowest imports of '{module}' (cumulative):")
+    for own, cumulative, name in sorted(imports, reverse=True, key=lambda item: item[1])[1:16]:
+        print(f"  {cumulative:8.1f} ms  {name.strip()}")
+
+    print(f"Total: {total:.0f} ms (budget {budget:.0f} ms).")
+    if total > budget:
+        print("Import time budget exceeded!")
+        sys.exit(1)
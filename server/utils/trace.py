@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""
+trace.py: Lightweight tracing of requests and scans.
+
+A trace is a tree of spans, each measuring one step (DNS lookup, TLS
+handshake, Cloudflare bypass, a review site, WHOIS, model inference).
+The outermost span starts the trace; spans opened while it is active
+(in the same thread or context) become its children. Outside of a trace,
+span() does nothing but read a context variable, so instrumented code
+costs next to nothing when it is not traced.
+
+Finished traces are kept in a ring buffer of const.TRACE_BUFFER_SIZE
+traces, served by /debug/traces as JSON or in the Chrome trace event
+format (open it in chrome://tracing or https://ui.perfetto.dev).
+"""
+
+# Header.
+__author__ = "Lennart Haack"
+__email__ = "lennart-haack@mail.de"
+__license__ = "GNU GPLv3"
+__version__ = "0.0.1"
+__date__ = "2024-02-23"
+__status__ = "Prototype/Development/Production"
+
+# Imports.
+import contextvars
+import functools
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from server import const
+
+# Child logger.
+LOGGER = logging.getLogger(__name__)
+
+# The innermost open span of the current context, or None.
+_CURRENT = contextvars.ContextVar("trace_span", default=None)
+
+# Finished traces, newest last. Appended by the request threads, so
+# readers take a snapshot under the lock (see recent).
+TRACES = deque(maxlen=const.TRACE_BUFFER_SIZE)
+_TRACES_LOCK = threading.Lock()
+
+_IDS = itertools.count(1)
+
+
+class Span:
+    """
+    One measured step of a trace.
+
+    :ivar int id: Position of the span in its trace.
+    :ivar str name: The name of the step (e.g. "review.trustpilot").
+    :ivar dict attrs: Attributes (e.g. the domain).
+    :ivar Span parent: The enclosing span, None for the root.
+    :ivar Trace trace: The trace the span belongs to.
+    :ivar float start: Start time (time.time()).
+    :ivar float duration: Duration in seconds, None while open.
+    :ivar int thread: Id of the thread the span ran in.
+    :ivar str error: The exception that ended the span, if any.
+    """
+
+    __slots__ = ("id", "name", "attrs", "parent", "trace", "start", "duration", "thread", "error")
+
+    def __init__(self, name: str, attrs: dict, parent, trace) -> None:
+        self.id = None
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.trace = trace
+        self.start = time.time()
+        self.duration = None
+        self.thread = threading.get_ident()
+        self.error = None
+
+    def to_dict(self) -> dict:
+        """
+        :return: The span as dict, for JSON.
+        :rtype: dict
+        """
+
+        return {
+            "id": self.id,
+            "name": self.name,
+            "parent": self.parent.id if self.parent is not None else None,
+            "start": self.start,
+            "duration": self.duration,
+            "thread": self.thread,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """
+    The spans of one request or scan.
+
+    :ivar int id: The id of the trace.
+    :ivar list spans: All spans, in the order they were opened.
+    """
+
+    def __init__(self) -> None:
+        self.id = next(_IDS)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        # Spans may be added from several threads (copied contexts).
+        with self._lock:
+            if len(self.spans) < const.TRACE_MAX_SPANS:
+                span.id = len(self.spans)
+                self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        """
+        :return: The trace as dict, with its root span's name, start,
+            duration and attributes, and all spans.
+        :rtype: dict
+        """
+
+        root = self.spans[0]
+        return {
+            "id": self.id,
+            "name": root.name,
+            "start": root.start,
+            "duration": root.duration,
+            "attrs": root.attrs,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def to_chrome(self) -> list[dict]:
+        """
+        :return: The spans as complete events ("ph": "X") of the Chrome
+            trace event format, times in microseconds.
+        :rtype: list[dict]
+        """
+
+        return [
+            {
+                "name": span.name,
+                "cat": span.name.split(".", 1)[0],
+                "ph": "X",
+                "ts": int(span.start * 1e6),
+                "dur": int((span.duration or 0) * 1e6),
+                "pid": os.getpid(),
+                "tid": span.thread,
+                "args": {
+                    "trace": self.id,
+                    **span.attrs,
+                    **({"error": span.error} if span.error else {}),
+                },
+            }
+            for span in self.spans
+        ]
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Measure a step as child of the current span. Outside of a trace,
+    nothing is recorded.
+
+    :param name: The name of the step.
+    :type name: str
+    :param attrs: Attributes of the step.
+    """
+
+    parent = _CURRENT.get()
+    if parent is None:
+        yield None
+        return
+
+    current = Span(name, attrs, parent, parent.trace)
+    parent.trace.add(current)
+    token = _CURRENT.set(current)
+    start = time.perf_counter()
+
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _CURRENT.reset(token)
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """
+    Start a trace, or a span if a trace is already active. Only
+    const.TRACE_SAMPLE of the traces are recorded. Finished traces are
+    added to TRACES.
+
+    :param name: The name of the request or scan.
+    :type name: str
+    :param attrs: Attributes (e.g. the route or the domain).
+    """
+
+    if _CURRENT.get() is not None:
+        with span(name, **attrs) as current:
+            yield current
+        return
+
+    if not const.TRACE_ENABLED or random.random() >= const.TRACE_SAMPLE:
+        yield None
+        return
+
+    root = Span(name, attrs, None, Trace())
+    root.trace.add(root)
+    token = _CURRENT.set(root)
+    start = time.perf_counter()
+
+    try:
+        yield root
+    except BaseException as e:
+        root.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        root.duration = time.perf_counter() - start
+        _CURRENT.reset(token)
+        with _TRACES_LOCK:
+            TRACES.append(root.trace)
+
+
+def traced(name: str = None, root: bool = False):
+    """
+    Decorator measuring each call of a function as a span. The first
+    argument is recorded as attribute 'domain'.
+
+    :param name: The span name. Default: module.function.
+    :type name: str
+    :param root: Start a trace if none is active.
+    :type root: bool
+    """
+
+    def decorator(func):
+        label = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+        opener = trace if root else span
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not root and _CURRENT.get() is None:
+                return func(*args, **kwargs)
+
+            attrs = {"domain": args[0]} if args and isinstance(args[0], str) else {}
+            with opener(label, **attrs):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def recent(limit: int = None, min_duration: float = 0.0) -> list:
+    """
+    Return the most recent finished traces.
+
+    :param limit: Maximum number of traces. Default: all.
+    :type limit: int
+    :param min_duration: Only traces lasting at least this many seconds.
+    :type min_duration: float
+    :return: The traces, newest first.
+    :rtype: list[Trace]
+    """
+
+    # Iterating the deque while another thread appends would raise.
+    with _TRACES_LOCK:
+        snapshot = list(TRACES)
+
+    traces = [t for t in reversed(snapshot) if (t.spans[0].duration or 0) >= min_duration]
+    return traces[:limit] if limit else traces
+
+
+def to_chrome(traces: list) -> dict:
+    """
+    Export traces in the Chrome trace event format.
+
+    :param traces: The traces (see recent).
+    :type traces: list[Trace]
+    :return: The JSON object with 'traceEvents'.
+    :rtype: dict
+    """
+
+    return {
+        "traceEvents": [event for t in traces for event in t.to_chrome()],
+        "displayTimeUnit": "ms",
+    }
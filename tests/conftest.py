@@ -0,0 +1,126 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import errors
+
+# The secrets are read from the environment when the server is
+# imported. The database URI points nowhere, so tests never touch a
+# real database.
+os.environ.setdefault("DB_URI", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100")
+os.environ.setdefault("API_SECRET_KEY", "test-secret-of-at-least-32-bytes!")
+os.environ.setdefault("API_ACCESS_KEY", "test-access")
+
+
+class FakeDatabase:
+    """In-memory stand-in for DatabaseManager, keyed by domain."""
+
+    def __init__(self):
+        self.entries = {}
+        self.leases = {}
+        self.markers = {}
+        self.reads = 0
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise errors.ServerSelectionTimeoutError("database down")
+
+    def get_by_domain(self, domain):
+        self._check()
+        self.reads += 1
+        entry = self.entries.get(domain)
+        return dict(entry) if entry else None
+
+    def upsert_entry(self, data):
+        self._check()
+        now = datetime.now()
+        data["updated_at"] = now
+        stored = self.entries.get(data["domain"])
+        if stored is None:
+            data["created_at"] = now
+            self.entries[data["domain"]] = dict(data)
+            return True
+        stored.update({key: value for key, value in data.items() if key != "created_at"})
+        return False
+
+    def get_recent(self, limit):
+        self._check()
+        entries = sorted(self.entries.values(), key=lambda entry: entry["updated_at"])
+        return [dict(entry) for entry in reversed(entries)][:limit]
+
+    def get_popular(self, limit):
+        self._check()
+        entries = [entry for entry in self.entries.values() if entry.get("hits", 0) > 0]
+        entries.sort(key=lambda entry: -entry["hits"])
+        return [dict(entry) for entry in entries][:limit]
+
+    def open_pool(self, size):
+        self._check()
+        return size
+
+    def add_hits(self, hits):
+        self._check()
+        for domain, count in hits.items():
+            if domain in self.entries:
+                self.entries[domain]["hits"] = self.entries[domain].get("hits", 0) + count
+        return len(hits)
+
+    def decay_hits(self, factor):
+        self._check()
+        for entry in self.entries.values():
+            if entry.get("hits"):
+                entry["hits"] *= factor
+
+    def get_expiring(self, before, min_hits, limit):
+        self._check()
+        entries = [
+            dict(entry)
+            for entry in self.entries.values()
+            if entry["updated_at"] < before and entry.get("hits", 0) >= min_hits
+        ]
+        return sorted(entries, key=lambda entry: -entry["hits"])[:limit]
+
+    def acquire_lease(self, key, owner, ttl, collection):
+        self._check()
+        return self.leases.setdefault(key, owner) == owner
+
+    def release_lease(self, key, owner, collection):
+        self._check()
+        if self.leases.get(key) == owner:
+            del self.leases[key]
+
+    def set_marker(self, key, ttl, collection):
+        self._check()
+        self.markers[key] = datetime.now() + timedelta(seconds=ttl)
+
+    def has_marker(self, key, collection):
+        self._check()
+        return self.markers.get(key, datetime.min) >= datetime.now()
+
+
+@pytest.fixture
+def store():
+    """A ScoreStore in front of a FakeDatabase."""
+
+    from server.controller.store import ScoreStore
+
+    store = ScoreStore()
+    store._db = FakeDatabase()
+    yield store
+    store._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def api_client(monkeypatch):
+    """A test client of the API, warmed up and with fresh rate limits."""
+
+    from server.api import api
+    from server.utils import ratelimit
+
+    ready = threading.Event()
+    ready.set()
+    monkeypatch.setattr(api, "READY", ready)
+    monkeypatch.setattr(api, "LIMITER", ratelimit.create(api.LIMITER.rate))
+    return api.app.test_client()
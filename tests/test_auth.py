@@ -0,0 +1,82 @@
+import base64
+import hashlib
+import logging
+import time
+import timeit
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+from server.api import api
+from server.secrets import secrets
+
+PASSWORD = hashlib.sha256(secrets.API_ACCESS_KEY.encode()).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def tokens():
+    api.TOKEN_CACHE.clear()
+    yield api.TOKEN_CACHE
+    api.TOKEN_CACHE.clear()
+
+
+def basic(user, password):
+    return {"Authorization": "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()}
+
+
+def test_login_needs_the_access_key_digest(api_client):
+    assert api_client.post("/auth/login", headers=basic("uuid-1", "wrong")).status_code == 401
+
+    response = api_client.post("/auth/login", headers=basic("uuid-1", PASSWORD))
+
+    assert response.status_code == 200
+    assert api.auth_verify(response.get_json()["token"]) == "uuid-1"
+
+
+def test_verified_tokens_are_cached_until_they_expire(tokens):
+    token = api.generate_token("uuid-1")
+
+    assert api.auth_verify(token) == "uuid-1"
+    assert api.auth_verify(token) == "uuid-1"
+
+    assert tokens.stats()["hits"] == 1
+    expires = tokens._data[hashlib.sha256(token.encode()).digest()][0]
+    assert expires - time.monotonic() == pytest.approx(3600, abs=5)
+
+
+def test_invalid_tokens_are_logged_not_printed(capsys, caplog):
+    expired = jwt.encode(
+        {"uuid": "uuid-1", "exp": datetime.utcnow() - timedelta(minutes=1)},
+        secrets.API_SECRET_KEY,
+        algorithm="HS256",
+    )
+    forged = jwt.encode(
+        {"uuid": "uuid-1", "exp": 4102444800}, "guessed-secret-" * 3, algorithm="HS256"
+    )
+
+    with caplog.at_level(logging.WARNING, logger=api.LOGGER.name):
+        assert api.auth_verify(expired) is None
+        assert api.auth_verify(forged) is None
+        assert api.auth_verify("") is None
+
+    assert capsys.readouterr().out == ""
+    assert len(caplog.records) == 2
+    assert all(record.levelno == logging.WARNING for record in caplog.records)
+    assert len(api.TOKEN_CACHE) == 0
+
+
+def test_cached_tokens_are_cheaper_than_decoding():
+    # Microbenchmark of the auth overhead per request.
+    token = api.generate_token("benchmark")
+    n = 2000
+
+    def uncached():
+        api.TOKEN_CACHE.clear()
+        api.auth_verify(token)
+
+    decoded = timeit.timeit(uncached, number=n)
+    api.auth_verify(token)
+    cached = timeit.timeit(lambda: api.auth_verify(token), number=n)
+
+    assert cached < decoded
@@ -0,0 +1,101 @@
+import pytest
+
+from server import const
+from server.api import api
+from server.controller import controller
+from server.utils import ratelimit
+
+
+@pytest.fixture
+def unknown_domains(monkeypatch):
+    """Domains without entries, recording scans and background scans."""
+
+    scans = []
+    refreshes = []
+
+    def scan(domain, progress=None, host=None):
+        scans.append(host)
+        return {"domain": domain, "score": 9}
+
+    monkeypatch.setattr(controller, "lookup", lambda domain: None)
+    monkeypatch.setattr(controller.resolver, "prefetch", lambda host: None)
+    monkeypatch.setattr(controller, "scan", scan)
+    monkeypatch.setattr(
+        controller.STORE, "refresh", lambda domain, compute: refreshes.append(domain)
+    )
+    monkeypatch.setattr(controller.fast, "predict", lambda domain: 0.95)
+    monkeypatch.setattr(const, "JOB_QUEUE", False)
+    monkeypatch.setattr(const, "FAST_PATH", False)
+    return scans, refreshes
+
+
+def test_each_domain_is_scanned_once(unknown_domains):
+    scans, _ = unknown_domains
+
+    results = list(controller.analyze_batch(["a.test", "https://www.b.test/", "www.a.test"]))
+
+    assert sorted(scans) == ["a.test", "www.b.test"]
+    assert len(results) == 3 and all(data["score"] == 9 for _, data in results)
+
+
+def test_the_fast_path_answers_without_waiting(monkeypatch, unknown_domains):
+    scans, refreshes = unknown_domains
+    monkeypatch.setattr(const, "FAST_PATH", True)
+
+    results = dict(controller.analyze_batch(["a.test", "b.test", "www.a.test"]))
+
+    assert scans == []
+    assert refreshes == ["a.test", "b.test"]
+    assert all(data["provisional"] for data in results.values())
+    assert results["www.a.test"] is results["a.test"]
+
+
+def test_the_job_queue_gets_each_domain_once(monkeypatch, unknown_domains):
+    scans, _ = unknown_domains
+    submitted = []
+    monkeypatch.setattr(const, "JOB_QUEUE", True)
+    monkeypatch.setattr(
+        controller.JOBS, "submit", lambda domain: submitted.append(domain) or domain
+    )
+
+    results = dict(controller.analyze_batch(["a.test", "b.test", "www.a.test"]))
+
+    assert scans == [] and submitted == ["a.test", "b.test"]
+    assert results["www.a.test"]["job"] == "a.test"
+
+
+@pytest.mark.parametrize("store", [
+    lambda tmp_path: None,
+    lambda tmp_path: ratelimit.SQLiteBuckets(str(tmp_path / "buckets.sqlite3")),
+])
+def test_a_request_can_cost_several_tokens(tmp_path, store):
+    limiter = ratelimit.ClientLimiter(rate=0.001, burst=5, store=store(tmp_path))
+
+    allowed, headers = limiter.check("client", 3)
+    assert allowed and headers["RateLimit-Remaining"] == "2"
+
+    # All or nothing: three more do not fit, two do.
+    allowed, headers = limiter.check("client", 3)
+    assert not allowed and headers["RateLimit-Remaining"] == "2"
+    assert limiter.check("client", 2)[0]
+
+
+def test_a_batch_costs_one_request_per_domain(api_client, unknown_domains):
+    burst = int(api.LIMITER.burst)
+
+    response = api_client.post(
+        "/analyze/batch", json={"domains": ["a.test", "b.test", "c.test", "www.a.test"]}
+    )
+
+    assert response.status_code == 200
+    assert len(response.get_json()["results"]) == 4
+    assert response.headers["RateLimit-Remaining"] == str(burst - 3)
+
+
+def test_batches_larger_than_the_burst_are_rejected(api_client, unknown_domains):
+    domains = [f"{i}.test" for i in range(const.RATE_LIMIT_BURST + 1)]
+
+    response = api_client.post("/analyze/batch", json={"domains": domains})
+
+    assert response.status_code == 400
+    assert not unknown_domains[0]
@@ -0,0 +1,127 @@
+import math
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from server.controller.budget import ScanBudget
+from server.data import exceptions
+from server.scan import review
+from server.utils import limiter
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def limit(monkeypatch):
+    limit = limiter.HostLimit("budget.test", concurrency=1, rate=1000, burst=1000)
+    monkeypatch.setitem(limiter.LIMITS, "budget.test", limit)
+    return limit
+
+
+def test_limits_are_enforced_and_skips_recorded():
+    budget = ScanBudget(max_seconds=60, max_requests=2, max_bytes=100, max_paid=1)
+
+    assert budget.allows("trustpilot")
+    assert budget.allows("virustotal", paid=True)
+    budget.charge(paid=True)
+    assert not budget.allows("virustotal", paid=True)
+
+    budget.charge(nbytes=150)
+    assert budget.exhausted() == "requests"
+    assert not budget.allows("scamadviser")
+    with pytest.raises(exceptions.BudgetExceededError):
+        budget.check()
+
+    summary = budget.summary()
+    assert summary["requests"] == 2 and summary["bytes"] == 150 and summary["paid"] == 1
+    assert summary["skipped"] == ["virustotal", "scamadviser"]
+
+
+def test_timeouts_are_clamped_to_the_remaining_time():
+    budget = ScanBudget(max_seconds=2)
+
+    assert budget.timeout(10) <= 2
+    assert budget.timeout(1) == 1
+    assert ScanBudget.unlimited().timeout(10) == 10
+    assert ScanBudget.unlimited().remaining() == math.inf
+
+
+def test_waiting_for_a_slot_stops_at_the_end_of_the_budget(limit):
+    limit.acquire()
+    budget = ScanBudget(max_seconds=0.2)
+
+    start = time.monotonic()
+    with pytest.raises(exceptions.BudgetExceededError):
+        limiter.call(lambda url, **kwargs: Response(200), "https://budget.test/", budget=budget)
+
+    assert time.monotonic() - start < 1
+    assert limit.stats()["queued"] == 0
+
+
+def test_pause_longer_than_the_budget_is_not_waited_for(limit):
+    calls = []
+
+    def send(url, **kwargs):
+        calls.append(url)
+        return Response(429, {"Retry-After": "30"})
+
+    start = time.monotonic()
+    response = limiter.call(send, "https://budget.test/", budget=ScanBudget(max_seconds=5))
+
+    assert response.status_code == 429
+    assert len(calls) == 1
+    assert time.monotonic() - start < 1
+
+    # The pause of the host holds for the next scan, which runs out of
+    # time instead of sleeping through it.
+    with pytest.raises(exceptions.BudgetExceededError):
+        limiter.call(send, "https://budget.test/", budget=ScanBudget(max_seconds=5))
+
+
+def test_request_timeout_is_computed_after_the_slot_is_taken(limit):
+    limit.acquire()
+    threading.Timer(0.5, limit.release).start()
+    timeouts = []
+
+    def send(url, timeout):
+        timeouts.append(timeout)
+        return Response(200)
+
+    limiter.call(send, "https://budget.test/", budget=ScanBudget(max_seconds=2), timeout=10)
+
+    assert timeouts[0] <= 1.55
+
+
+def test_review_sources_out_of_budget_are_recorded_as_skipped(monkeypatch):
+    def exhausted(*args, **kwargs):
+        raise exceptions.BudgetExceededError("time")
+
+    # Mid-source: the slot of the host or the second request.
+    monkeypatch.setattr(review.limiter, "call", exhausted)
+    # Review pages: the WebScraper ends with the error instead of raising.
+    monkeypatch.setattr(
+        review.scrape,
+        "get",
+        lambda domain, budget: SimpleNamespace(error=exceptions.BudgetExceededError("time")),
+    )
+    budget = ScanBudget()
+
+    assert review.urlvoid("skipped.test", budget=budget) == {}
+    assert review.trustpilot("skipped.test", budget=budget) == {}
+    assert review.trustedshops("skipped.test", budget=budget) == {}
+    assert review.getsafeonline("skipped.test", budget=budget) == {}
+    assert review.scamadviser("skipped.test", budget=budget) == {}
+
+    assert budget.skipped == [
+        "urlvoid",
+        "trustpilot",
+        "trustedshops",
+        "getsafeonline",
+        "scamadviser",
+    ]
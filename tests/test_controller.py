@@ -0,0 +1,132 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import const
+from server.controller import controller
+from server.secrets import secrets
+from server.utils import singleflight
+
+
+@pytest.fixture
+def scans(monkeypatch, store):
+    """Route controller scans to a fake scorer and a fake store."""
+
+    calls = []
+
+    def calculate_score(domain, progress=None, host=None):
+        calls.append(domain)
+        time.sleep(0.2)
+        return {"domain": domain, "score": 9}
+
+    monkeypatch.setattr(controller, "STORE", store)
+    monkeypatch.setattr(controller, "SCANS", singleflight.SingleFlight())
+    monkeypatch.setattr(controller, "calculate_score", calculate_score)
+    return calls
+
+
+def test_concurrent_requests_share_one_scan(scans):
+    n = 50
+    start = threading.Barrier(n)
+    results = []
+
+    def request():
+        start.wait()
+        results.append(controller.scan("shop.test"))
+
+    threads = [threading.Thread(target=request) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert scans == ["shop.test"]
+    assert len(results) == n and all(entry["score"] == 9 for entry in results)
+    assert controller.SCANS.stats() == {"calls": 1, "shared": n - 1, "inflight": 0}
+    assert controller.STORE.db.entries["shop.test"]["score"] == 9
+
+
+def stale_in_memory_fresh_in_database(store):
+    old = datetime.now() - timedelta(days=secrets.DB_RETENTION + 1)
+    store.memory.set("shop.test", {"domain": "shop.test", "score": 1, "updated_at": old})
+    store.db.entries["shop.test"] = {
+        "domain": "shop.test",
+        "score": 9,
+        "updated_at": datetime.now(),
+    }
+
+
+def test_lease_holder_skips_the_scan_if_another_worker_stored_it(monkeypatch, scans):
+    monkeypatch.setattr(const, "SCAN_LEASE", True)
+    stale_in_memory_fresh_in_database(controller.STORE)
+
+    entry = controller.scan("shop.test")
+
+    assert scans == []
+    assert entry["score"] == 9
+    assert controller.STORE.db.leases == {}
+
+
+def test_lease_follower_reads_past_the_stale_memory_entry(monkeypatch, scans):
+    monkeypatch.setattr(const, "SCAN_LEASE", True)
+    monkeypatch.setattr(const, "SCAN_LEASE_POLL", 0.01)
+    stale_in_memory_fresh_in_database(controller.STORE)
+    controller.STORE.db.leases["shop.test"] = "other-worker"
+
+    entry = controller.scan("shop.test")
+
+    assert scans == []
+    assert entry["score"] == 9
+    assert controller.STORE.db.leases == {"shop.test": "other-worker"}
+
+
+def test_analyze_scans_the_host_the_user_gave(monkeypatch, store):
+    scanned = []
+
+    def calculate_score(domain, progress=None, host=None):
+        scanned.append((domain, host))
+        return {"domain": domain, "score": 9}
+
+    monkeypatch.setattr(controller, "STORE", store)
+    monkeypatch.setattr(controller, "calculate_score", calculate_score)
+    monkeypatch.setattr(controller, "lookup", lambda domain: None)
+    monkeypatch.setattr(controller.resolver, "prefetch", lambda host: None)
+    monkeypatch.setattr(const, "JOB_QUEUE", False)
+    monkeypatch.setattr(const, "FAST_PATH", False)
+
+    data = controller.analyze("https://www.shop.test/")
+
+    assert scanned == [("shop.test", "www.shop.test")]
+    assert data["domain"] == "shop.test"
+    assert "shop.test" in store.db.entries
+
+
+def test_failed_scan_is_not_repeated_by_the_waiting_workers(monkeypatch, scans):
+    monkeypatch.setattr(const, "SCAN_LEASE", True)
+    monkeypatch.setattr(controller, "calculate_score", lambda *args: scans.append(1))
+
+    assert controller.scan("dead.test") is None
+    assert scans == [1] and "failed:dead.test" in controller.STORE.db.markers
+
+    # Another worker process waiting for the lease gives up as well.
+    monkeypatch.setattr(const, "SCAN_LEASE_POLL", 0.01)
+    controller.STORE.db.leases["dead.test"] = "other-worker"
+    assert controller.scan("dead.test") is None
+    # The next lease holder does not scan either.
+    del controller.STORE.db.leases["dead.test"]
+    assert controller.scan("dead.test") is None
+    assert scans == [1]
+
+
+def test_lease_followers_wait_until_their_deadline(monkeypatch, scans):
+    monkeypatch.setattr(const, "SCAN_LEASE", True)
+    monkeypatch.setattr(const, "SCAN_LEASE_POLL", 0.01)
+    monkeypatch.setattr(const, "SCAN_LEASE_TTL", 0.1)
+    controller.STORE.db.leases["slow.test"] = "other-worker"
+
+    start = time.monotonic()
+    assert controller.scan("slow.test") is None
+    assert time.monotonic() - start < 1
+    assert scans == []
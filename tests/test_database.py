@@ -0,0 +1,41 @@
+import os
+from types import SimpleNamespace
+
+from server.database.database import DatabaseManager
+
+
+class FakeCollection:
+    def __init__(self, upserted_id):
+        self.upserted_id = upserted_id
+        self.calls = []
+
+    def update_one(self, query, update, upsert=False):
+        self.calls.append((query, update, upsert))
+        return SimpleNamespace(upserted_id=self.upserted_id)
+
+
+def manager(collection):
+    db = DatabaseManager("mongodb://127.0.0.1:1", "test", "scores")
+    db._client, db._db, db._collection, db._pid = None, None, collection, os.getpid()
+    return db
+
+
+def test_upsert_sets_created_at_only_on_insert():
+    collection = FakeCollection(upserted_id="new")
+    data = {"_id": "old", "domain": "shop.test", "score": 3, "created_at": "stale"}
+
+    assert manager(collection).upsert_entry(data)
+
+    [(query, update, upsert)] = collection.calls
+    assert query == {"domain": "shop.test"} and upsert
+    assert set(update["$set"]) == {"domain", "score", "updated_at"}
+    assert update["$setOnInsert"] == {"created_at": update["$set"]["updated_at"]}
+    assert data["created_at"] == data["updated_at"]
+
+
+def test_upsert_of_an_existing_entry_keeps_its_created_at():
+    data = {"domain": "shop.test", "score": 5}
+
+    assert not manager(FakeCollection(upserted_id=None)).upsert_entry(data)
+
+    assert "created_at" not in data and data["updated_at"]
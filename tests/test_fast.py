@@ -0,0 +1,84 @@
+import pytest
+
+from server import const
+from server.controller import controller
+from server.model import fast
+
+
+def test_fast_path_is_off_by_default():
+    assert const.FAST_PATH is False
+
+
+@pytest.mark.parametrize("probability, confidence", [(0.5, 0.0), (0.9, 0.8), (0.1, 0.8), (1, 1)])
+def test_confidence_grows_away_from_one_half(probability, confidence):
+    assert fast.confidence(probability) == pytest.approx(confidence)
+
+
+def test_predictions_are_probabilities():
+    for domain in ("shop.de", "paypal-login-secure.verify-account.tk", "1.2.3.4"):
+        assert 0 <= fast.predict(domain) <= 1
+
+
+@pytest.mark.parametrize("probability, score", [(0.95, 14), (0.1, 2)])
+def test_confident_predictions_give_a_provisional_score(monkeypatch, probability, score):
+    monkeypatch.setattr(fast, "predict", lambda domain: probability)
+
+    data = controller.provisional("shop.test")
+
+    assert data["score"] == score and data["score_readable"] != "Unknown"
+    assert data["provisional"] is True
+
+
+def test_unsure_predictions_leave_the_score_unknown(monkeypatch):
+    monkeypatch.setattr(fast, "predict", lambda domain: 0.55)
+
+    data = controller.provisional("shop.test")
+
+    assert data["score"] is None and data["score_readable"] == "Unknown"
+    assert data["provisional"] is True and data["confidence"] == 0.1
+
+
+def test_evaluation_reports_the_coverage_of_confident_predictions():
+    rows = fast.read_known()[:200]
+    model = fast.load()
+
+    everything = fast.evaluate(model, rows)
+    confident = fast.evaluate(model, rows, min_confidence=0.3)
+
+    assert everything["coverage"] == 1.0
+    assert 0 < confident["coverage"] < 1
+
+
+@pytest.fixture
+def unknown_domain(monkeypatch):
+    scans = []
+    refreshes = []
+
+    monkeypatch.setattr(controller, "lookup", lambda domain: None)
+    monkeypatch.setattr(controller.resolver, "prefetch", lambda host: None)
+    monkeypatch.setattr(controller, "scan", lambda domain, host=None: scans.append(domain))
+    monkeypatch.setattr(
+        controller.STORE, "refresh", lambda domain, compute: refreshes.append(domain)
+    )
+    monkeypatch.setattr(fast, "predict", lambda domain: 0.95)
+    monkeypatch.setattr(const, "JOB_QUEUE", False)
+    return scans, refreshes
+
+
+def test_without_fast_path_the_request_waits_for_the_scan(unknown_domain):
+    scans, refreshes = unknown_domain
+
+    data = controller.analyze("shop.test")
+
+    assert scans == ["shop.test"] and refreshes == []
+    assert data["score"] is None
+
+
+def test_with_fast_path_the_scan_runs_in_the_background(monkeypatch, unknown_domain):
+    scans, refreshes = unknown_domain
+    monkeypatch.setattr(const, "FAST_PATH", True)
+
+    data = controller.analyze("shop.test")
+
+    assert scans == [] and refreshes == ["shop.test"]
+    assert data["provisional"] is True and data["score"] == 14
@@ -0,0 +1,227 @@
+import time
+
+import pytest
+
+from server import const
+from server.controller import controller
+from server.controller.budget import ScanBudget
+from server.controller.features import FEATURE_CACHE, WebsiteFeatures
+
+
+@pytest.fixture
+def groups(monkeypatch):
+    """
+    Replace the feature groups by constants (1 per feature) and the
+    website fetch by a reachable website. Returns the computed group
+    names and a dict of groups that fail (all "NaN").
+    """
+
+    computed = []
+    failing = {}
+    fetches = []
+
+    def group(name, size):
+        def compute(self):
+            computed.append(name)
+            return ["NaN"] * size if name in failing else [1] * size
+        return compute
+
+    for name, size in WebsiteFeatures.feature_groups:
+        monkeypatch.setattr(WebsiteFeatures, f"_group_{name}", group(name, size))
+
+    def initialization(self):
+        fetches.append(self.domain)
+        self.alive = True
+
+    monkeypatch.setattr(WebsiteFeatures, "initialization", initialization)
+    FEATURE_CACHE.clear()
+    yield computed, failing, fetches
+    FEATURE_CACHE.clear()
+
+
+def extract(domain="shop.test", **kwargs):
+    obj = WebsiteFeatures(domain, refresh=kwargs.pop("refresh", False))
+    obj.feature_extraction(**kwargs)
+    return obj
+
+
+def test_fresh_groups_are_not_computed_again(groups):
+    computed, _, fetches = groups
+
+    first = extract()
+    second = extract()
+
+    assert len(computed) == len(WebsiteFeatures.feature_groups)
+    assert fetches == ["shop.test"]
+    assert second.alive and second.features == first.features
+    assert second.groups_cached == [name for name, _ in WebsiteFeatures.feature_groups]
+
+
+def test_groups_are_cached_per_domain(groups):
+    computed, _, _ = groups
+
+    extract("shop.test")
+    extract("other.test")
+
+    assert len(computed) == 2 * len(WebsiteFeatures.feature_groups)
+
+
+def test_failed_groups_are_retried(groups):
+    computed, failing, fetches = groups
+    failing["trustpilot"] = True
+
+    first = extract()
+    computed.clear()
+    second = extract()
+
+    assert first.groups_failed == ["trustpilot"]
+    assert computed == ["trustpilot"]
+    assert len(fetches) == 2
+    assert second.groups_cached == [
+        name for name, _ in WebsiteFeatures.feature_groups if name != "trustpilot"
+    ]
+
+
+def test_refresh_ignores_the_cache(groups):
+    computed, _, _ = groups
+
+    extract()
+    computed.clear()
+    extract(refresh=True)
+
+    assert len(computed) == len(WebsiteFeatures.feature_groups)
+
+
+def test_each_group_expires_after_its_own_ttl(groups):
+    extract()
+    now = time.monotonic()
+
+    for name, _ in WebsiteFeatures.feature_groups:
+        expires = FEATURE_CACHE._data[("shop.test", name)][0]
+        assert expires - now == pytest.approx(const.FEATURE_TTLS[name], abs=5)
+
+
+def test_progress_reports_each_group(groups):
+    _, failing, _ = groups
+    failing["whois"] = True
+    extract("shop.test")
+
+    reports = []
+    FEATURE_CACHE.delete(("shop.test", "pagerank"))
+    extract("shop.test", progress=lambda name, status: reports.append((name, status)))
+
+    statuses = dict(reports)
+    assert len(reports) == len(WebsiteFeatures.feature_groups)
+    assert statuses["pagerank"] == "done"
+    assert statuses["whois"] == "failed"
+    assert statuses["trustpilot"] == "cached"
+
+
+def test_merge_fills_missing_groups():
+    vector = WebsiteFeatures.merge({"domain_url": [True] * 10}, normalize=True)
+
+    assert len(vector) == len(WebsiteFeatures.features_names)
+    assert vector[:10] == [1] * 10
+    assert set(vector[10:]) == {"NaN"}
+
+
+def stage_names(stage):
+    return dict(WebsiteFeatures.feature_stages)[stage]
+
+
+def test_a_clear_verdict_stops_after_the_stage(groups):
+    computed, _, _ = groups
+    reports = {}
+    vectors = []
+
+    def judge(features, names):
+        vectors.append(features)
+        return 0.01
+
+    obj = extract(judge=judge, progress=lambda name, status: reports.update({name: status}))
+
+    assert computed == stage_names("cheap")
+    assert obj.stopped_after == "cheap"
+    assert len(vectors) == 1 and "NaN" in vectors[0]
+    assert [name for name, status in reports.items() if status == "skipped"] == [
+        name for name, _ in WebsiteFeatures.feature_groups if name not in stage_names("cheap")
+    ]
+    assert obj.alive and len(obj.features) == len(WebsiteFeatures.features_names)
+
+
+def test_an_unclear_verdict_runs_all_stages(groups):
+    computed, _, _ = groups
+    judged = []
+
+    obj = extract(judge=lambda features, names: judged.append(1) or 0.5)
+
+    assert len(computed) == len(WebsiteFeatures.feature_groups)
+    assert obj.stopped_after is None
+    assert len(judged) == len(WebsiteFeatures.feature_stages) - 1
+
+
+def test_the_thresholds_are_exclusive(monkeypatch, groups):
+    monkeypatch.setattr(const, "CASCADE_HIGH", 0.9)
+
+    assert extract("a.test", judge=lambda features, names: 0.9).stopped_after == "cheap"
+    assert extract("b.test", judge=lambda features, names: 0.89).stopped_after is None
+
+
+def test_the_cascade_is_off_by_default(monkeypatch):
+    judges = []
+
+    class Features:
+        alive = False
+
+        def __init__(self, domain):
+            pass
+
+        def feature_extraction(self, judge=None, progress=None):
+            judges.append(judge)
+
+    monkeypatch.setattr(controller, "WebsiteFeatures", Features)
+
+    assert const.CASCADE is False
+    assert controller.calculate_score("shop.test", host="shop.test") is None
+    assert judges == [None]
+
+
+def test_budget_skipped_groups_are_reported_as_skipped_and_not_cached(groups, monkeypatch):
+    def starved(self):
+        self.budget.skip("favicon", "time")
+        return [1, "NaN", 1]
+
+    monkeypatch.setattr(WebsiteFeatures, "_group_misc", starved)
+    reports = []
+
+    obj = extract(progress=lambda name, status: reports.append((name, status)))
+
+    assert dict(reports)["misc"] == "skipped"
+    assert obj.groups_skipped == ["misc"] and obj.groups_failed == []
+    assert FEATURE_CACHE.get(("shop.test", "misc")) is None
+
+
+def test_partly_filled_groups_are_not_cached(groups, monkeypatch):
+    monkeypatch.setattr(WebsiteFeatures, "_group_pagerank", lambda self: [3, None])
+
+    obj = extract()
+
+    assert obj.groups_failed == [] and obj.groups_skipped == []
+    assert FEATURE_CACHE.get(("shop.test", "pagerank")) is None
+    assert FEATURE_CACHE.get(("shop.test", "whois")) is not None
+
+
+def test_wrong_group_size_raises(groups, monkeypatch):
+    monkeypatch.setattr(WebsiteFeatures, "_group_pagerank", lambda self: [3])
+
+    with pytest.raises(ValueError):
+        extract()
+
+
+def test_https_skipped_by_the_budget_is_unknown_not_disabled():
+    obj = WebsiteFeatures("shop.test", budget=ScanBudget(max_seconds=0))
+
+    values = obj._group_https_ssl()
+
+    assert values[:2] == ["NaN", "NaN"]
+    assert obj.budget.skipped == ["https_ssl"]
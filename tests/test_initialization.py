@@ -0,0 +1,87 @@
+import ssl
+
+import httpx
+import pytest
+
+from server.controller.budget import ScanBudget
+from server.scan import initialization
+
+_CLIENT = httpx.Client
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    initialization.PROBE_CACHE.clear()
+    yield
+    initialization.PROBE_CACHE.clear()
+
+
+def serve(monkeypatch, handler):
+    """Route the httpx clients of the probe to handler, record the requests."""
+
+    calls = []
+
+    def client(verify=True):
+        def record(request):
+            calls.append((request.method, str(request.url), verify))
+            return handler(request, verify)
+
+        return _CLIENT(transport=httpx.MockTransport(record))
+
+    monkeypatch.setattr(initialization.httpx, "Client", client)
+    return calls
+
+
+def test_probe_sends_one_request_and_caches_it(monkeypatch):
+    calls = serve(monkeypatch, lambda request, verify: httpx.Response(200))
+
+    first = initialization.probe("https://shop.test/some/page")
+    second = initialization.probe("shop.test")
+
+    assert calls == [("HEAD", "https://shop.test", True)]
+    assert second is first
+    assert first.ok and first.protocol == "https://" and first.verify_ok
+
+
+def test_probe_retries_without_verification_on_tls_failure(monkeypatch):
+    def handler(request, verify):
+        if verify:
+            raise httpx.ConnectError("handshake failed") from ssl.SSLError("bad certificate")
+        return httpx.Response(200, headers={"Server": "cloudflare"})
+
+    calls = serve(monkeypatch, handler)
+    result = initialization.probe("shop.test")
+
+    assert [verify for _, _, verify in calls] == [True, False]
+    assert result.reachable and not result.verify_ok
+    assert result.cloudflare
+    assert initialization.cloudflare_protected("shop.test") is True
+
+
+def test_probe_falls_back_to_http(monkeypatch):
+    def handler(request, verify):
+        if request.url.scheme == "https":
+            raise httpx.ConnectError("refused")
+        return httpx.Response(403)
+
+    serve(monkeypatch, handler)
+    result = initialization.probe("shop.test")
+
+    assert result.protocol == "http://"
+    assert result.status_code == 403
+    assert not initialization.server_reachable("shop.test")
+
+
+def test_unreachable_result_is_cached_unless_the_budget_cut_the_timeout(monkeypatch):
+    def handler(request, verify):
+        raise httpx.ConnectError("refused")
+
+    calls = serve(monkeypatch, handler)
+
+    budget = ScanBudget(max_seconds=1)
+    assert not initialization.probe("down.test", budget=budget).reachable
+    assert "down.test" not in initialization.PROBE_CACHE
+
+    assert not initialization.probe("down.test").reachable
+    assert "down.test" in initialization.PROBE_CACHE
+    assert len(calls) == 4
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from server import const
+from server.controller import controller, jobs
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = jobs.JobQueue(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(jobs, "JOBS", queue)
+    monkeypatch.setattr(controller, "JOBS", queue)
+    return queue
+
+
+def age(queue, job_id, seconds):
+    with queue._connect() as conn:
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - seconds, job_id))
+
+
+def test_a_domain_is_queued_once(queue):
+    first = queue.submit("shop.test")
+
+    assert queue.submit("shop.test") == first
+    assert queue.submit("other.test") != first
+    assert queue.stats() == {"queued": 2, "running": 0, "done": 0, "failed": 0}
+
+
+def test_jobs_are_claimed_oldest_first(queue):
+    first = queue.submit("a.test")
+    queue.submit("b.test")
+
+    job = queue.claim("worker-1")
+
+    assert job == {"id": first, "domain": "a.test", "attempts": 0}
+    assert queue.get(first)["status"] == "running"
+    assert queue.claim("worker-2")["domain"] == "b.test"
+    assert queue.claim("worker-3") is None
+
+
+def test_finished_jobs_keep_their_result(queue):
+    done = queue.submit("a.test")
+    failed = queue.submit("b.test")
+
+    queue.complete(done, {"domain": "a.test", "score": 12})
+    queue.fail(failed, "NotReachableError: offline")
+
+    assert queue.get(done)["result"] == {"domain": "a.test", "score": 12}
+    assert queue.get(failed)["error"] == "NotReachableError: offline"
+    assert queue.get("missing") is None
+    # A finished domain can be queued again.
+    assert queue.submit("a.test") != done
+
+
+def test_stuck_jobs_are_retried_then_failed(queue, monkeypatch):
+    monkeypatch.setattr(const, "JOB_MAX_ATTEMPTS", 2)
+    job_id = queue.submit("shop.test")
+
+    queue.claim("crashed")
+    age(queue, job_id, const.JOB_TIMEOUT + 1)
+    assert queue.recover() == 1
+    assert queue.get(job_id)["status"] == "queued"
+
+    queue.claim("crashed-again")
+    age(queue, job_id, const.JOB_TIMEOUT + 1)
+    assert queue.recover() == 0
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_old_results_are_deleted(queue):
+    job_id = queue.submit("shop.test")
+    queue.complete(job_id, {})
+    age(queue, job_id, const.JOB_RESULT_TTL + 1)
+
+    queue.recover()
+
+    assert queue.get(job_id) is None
+
+
+def test_the_worker_scans_and_stores_the_result(queue, monkeypatch):
+    stop = threading.Event()
+
+    def scan(domain):
+        stop.set()
+        return {"domain": domain, "score": 15, "score_readable": "A+"}
+
+    monkeypatch.setattr(controller, "scan", scan)
+    job_id = queue.submit("shop.test")
+
+    jobs.worker(stop)
+
+    assert controller.job(job_id)["status"] == "done"
+    assert controller.job(job_id)["score"] == 15
+
+
+def test_failed_scans_fail_the_job(queue, monkeypatch):
+    stop = threading.Event()
+
+    def scan(domain):
+        stop.set()
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(controller, "scan", scan)
+    job_id = queue.submit("shop.test")
+
+    jobs.worker(stop)
+
+    assert controller.job(job_id) == {
+        **controller.unknown("shop.test"),
+        "job": job_id,
+        "status": "failed",
+    }
+
+
+def test_analyze_queues_unknown_domains(queue, monkeypatch):
+    monkeypatch.setattr(const, "JOB_QUEUE", True)
+    monkeypatch.setattr(controller, "lookup", lambda domain: None)
+
+    data = controller.analyze("https://www.shop.test/")
+
+    assert controller.job(data["job"]) == {
+        "domain": "shop.test",
+        "job": data["job"],
+        "status": "queued",
+    }
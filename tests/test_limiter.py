@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from server import const
+from server.api import api  # noqa: F401 (registers the metrics)
+from server.utils import limiter, metrics
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_subdomains_share_the_limit_of_their_parent():
+    assert limiter.get_limit("https://de.trustpilot.com/review/shop.de").host == "trustpilot.com"
+    assert limiter.get_limit("www.urlvoid.com/scan/shop.de/").host == "urlvoid.com"
+    assert limiter.get_limit("https://shop.de/") is None
+
+
+def test_slots_are_handed_out_in_fifo_order():
+    limit = limiter.HostLimit("fifo.test", concurrency=1, rate=1000, burst=1000)
+    limit.acquire()
+
+    order = []
+
+    def worker(i):
+        limit.acquire()
+        order.append(i)
+        limit.release()
+
+    threads = []
+    for i in range(5):
+        threads.append(threading.Thread(target=worker, args=(i,)))
+        threads[-1].start()
+        time.sleep(0.02)
+
+    assert limit.stats()["queued"] == 5
+    limit.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == [0, 1, 2, 3, 4]
+    stats = limit.stats()
+    assert stats["requests"] == 6 and stats["active"] == 0 and stats["queued"] == 0
+    assert stats["wait_max"] > 0 and stats["wait_avg"] == stats["wait_total"] / 6
+
+
+def test_acquire_times_out_and_leaves_the_queue():
+    limit = limiter.HostLimit("busy.test", concurrency=1, rate=1000, burst=1000)
+    limit.acquire()
+
+    with pytest.raises(TimeoutError):
+        limit.acquire(timeout=0.05)
+
+    assert limit.stats()["queued"] == 0
+
+
+def test_retry_after_is_parsed_and_clamped(monkeypatch):
+    monkeypatch.setattr(const, "HOST_LIMIT_MAX_BACKOFF", 60)
+
+    assert limiter.retry_after(Response(429, {"Retry-After": "2"})) == 2
+    assert limiter.retry_after(Response(429, {"Retry-After": "3600"})) == 60
+    assert limiter.retry_after(Response(429, {"Retry-After": "soon"})) == min(
+        const.HOST_LIMIT_BACKOFF, 60
+    )
+    date = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert limiter.retry_after(Response(429, {"Retry-After": date})) == 0
+
+
+def test_429_pauses_the_host_and_retries(monkeypatch):
+    limit = limiter.HostLimit("paused.test", concurrency=2, rate=1000, burst=1000)
+    monkeypatch.setitem(limiter.LIMITS, "paused.test", limit)
+
+    responses = [Response(429, {"Retry-After": "0.2"}), Response(200)]
+    start = time.monotonic()
+    response = limiter.call(lambda url: responses.pop(0), "https://paused.test/")
+
+    assert response.status_code == 200
+    assert time.monotonic() - start >= 0.2
+    assert limit.stats()["throttled"] == 1
+
+
+def test_wait_stats_are_exported_per_host(monkeypatch):
+    limit = limiter.HostLimit("metrics.test", concurrency=1, rate=1000, burst=1000)
+    monkeypatch.setitem(limiter.LIMITS, "metrics.test", limit)
+    limit.acquire()
+    limit.release()
+    limit.pause(0)
+
+    text = metrics.render()
+
+    assert 'host_requests_total{host="metrics.test"} 1' in text
+    assert 'host_throttled_total{host="metrics.test"} 1' in text
+    assert 'host_wait_seconds_total{host="metrics.test"}' in text
+    assert 'host_wait_seconds_max{host="metrics.test"}' in text
+    assert 'host_wait_seconds_avg{host="metrics.test"}' in text
@@ -0,0 +1,96 @@
+import json
+import logging
+import sys
+
+import pytest
+
+from server import const
+from server.utils import log
+
+
+def _record(level=logging.INFO, name="server", msg="hello %s", args=("world",), exc_info=None):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, exc_info)
+
+
+@pytest.fixture
+def root_logger():
+    # create_logger configures the root logger: restore it afterwards.
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    log.stop()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_log_count_counts_warnings_and_above():
+    counter = log.LogCount()
+    before = (counter.warnings, counter.errors, counter.criticals)
+
+    for level in (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.ERROR):
+        assert counter.filter(_record(level))
+    counter.filter(_record(logging.CRITICAL))
+
+    after = (counter.warnings, counter.errors, counter.criticals)
+    assert [a - b for a, b in zip(after, before)] == [1, 2, 1]
+
+
+def test_sampling_uses_the_longest_prefix():
+    sampling = log.SamplingFilter({"server": 0.5, "server.controller.scrape": 0.0})
+
+    assert sampling.rate("server.controller.scrape.trustpilot") == 0.0
+    assert sampling.rate("server.controller") == 0.5
+    assert sampling.rate("werkzeug") == 1.0
+
+
+def test_sampling_keeps_warnings_of_muted_loggers():
+    sampling = log.SamplingFilter({"server": 0.0})
+
+    assert not sampling.filter(_record(logging.INFO))
+    assert sampling.filter(_record(logging.WARNING))
+    assert sampling.filter(_record(logging.INFO, name="werkzeug"))
+
+
+def test_json_formatter_writes_one_object_with_the_exception():
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        record = _record(logging.ERROR, exc_info=sys.exc_info())
+
+    entry = json.loads(log.JsonFormatter().format(record))
+
+    assert entry["level"] == "ERROR"
+    assert entry["logger"] == "server"
+    assert entry["message"] == "hello world"
+    assert "ValueError: broken" in entry["exc"]
+
+
+def test_queue_handler_renders_the_message_and_keeps_the_exception_apart():
+    handler = log._QueueHandler(None)
+    handler.setFormatter(logging.Formatter())
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        record = _record(exc_info=sys.exc_info())
+
+    prepared = handler.prepare(record)
+
+    assert (prepared.msg, prepared.args, prepared.exc_info) == ("hello world", None, None)
+    assert "ValueError: broken" in prepared.exc_text
+    # The original record is not changed for the other handlers.
+    assert record.args == ("world",) and record.exc_info is not None
+
+
+def test_create_logger_writes_in_the_background(root_logger, tmp_path, monkeypatch):
+    monkeypatch.setattr(const, "LOG_FILE", str(tmp_path / "log" / "server.log"))
+    monkeypatch.setattr(const, "LOG_FORMAT", "json")
+    monkeypatch.setattr(const, "LOG_SAMPLING", {"chatty": 0.0})
+
+    log.create_logger(log.LogCount())
+    logging.getLogger("server.test").info("kept %d", 1)
+    logging.getLogger("chatty").info("dropped")
+    logging.getLogger("chatty").warning("kept %d", 2)
+    log.stop()
+
+    lines = (tmp_path / "log" / "server.log").read_text().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == ["kept 1", "kept 2"]
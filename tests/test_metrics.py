@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from server.api import api  # noqa: F401 (registers the metrics of the API)
+from server.utils import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Metrics of the tests stay out of the registry of the server.
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+
+
+def test_counters_render_with_help_type_and_labels(registry):
+    requests = metrics.Counter("requests", "Requests served.", ("route",))
+    requests.labels("/analyze").inc()
+    requests.labels("/analyze").inc(2)
+    requests.labels('/odd"route\n').inc()
+
+    assert metrics.render().splitlines() == [
+        "# HELP requests Requests served.",
+        "# TYPE requests counter",
+        'requests_total{route="/analyze"} 3',
+        'requests_total{route="/odd\\"route\\n"} 1',
+    ]
+
+
+def test_histograms_are_cumulative(registry):
+    latency = metrics.Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value)
+
+    lines = metrics.render().splitlines()
+
+    assert lines[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_count 4",
+        "latency_seconds_sum 6.05",
+    ]
+
+
+def test_histogram_timer_records_the_block(registry):
+    latency = metrics.Histogram("block_seconds", "Block.", ("name",))
+
+    with latency.time("sleep"):
+        pass
+
+    assert 'block_seconds_count{name="sleep"} 1' in metrics.render()
+
+
+def test_counts_of_finished_threads_are_kept(registry):
+    counter = metrics.Counter("work", "Work done.")
+
+    def work():
+        for _ in range(1000):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc()
+
+    assert counter.labels().get() == 8001
+
+
+def test_callbacks_are_read_at_render_time(registry):
+    depth = {"value": 1}
+    metrics.Callback("queue_depth", "Queued items.", lambda: depth["value"])
+    hits = {("dns",): 5, ("score",): 0.5}
+    metrics.Callback("cache_hits", "Cache hits.", lambda: hits, ("cache",), "counter")
+
+    depth["value"] = 7
+    text = metrics.render()
+
+    assert "# TYPE queue_depth gauge\nqueue_depth 7\n" in text
+    assert '# TYPE cache_hits counter\ncache_hits{cache="dns"} 5\n' in text
+    assert 'cache_hits{cache="score"} 0.5\n' in text
+
+
+def test_a_failing_callback_skips_only_its_metric(registry):
+    metrics.Callback("broken", "Fails.", lambda: 1 / 0)
+    metrics.Counter("fine", "Works.").inc()
+
+    text = metrics.render()
+
+    assert "broken" not in text
+    assert "fine_total 1" in text
+
+
+def test_the_api_serves_all_metrics(api_client):
+    response = api_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert "# TYPE api_request_seconds histogram" in response.get_data(as_text=True)
@@ -0,0 +1,122 @@
+import httpx
+import pytest
+
+from server.controller import scrape
+from server.controller.budget import ScanBudget
+from server.data import exceptions
+from server.scan import initialization
+
+_CLIENT = httpx.Client
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+    """Let every scraping attempt fail with the error in errors[0]."""
+
+    calls = []
+    errors = [exceptions.NotReachableError("offline")]
+
+    def start(self):
+        calls.append(self.ctx.domain)
+        raise errors[0]
+
+    monkeypatch.setattr(scrape.WebScraper, "start", start)
+    scrape.NEGATIVE_CACHE.clear()
+    yield calls, errors
+    scrape.NEGATIVE_CACHE.clear()
+
+
+def test_each_verdict_has_its_own_ttl():
+    assert scrape.negative_ttl(exceptions.NotReachableError()) == 300
+    assert scrape.negative_ttl(exceptions.CloudflareFlaggedError()) == 86400
+    assert scrape.negative_ttl(exceptions.SeleniumError()) is None
+
+
+def test_subclasses_inherit_the_ttl_of_their_base():
+    class Parked(exceptions.NotReachableError):
+        pass
+
+    assert scrape.negative_ttl(Parked()) == 300
+
+
+def test_failed_domain_is_not_scraped_again(attempts):
+    calls, _ = attempts
+
+    first = scrape.WebScraper("Shop.test.")
+    second = scrape.WebScraper("shop.test")
+
+    assert calls == ["Shop.test."]
+    assert not first.success and not second.success
+    assert second.error is first.error
+    assert scrape.NEGATIVE_CACHE.stats()["hits"] == 1
+
+
+def test_uncached_errors_are_retried(attempts):
+    calls, errors = attempts
+    errors[0] = exceptions.SeleniumError("driver crashed")
+
+    scrape.WebScraper("shop.test")
+    scrape.WebScraper("shop.test")
+
+    assert calls == ["shop.test", "shop.test"]
+
+
+def test_budget_errors_are_not_cached(attempts):
+    calls, errors = attempts
+    errors[0] = exceptions.BudgetExceededError("out of time")
+
+    scrape.WebScraper("shop.test")
+    scrape.WebScraper("shop.test")
+
+    assert len(calls) == 2
+    assert len(scrape.NEGATIVE_CACHE) == 0
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Let every request of the probe and the scraper fail to connect."""
+
+    calls = []
+
+    def client(verify=True):
+        def refuse(request):
+            calls.append(request.method)
+            raise httpx.ConnectError("timed out")
+
+        return _CLIENT(transport=httpx.MockTransport(refuse))
+
+    monkeypatch.setattr(initialization.httpx, "Client", client)
+    monkeypatch.setattr(scrape.httpx, "Client", client)
+    initialization.PROBE_CACHE.clear()
+    scrape.NEGATIVE_CACHE.clear()
+    yield calls
+    initialization.PROBE_CACHE.clear()
+    scrape.NEGATIVE_CACHE.clear()
+
+
+def test_failures_within_a_shortened_timeout_are_not_cached(offline):
+    budget = ScanBudget(max_seconds=1)
+
+    scraper = scrape.WebScraper("slow-shop.test", budget=budget)
+
+    assert isinstance(scraper.error, exceptions.BudgetExceededError)
+    assert "slow-shop.test" in budget.skipped
+    assert len(scrape.NEGATIVE_CACHE) == 0
+
+    # A scan with the full timeouts tries again and caches its verdict.
+    sent = len(offline)
+    scraper = scrape.WebScraper("slow-shop.test")
+    assert isinstance(scraper.error, exceptions.NotReachableError)
+    assert len(offline) > sent and "slow-shop.test" in scrape.NEGATIVE_CACHE
+
+
+def test_get_failing_within_a_shortened_timeout_is_not_cached(offline):
+    probe = initialization.ProbeResult("slow-shop.test")
+    probe.reachable, probe.protocol, probe.status_code = True, "https://", 200
+    initialization.PROBE_CACHE.set("slow-shop.test", probe)
+
+    scraper = scrape.WebScraper("slow-shop.test", budget=ScanBudget(max_seconds=1))
+
+    assert isinstance(scraper.error, exceptions.BudgetExceededError)
+    assert offline == ["GET", "GET"]
+    assert len(scrape.NEGATIVE_CACHE) == 0
@@ -0,0 +1,86 @@
+import sqlite3
+import time
+
+import pytest
+
+from server.api import api
+from server.utils import ratelimit
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def buckets(request, tmp_path):
+    if request.param == "memory":
+        return ratelimit.MemoryBuckets(shards=4, max_clients=100)
+    return ratelimit.SQLiteBuckets(str(tmp_path / "buckets.sqlite3"))
+
+
+def test_a_client_gets_its_burst_then_waits(buckets):
+    limiter = ratelimit.ClientLimiter(rate=0.5, burst=3, store=buckets)
+
+    results = [limiter.check("client") for _ in range(4)]
+
+    assert [allowed for allowed, _ in results] == [True, True, True, False]
+    assert results[0][1] == {
+        "RateLimit-Limit": "3",
+        "RateLimit-Remaining": "2",
+        "RateLimit-Reset": "2",
+    }
+    assert results[-1][1]["Retry-After"] == "2"
+    assert limiter.stats() == {"allowed": 3, "limited": 1}
+
+
+def test_clients_have_their_own_buckets(buckets):
+    limiter = ratelimit.ClientLimiter(rate=0.001, burst=1, store=buckets)
+
+    assert limiter.check("ip:1.2.3.4")[0]
+    assert not limiter.check("ip:1.2.3.4")[0]
+    assert limiter.check("user:42")[0]
+
+
+def test_buckets_refill_over_time(buckets):
+    limiter = ratelimit.ClientLimiter(rate=1000, burst=1, store=buckets)
+
+    assert limiter.check("client")[0]
+    # 1000 tokens per second: the next request a few ms later passes.
+    time.sleep(0.01)
+    assert limiter.check("client")[0]
+
+
+def test_the_sqlite_buckets_are_shared_by_processes(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    worker_1 = ratelimit.ClientLimiter(rate=0.001, burst=2, store=ratelimit.SQLiteBuckets(path))
+    worker_2 = ratelimit.ClientLimiter(rate=0.001, burst=2, store=ratelimit.SQLiteBuckets(path))
+
+    assert worker_1.check("client")[0]
+    assert worker_2.check("client")[0]
+    assert not worker_1.check("client")[0]
+
+
+def test_a_broken_store_does_not_block_the_api():
+    class Broken:
+        def take(self, *args):
+            raise sqlite3.OperationalError("database is locked")
+
+    limiter = ratelimit.ClientLimiter(rate=1, burst=1, store=Broken())
+
+    assert limiter.check("client") == (True, {})
+
+
+def test_idle_clients_are_forgotten():
+    buckets = ratelimit.MemoryBuckets(shards=1, max_clients=10)
+
+    for i in range(25):
+        buckets.take(f"client-{i}", rate=0.001, capacity=1)
+
+    assert len(buckets._buckets[0]) <= 10
+
+
+def test_the_api_answers_429_over_the_limit(api_client, monkeypatch):
+    monkeypatch.setattr(api, "LIMITER", ratelimit.ClientLimiter(rate=0.001, burst=1))
+
+    assert api_client.post("/analyze/stream", json={}).status_code == 400
+    response = api_client.post("/analyze/stream", json={})
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert response.headers["RateLimit-Remaining"] == "0"
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from server.api import api
+from server.controller import controller
+
+
+@pytest.fixture
+def cold_api(monkeypatch):
+    """The API of a process that has not warmed up yet."""
+
+    monkeypatch.setattr(api, "READY", threading.Event())
+    monkeypatch.setattr(api, "WARMUP", {})
+    monkeypatch.setattr(api, "_WARMUP_THREAD", None)
+    monkeypatch.setattr(api, "_WARMUP_SCHEDULED", False)
+    return api.app.test_client()
+
+
+def test_first_request_warms_up_when_the_server_did_not(cold_api, monkeypatch):
+    calls = []
+    monkeypatch.setattr(controller, "warm_up", lambda: calls.append(1) or (True, {"model": {}}))
+
+    first = cold_api.get("/metrics")
+    second = cold_api.get("/metrics")
+
+    assert (first.status_code, second.status_code) == (200, 200)
+    assert calls == [1]
+    assert cold_api.get("/readyz").status_code == 200
+
+
+def test_scheduled_warm_up_is_not_waited_for(cold_api, monkeypatch):
+    release = threading.Event()
+
+    def warm_up():
+        release.wait(5)
+        return True, {}
+
+    monkeypatch.setattr(controller, "warm_up", warm_up)
+
+    thread = api.start_warm_up()
+    assert api.start_warm_up(scheduled=False) is thread
+
+    response = cold_api.get("/metrics")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert cold_api.get("/healthz").status_code == 200
+
+    release.set()
+    thread.join(5)
+    assert cold_api.get("/metrics").status_code == 200
+
+
+def test_failed_warm_up_keeps_the_gate_closed(cold_api, monkeypatch):
+    calls = []
+    monkeypatch.setattr(controller, "warm_up", lambda: calls.append(1) or (False, {}))
+
+    assert cold_api.get("/metrics").status_code == 503
+    assert cold_api.get("/metrics").status_code == 503
+    assert calls == [1]
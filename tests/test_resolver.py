@@ -0,0 +1,148 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from server import const
+from server.controller import controller
+from server.utils import resolver
+
+
+class Answer:
+    def __init__(self, addresses, ttl):
+        self._rdata = [type("Rdata", (), {"to_text": lambda self, a=a: a})() for a in addresses]
+        self.rrset = type("RRset", (), {"ttl": ttl})()
+
+    def __iter__(self):
+        return iter(self._rdata)
+
+
+@pytest.fixture
+def dns_queries(monkeypatch, tmp_path):
+    """Answer A queries with 192.0.2.1 (TTL 120) and count the queries."""
+
+    queries = []
+
+    def resolve(host, rdtype, lifetime=None):
+        queries.append((host, rdtype))
+        if rdtype == "A" and host.endswith(".test"):
+            return Answer(["192.0.2.1"], 120)
+        raise resolver.dns.resolver.NoAnswer()
+
+    hosts = tmp_path / "hosts"
+    hosts.write_text("127.0.0.1 localhost\n10.0.0.5 intranet.test intranet  # office\n")
+    monkeypatch.setattr(const, "DNS_HOSTS_FILE", str(hosts))
+    monkeypatch.setattr(resolver.dns.resolver, "resolve", resolve)
+    return queries
+
+
+def test_records_are_cached_for_their_ttl(dns_queries):
+    dns = resolver.CachingResolver()
+
+    assert dns.resolve("shop.test") == ["192.0.2.1"]
+    assert dns.resolve("SHOP.test.") == ["192.0.2.1"]
+
+    assert dns_queries == [("shop.test", "A"), ("shop.test", "AAAA")]
+    expires = dns.cache._data["shop.test"][0]
+    assert 119 < expires - time.monotonic() <= 120
+    assert dns.stats()["hits"] == 1
+
+
+def test_hosts_file_names_are_left_to_the_system(dns_queries, monkeypatch):
+    system = []
+
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        system.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.0.0.5", port or 0))]
+
+    monkeypatch.setattr(resolver, "_SYSTEM_GETADDRINFO", getaddrinfo)
+    dns = resolver.CachingResolver()
+
+    assert dns.resolve("intranet.test") == ["10.0.0.5"]
+    assert dns.getaddrinfo("Intranet", 443)[0][4] == ("10.0.0.5", 443)
+    assert dns_queries == []
+    assert system == ["intranet.test", "Intranet"]
+
+
+def test_concurrent_lookups_are_coalesced(dns_queries, monkeypatch):
+    release = threading.Event()
+    query = resolver.CachingResolver._query
+
+    def slow_query(host):
+        release.wait(5)
+        return query(host)
+
+    monkeypatch.setattr(resolver.CachingResolver, "_query", staticmethod(slow_query))
+    dns = resolver.CachingResolver()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(dns.resolve("shop.test")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [["192.0.2.1"]] * 5
+    assert dns.stats()["misses"] == 1
+    assert dns.stats()["coalesced"] == 4
+
+
+def test_failed_lookups_are_cached(dns_queries, monkeypatch):
+    def getaddrinfo(*args, **kwargs):
+        raise socket.gaierror(socket.EAI_NONAME, "unknown")
+
+    monkeypatch.setattr(resolver, "_SYSTEM_GETADDRINFO", getaddrinfo)
+    dns = resolver.CachingResolver()
+
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            dns.resolve("missing.invalid")
+
+    assert len(dns_queries) == 2
+    assert dns.stats()["hits"] == 1
+
+
+def test_prefetch_queue_is_bounded(dns_queries, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(const, "DNS_PREFETCH_QUEUE", 2)
+    dns = resolver.CachingResolver()
+    monkeypatch.setattr(dns, "resolve", lambda host: release.wait(5))
+
+    for i in range(5):
+        dns.prefetch(f"shop{i}.test")
+    release.set()
+    dns._executor.shutdown(wait=True)
+
+    assert dns.stats()["dropped"] == 3
+
+
+def test_prefetch_skips_cached_hosts(dns_queries):
+    dns = resolver.CachingResolver()
+    dns.resolve("shop.test")
+
+    dns.prefetch("shop.test")
+    dns._executor.shutdown(wait=True)
+
+    assert len(dns_queries) == 2
+
+
+def test_analyze_prefetches_only_on_a_store_miss(monkeypatch):
+    prefetched = []
+    monkeypatch.setattr(resolver, "prefetch", prefetched.append)
+    monkeypatch.setattr(const, "JOB_QUEUE", False)
+    monkeypatch.setattr(const, "FAST_PATH", False)
+    monkeypatch.setattr(controller, "scan", lambda domain, host=None: None)
+
+    monkeypatch.setattr(controller, "lookup", lambda domain: {"domain": domain, "score": 15})
+    controller.analyze("https://known.test")
+    assert prefetched == []
+
+    monkeypatch.setattr(controller, "lookup", lambda domain, host=None: None)
+    controller.analyze("https://new.test")
+    assert prefetched == ["new.test"]
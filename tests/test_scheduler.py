@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import const
+from server.controller import scheduler
+from server.secrets import secrets
+
+
+@pytest.fixture
+def refresh(monkeypatch, store):
+    """A scheduler on a fake store, recording the refreshed domains."""
+
+    refreshed = []
+    monkeypatch.setattr(scheduler, "STORE", store)
+    monkeypatch.setattr(store, "refresh", lambda domain, compute: refreshed.append(domain) or 1)
+    monkeypatch.setattr(const, "REFRESH_RATE", 1000)
+
+    sched = scheduler.RefreshScheduler()
+    sched._compute = lambda domain: None
+    return sched, store, refreshed
+
+
+def add(store, domain, expires_in_hours, hits=0):
+    age = timedelta(days=secrets.DB_RETENTION) - timedelta(hours=expires_in_hours)
+    store.db.entries[domain] = {
+        "domain": domain,
+        "score": 9,
+        "hits": hits,
+        "updated_at": datetime.now() - age,
+    }
+
+
+def test_request_counts_are_stored_in_the_database(refresh):
+    sched, store, _ = refresh
+    add(store, "shop.test", 200)
+    for _ in range(3):
+        sched.touch("shop.test")
+    sched.touch("unknown.test")
+
+    assert sched.flush() == 2
+    assert store.db.entries["shop.test"]["hits"] == 3
+    assert sched.stats()["tracked"] == 0
+
+
+def test_popular_entries_close_to_expiry_are_refreshed_first(refresh):
+    sched, store, refreshed = refresh
+    add(store, "popular.test", expires_in_hours=10, hits=50)
+    add(store, "sooner.test", expires_in_hours=1, hits=20)
+    add(store, "rare.test", expires_in_hours=1, hits=1)
+    add(store, "fresh.test", expires_in_hours=200, hits=500)
+
+    assert sched.run_once() == 2
+    assert refreshed == ["sooner.test", "popular.test"]
+    assert sched.stats()["leader"]
+
+
+def test_only_the_lease_holder_refreshes(refresh):
+    sched, store, refreshed = refresh
+    add(store, "shop.test", expires_in_hours=1, hits=10)
+    store.db.leases[const.REFRESH_LEASE] = "other-worker"
+    sched.touch("shop.test")
+
+    assert sched.run_once() == 0
+    assert refreshed == []
+    assert not sched.stats()["leader"]
+    # Its requests still count for the lease holder.
+    assert store.db.entries["shop.test"]["hits"] == 11
+
+
+def test_request_counts_decay_each_round(refresh):
+    sched, store, _ = refresh
+    add(store, "shop.test", expires_in_hours=200, hits=8)
+
+    sched.run_once()
+
+    factor = 0.5 ** (const.REFRESH_INTERVAL / const.REFRESH_HALF_LIFE)
+    assert store.db.entries["shop.test"]["hits"] == pytest.approx(8 * factor)
+
+
+def test_candidates_do_not_count_as_store_lookups(refresh):
+    sched, store, _ = refresh
+    add(store, "shop.test", expires_in_hours=1, hits=10)
+
+    assert [domain for _, domain in sched.candidates()] == ["shop.test"]
+    assert store.stats()["memory"]["hits"] + store.stats()["memory"]["misses"] == 0
+    assert store.stats()["database"]["hits"] == 0
+
+
+def test_pending_domains_are_bounded(monkeypatch, refresh):
+    sched, _, _ = refresh
+    monkeypatch.setattr(const, "REFRESH_TRACKED", 2)
+
+    for domain in ("a.test", "b.test", "c.test", "a.test"):
+        sched.touch(domain)
+
+    assert sched._hits == {"a.test": 2, "b.test": 1}
@@ -0,0 +1,80 @@
+import httpx
+import pytest
+
+from server.controller import scrape
+from server.data import exceptions
+
+
+def client(body_chunks, served):
+    def handler(request):
+        def stream():
+            for chunk in body_chunks:
+                served.append(len(chunk))
+                yield chunk
+
+        return httpx.Response(200, content=stream(), headers={"Content-Type": "text/html"})
+
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_body_is_cut_at_the_size_limit():
+    served = []
+    chunks = [b"a" * 4096] * 100
+
+    with client(chunks, served) as c:
+        response = scrape.fetch(c, "GET", "https://shop.test/", max_body_size=10000)
+
+    assert response.content == b"a" * 10000
+    assert response.truncated and not response.challenge
+    assert len(served) < 100
+
+
+def test_challenge_page_stops_the_download():
+    served = []
+    page = b"<html><head><title>Just a moment...</title>" + b" " * 4096
+    chunks = [page] + [b"b" * 4096] * 50
+
+    with client(chunks, served) as c:
+        response = scrape.fetch(c, "GET", "https://shop.test/", max_body_size=10**6)
+
+    assert response.challenge and not response.truncated
+    assert len(served) < 50
+
+
+def test_phishing_warning_raises():
+    page = b"<title>Suspected phishing site | Cloudflare</title>" + b" " * 4096
+
+    with client([page], []) as c:
+        with pytest.raises(exceptions.CloudflareFlaggedError):
+            scrape.fetch(c, "GET", "https://shop.test/")
+
+
+def test_small_bodies_are_checked_as_well():
+    body, truncated, challenge = scrape._read_body(
+        [b"<title>Attention Required! | Cloudflare</title>"], 1000, "https://shop.test/"
+    )
+
+    assert challenge and not truncated
+
+
+class Streamed:
+    url = "https://shop.test/"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+def test_requests_responses_are_capped_and_closed():
+    response = Streamed([b"x" * 3000] * 10)
+
+    scrape.read_capped(response, max_body_size=5000)
+
+    assert response._content == b"x" * 5000
+    assert response.truncated and response.closed
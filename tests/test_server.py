@@ -0,0 +1,26 @@
+from server import server
+from server.controller import scrape
+from server.model import ai, fast
+
+
+def test_preload_leaves_the_ai_model_to_the_workers(monkeypatch):
+    def load():
+        raise AssertionError("TensorFlow must not be loaded before fork()")
+
+    monkeypatch.setattr(ai, "load", load)
+
+    server.preload()
+
+    assert fast.load()["samples"] > 0
+    assert server.controller.known_scores()
+    assert scrape.user_agents.cache_info().currsize == 1
+
+
+def test_workers_load_the_ai_model_in_their_warm_up(monkeypatch):
+    warmed = []
+    monkeypatch.setattr(server.api, "start_warm_up", lambda: warmed.append(True))
+
+    server._post_worker_init(worker=None)
+
+    assert warmed == [True]
+
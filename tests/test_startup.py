@@ -0,0 +1,10 @@
+from server import const
+from server.utils import startup
+
+
+def test_entry_point_imports_within_budget():
+    total, imports = startup.measure(const.STARTUP_MODULE)
+
+    slowest = sorted(imports, reverse=True, key=lambda item: item[1])[1:6]
+    assert total <= const.STARTUP_BUDGET_MS, f"{total:.0f} ms, slowest: {slowest}"
+    assert any(name.strip() == const.STARTUP_MODULE for _, _, name in imports)
@@ -0,0 +1,97 @@
+import threading
+from datetime import datetime, timedelta
+
+from server.secrets import secrets
+
+
+def entry(domain, age_days=0):
+    return {
+        "domain": domain,
+        "score": 12,
+        "updated_at": datetime.now() - timedelta(days=age_days),
+    }
+
+
+def test_lookups_go_to_memory_before_the_database(store):
+    store.db.entries["shop.test"] = entry("shop.test")
+
+    first, stale = store.get("shop.test")
+    second, _ = store.get("shop.test")
+
+    assert first["score"] == 12 and not stale
+    assert second is first
+    assert store.db.reads == 1
+    assert store.stats()["database"]["hits"] == 1
+    assert store.stats()["memory"]["hits"] == 1
+
+
+def test_misses_are_counted_and_not_cached(store):
+    assert store.get("new.test") == (None, False)
+    assert store.get("new.test") == (None, False)
+
+    assert store.db.reads == 2
+    assert store.stats()["database"]["misses"] == 2
+
+
+def test_old_entries_are_served_as_stale(store):
+    store.db.entries["old.test"] = entry("old.test", age_days=secrets.DB_RETENTION + 1)
+
+    found, stale = store.get("old.test")
+
+    assert found["score"] == 12 and stale
+
+
+def test_put_inserts_then_updates(store):
+    first = store.put({"domain": "shop.test", "score": 3})
+    created = first["created_at"]
+    store.put({"domain": "shop.test", "score": 5})
+
+    assert store.db.entries["shop.test"]["score"] == 5
+    assert store.db.entries["shop.test"]["created_at"] == created
+    assert store.get("shop.test")[0]["score"] == 5
+    # One upsert per write, no read before it.
+    assert store.db.reads == 0
+
+
+def test_store_keeps_working_without_the_database(store):
+    store.db.down = True
+
+    stored = store.put({"domain": "shop.test", "score": 7})
+    found, stale = store.get("shop.test")
+
+    assert found is stored and found["updated_at"] and not stale
+    assert store.get("other.test") == (None, False)
+
+
+def test_only_one_refresh_per_domain_runs(store):
+    release = threading.Event()
+    done = threading.Event()
+    calls = []
+
+    def compute(domain):
+        calls.append(domain)
+        release.wait(5)
+        done.set()
+        return {"domain": domain}
+
+    assert store.refresh("shop.test", compute)
+    assert not store.refresh("shop.test", compute)
+    release.set()
+    done.wait(5)
+    store._executor.shutdown(wait=True)
+
+    assert calls == ["shop.test"]
+    assert store.stats()["refreshes"] == 1
+
+
+def test_warm_loads_the_most_requested_entries_first(store):
+    for domain, hits, age in (("a.test", 0, 0), ("b.test", 5, 3), ("c.test", 9, 2)):
+        store.db.entries[domain] = {**entry(domain, age_days=age), "hits": hits}
+
+    assert store.warm(2) == 2
+    assert store.memory.get("a.test") is None
+    assert store.memory.get("b.test") and store.memory.get("c.test")
+
+    # Too few requested entries: the most recent fill up the rest.
+    assert store.warm(3) == 3
+    assert store.memory.get("a.test") is not None
@@ -0,0 +1,92 @@
+import json
+import threading
+
+import pytest
+
+from server import const
+from server.controller import controller
+
+
+@pytest.fixture
+def unknown_domain(monkeypatch):
+    """An unknown domain, whose scan reports two sources."""
+
+    def scan(domain, progress=None, host=None):
+        progress("domain_url", "done")
+        progress("trustpilot", "failed")
+        return {"domain": domain, "score": 12}
+
+    monkeypatch.setattr(controller, "lookup", lambda domain: None)
+    monkeypatch.setattr(controller.resolver, "prefetch", lambda host: None)
+    monkeypatch.setattr(controller, "scan", scan)
+    monkeypatch.setattr(controller.fast, "predict", lambda domain: 0.95)
+
+
+def events(body):
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((lines.get("event"), json.loads(lines["data"]) if "data" in lines else None))
+    return parsed
+
+
+def test_known_domains_are_answered_at_once(monkeypatch):
+    monkeypatch.setattr(controller, "lookup", lambda domain: {"domain": domain, "score": 15})
+
+    assert list(controller.analyze_stream("www.shop.test")) == [
+        ("final", {"domain": "shop.test", "score": 15})
+    ]
+
+
+def test_the_scan_is_reported_step_by_step(unknown_domain):
+    messages = list(controller.analyze_stream("https://shop.test/"))
+
+    assert [event for event, _ in messages] == ["provisional", "source", "source", "final"]
+    assert messages[0][1]["provisional"] is True
+    assert messages[1][1] == {"source": "domain_url", "status": "done"}
+    assert messages[-1][1]["score"] == 12 and messages[-1][1]["provisional"] is False
+
+
+def test_failed_scans_end_with_an_unknown_score(monkeypatch, unknown_domain):
+    def scan(domain, progress=None, host=None):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(controller, "scan", scan)
+
+    event, data = list(controller.analyze_stream("shop.test"))[-1]
+
+    assert event == "final" and data == controller.unknown("shop.test")
+
+
+def test_silence_is_filled_with_heartbeats(monkeypatch, unknown_domain):
+    release = threading.Event()
+
+    def scan(domain, progress=None, host=None):
+        release.wait(5)
+        return None
+
+    monkeypatch.setattr(controller, "scan", scan)
+    monkeypatch.setattr(const, "STREAM_HEARTBEAT", 0.01)
+
+    stream = controller.analyze_stream("shop.test")
+    assert next(stream)[0] == "provisional"
+    assert next(stream) is None
+    release.set()
+    assert [message for message in stream if message is not None][-1][0] == "final"
+
+
+def test_the_api_sends_server_sent_events(api_client, unknown_domain):
+    response = api_client.get("/analyze/stream?domain=shop.test")
+
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert [event for event, _ in events(response.get_data(as_text=True))] == [
+        "provisional",
+        "source",
+        "source",
+        "final",
+    ]
+
+
+def test_the_api_needs_a_domain(api_client):
+    assert api_client.post("/analyze/stream", json={}).status_code == 400
@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+
+from server import const
+from server.api import api
+from server.utils import trace
+
+
+@pytest.fixture(autouse=True)
+def traces(monkeypatch):
+    monkeypatch.setattr(trace, "TRACES", trace.deque(maxlen=const.TRACE_BUFFER_SIZE))
+    monkeypatch.setattr(const, "TRACE_SAMPLE", 1.0)
+    return trace.TRACES
+
+
+@trace.traced("scan", root=True)
+def scan(domain):
+    with trace.span("group.whois"):
+        lookup(domain)
+    return 12
+
+
+@trace.traced()
+def lookup(domain):
+    raise_if_bad(domain)
+
+
+def raise_if_bad(domain):
+    if domain == "bad.test":
+        raise ValueError("bad domain")
+
+
+def test_spans_nest_under_their_trace(traces):
+    assert scan("shop.test") == 12
+
+    (recorded,) = trace.recent()
+    data = recorded.to_dict()
+
+    assert data["name"] == "scan" and data["attrs"] == {"domain": "shop.test"}
+    assert [(s["name"], s["parent"]) for s in data["spans"]] == [
+        ("scan", None),
+        ("group.whois", 0),
+        ("test_trace.lookup", 1),
+    ]
+    assert all(s["duration"] is not None for s in data["spans"])
+
+
+def test_errors_are_recorded_and_raised(traces):
+    with pytest.raises(ValueError):
+        scan("bad.test")
+
+    spans = trace.recent()[0].to_dict()["spans"]
+    assert [s["error"] for s in spans] == ["ValueError: bad domain"] * 3
+
+
+def test_nothing_is_recorded_outside_of_a_trace(traces):
+    lookup("shop.test")
+    with trace.span("orphan") as current:
+        assert current is None
+
+    assert trace.recent() == []
+
+
+def test_sampling_and_the_switch(monkeypatch, traces):
+    monkeypatch.setattr(const, "TRACE_SAMPLE", 0.0)
+    scan("shop.test")
+    monkeypatch.setattr(const, "TRACE_SAMPLE", 1.0)
+    monkeypatch.setattr(const, "TRACE_ENABLED", False)
+    scan("shop.test")
+
+    assert trace.recent() == []
+
+
+def test_spans_per_trace_are_bounded(monkeypatch, traces):
+    monkeypatch.setattr(const, "TRACE_MAX_SPANS", 2)
+
+    scan("shop.test")
+
+    assert len(trace.recent()[0].spans) == 2
+
+
+def test_chrome_export():
+    scan("shop.test")
+
+    events = trace.to_chrome(trace.recent())["traceEvents"]
+
+    assert [event["name"] for event in events] == ["scan", "group.whois", "test_trace.lookup"]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert events[0]["args"] == {"trace": trace.recent()[0].id, "domain": "shop.test"}
+
+
+def test_traces_need_a_token(api_client):
+    scan("secret-shop.test")
+
+    response = api_client.get("/debug/traces")
+
+    assert response.status_code == 401
+    assert b"secret-shop.test" not in response.data
+
+
+def test_traces_are_served_with_a_token(api_client):
+    scan("shop.test")
+    headers = {"Authorization": f"Bearer {api.generate_token('admin')}"}
+
+    response = api_client.get("/debug/traces?limit=1", headers=headers)
+    chrome = api_client.get("/debug/traces?format=chrome", headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()["traces"][0]["attrs"] == {"domain": "shop.test"}
+    assert "traceEvents" in chrome.get_json()
+    assert api_client.get("/debug/traces?limit=x", headers=headers).status_code == 400
+
+
+def test_recent_while_requests_add_traces():
+    stop = threading.Event()
+
+    def requests():
+        while not stop.is_set():
+            scan("shop.test")
+
+    writers = [threading.Thread(target=requests) for _ in range(4)]
+    for writer in writers:
+        writer.start()
+    try:
+        for _ in range(2000):
+            trace.recent(limit=10)
+    finally:
+        stop.set()
+        for writer in writers:
+            writer.join()
+
+    assert len(trace.recent()) == const.TRACE_BUFFER_SIZE